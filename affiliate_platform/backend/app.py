@@ -1,15 +1,35 @@
 """
 Главное Flask приложение для партнёрской платформы
 """
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, abort, stream_with_context
 from flask_cors import CORS
-from flask_mail import Mail, Message
 from datetime import datetime, timedelta
+import click
+import hashlib
+import hmac
 import jwt
 import os
+import secrets
+import tempfile
 from functools import wraps
-
-from .models import db, User, Offer, AffiliateLink, Click, Conversion, Payout, PasswordReset
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from .models import db, utcnow, Money, User, Offer, AffiliateLink, Click, Conversion, Payout, LedgerEntry, PasswordReset
+from . import (
+    conversion_import, exports, ledger, migrations, pagination, partitions, rollups, search, serializers, sketches,
+    stats
+)
+from .auth_cache import AuthCache
+from .catalog import CatalogCache, CatalogVersion
+from .click_dedup import ClickDeduplicator
+from .click_writer import ClickWriter
+from .link_cache import TrackingCache
+from .mail_outbox import MailOutbox
+from .password_hasher import HasherBusy, PasswordHasher
+from .sqlite_tuning import SQLiteTuning
 
 app = Flask(__name__,
             template_folder='../frontend/templates',
@@ -18,9 +38,105 @@ app = Flask(__name__,
 # Конфигурация
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(BASE_DIR, "affiliate_platform", "database", "affiliate.db")}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# База данных: DATABASE_URL (PostgreSQL в production) или локальный файл SQLite
+database_url = os.environ.get(
+    'DATABASE_URL',
+    f'sqlite:///{os.path.join(BASE_DIR, "affiliate_platform", "database", "affiliate.db")}'
+)
+if database_url.startswith('postgres://'):
+    # Railway/Heroku отдают устаревшую схему, SQLAlchemy 2 её не принимает
+    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+
+# Пул соединений на каждый воркер gunicorn (всего: воркеры * (pool_size + max_overflow))
+if not database_url.startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    }
+
+# Профиль SQLite (применяется к каждому соединению)
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+app.config['SQLITE_CACHE_SIZE'] = int(os.environ.get('SQLITE_CACHE_SIZE', -20000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+app.config['SQLITE_TEMP_STORE'] = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+app.config['SQLITE_CHECKPOINT_INTERVAL'] = int(os.environ.get('SQLITE_CHECKPOINT_INTERVAL', 60))
+
+# Блокировка, под которой процессы одной машины применяют миграции по очереди
+app.config['MIGRATIONS_LOCK_FILE'] = os.environ.get(
+    'MIGRATIONS_LOCK_FILE',
+    os.path.join(tempfile.gettempdir(), 'affiliate_migrations.lock')
+)
+
+# Буферизованная запись кликов
+app.config['CLICK_WRITE_BEHIND'] = os.environ.get('CLICK_WRITE_BEHIND', 'true').lower() == 'true'
+app.config['CLICK_BATCH_SIZE'] = int(os.environ.get('CLICK_BATCH_SIZE', 200))
+app.config['CLICK_FLUSH_INTERVAL'] = float(os.environ.get('CLICK_FLUSH_INTERVAL', 1.0))
+app.config['CLICK_QUEUE_MAX'] = int(os.environ.get('CLICK_QUEUE_MAX', 10000))
+
+# Повторные клики (тот же ip, user_agent и ссылка в окне): flag, skip или off
+app.config['CLICK_DEDUP_MODE'] = os.environ.get('CLICK_DEDUP_MODE', 'flag').lower()
+app.config['CLICK_DEDUP_WINDOW'] = float(os.environ.get('CLICK_DEDUP_WINDOW', 300))
+app.config['CLICK_DEDUP_CAPACITY'] = int(os.environ.get('CLICK_DEDUP_CAPACITY', 100000))
+
+# Архивация кликов (flask rollover-clicks): сколько последних месяцев остаётся
+# в горячей таблице clicks и делать ли VACUUM после переноса
+app.config['CLICK_HOT_MONTHS'] = int(os.environ.get('CLICK_HOT_MONTHS', 1))
+app.config['CLICK_ROLLOVER_COMPACT'] = os.environ.get('CLICK_ROLLOVER_COMPACT', 'true').lower() == 'true'
+
+# Кеш разрешения tracking_code
+app.config['TRACKING_CACHE_SIZE'] = int(os.environ.get('TRACKING_CACHE_SIZE', 10000))
+app.config['TRACKING_CACHE_TTL'] = int(os.environ.get('TRACKING_CACHE_TTL', 60))
+# Общий для воркеров счётчик: изменение оффера или ссылки сбрасывает кеш во всех
+app.config['TRACKING_VERSION_FILE'] = os.environ.get(
+    'TRACKING_VERSION_FILE',
+    os.path.join(tempfile.gettempdir(), 'affiliate_tracking.version')
+)
+
+# Версия каталога офферов для ETag: файл общий для воркеров на одной машине
+app.config['CATALOG_VERSION_FILE'] = os.environ.get(
+    'CATALOG_VERSION_FILE',
+    os.path.join(tempfile.gettempdir(), 'affiliate_catalog.version')
+)
+app.config['CATALOG_MAX_AGE'] = int(os.environ.get('CATALOG_MAX_AGE', 60))
+app.config['CATALOG_CACHE'] = os.environ.get('CATALOG_CACHE', 'true').lower() == 'true'
+
+# Максимум ссылок в одном запросе POST /api/affiliate-links/bulk
+app.config['LINKS_BULK_MAX'] = int(os.environ.get('LINKS_BULK_MAX', 500))
+# Строк в одной транзакции POST /api/conversions/batch
+app.config['CONVERSION_BATCH_CHUNK'] = int(os.environ.get('CONVERSION_BATCH_CHUNK', 1000))
+# Максимум ids в одном запросе POST /api/conversions/status
+app.config['CONVERSION_STATUS_MAX_IDS'] = int(os.environ.get('CONVERSION_STATUS_MAX_IDS', 10000))
+# Подтверждение конверсий (flask settle-conversions): срок холда в днях и конверсий в транзакции
+app.config['CONVERSION_HOLD_DAYS'] = int(os.environ.get('CONVERSION_HOLD_DAYS', 14))
+app.config['SETTLEMENT_BATCH'] = int(os.environ.get('SETTLEMENT_BATCH', ledger.SETTLE_BATCH))
+
+# Постбэки рекламодателей: имя параметра click_id в URL товара и общий секрет
+app.config['CLICK_ID_PARAM'] = os.environ.get('CLICK_ID_PARAM', 'click_id')
+app.config['POSTBACK_SECRET'] = os.environ.get('POSTBACK_SECRET')
+
+# Кеш проверки JWT и полей доступа пользователя в token_required
+app.config['AUTH_CACHE_SIZE'] = int(os.environ.get('AUTH_CACHE_SIZE', 10000))
+app.config['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 30))
+app.config['AUTH_VERSION_FILE'] = os.environ.get(
+    'AUTH_VERSION_FILE',
+    os.path.join(tempfile.gettempdir(), 'affiliate_auth.version')
+)
+
+# Хеширование паролей: параметры KDF и ограниченный пул на воркер
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE_MAX'] = int(os.environ.get('PASSWORD_HASH_QUEUE_MAX', 16))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+app.config['PASSWORD_HASH_RETRY_AFTER'] = int(os.environ.get('PASSWORD_HASH_RETRY_AFTER', 1))
+
 # Email конфигурация
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
@@ -28,21 +144,40 @@ app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == '
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@affiliatebridge.com')
+# Письма уходят из очереди email_outbox фоновым потоком; по умолчанию
+# отправка включена, если заданы логин и пароль SMTP
+app.config['MAIL_ENABLED'] = os.environ.get(
+    'MAIL_ENABLED', str(bool(app.config['MAIL_USERNAME'] and app.config['MAIL_PASSWORD']))
+).lower() == 'true'
+app.config['MAIL_TIMEOUT'] = float(os.environ.get('MAIL_TIMEOUT', 10))
+app.config['MAIL_OUTBOX_INTERVAL'] = float(os.environ.get('MAIL_OUTBOX_INTERVAL', 5))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.environ.get('MAIL_MAX_ATTEMPTS', 5))
 
 # Инициализация расширений
 db.init_app(app)
+sqlite_tuning = SQLiteTuning(app)
 CORS(app)
-mail = Mail(app)
+click_writer = ClickWriter(app)
+click_dedup = ClickDeduplicator(app)
+tracking_cache = TrackingCache(app)
+catalog_version = CatalogVersion(app)
+catalog_cache = CatalogCache(catalog_version, app)
+auth_cache = AuthCache(app)
+password_hasher = PasswordHasher(app)
+mail_outbox = MailOutbox(app)
 
 # Вспомогательные функции
 def send_password_reset_email(user_email, reset_token):
-    """Отправить email с ссылкой для восстановления пароля"""
+    """Поставить в очередь email с ссылкой для восстановления пароля
+
+    Письмо сохраняется в текущей транзакции и уходит после коммита.
+    """
     reset_url = f"{request.host_url.rstrip('/')}/reset-password?token={reset_token}"
 
-    msg = Message(
-        subject='Восстановление пароля - Affiliate Bridge',
-        recipients=[user_email],
-        html=f"""
+    return mail_outbox.enqueue(
+        user_email,
+        'Восстановление пароля - Affiliate Bridge',
+        f"""
         <html>
             <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
                 <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px; text-align: center;">
@@ -91,25 +226,13 @@ def send_password_reset_email(user_email, reset_token):
         """
     )
 
-    try:
-        # Устанавливаем timeout для отправки (5 секунд)
-        import socket
-        default_timeout = socket.getdefaulttimeout()
-        socket.setdefaulttimeout(5)
-
-        mail.send(msg)
-
-        # Возвращаем таймаут обратно
-        socket.setdefaulttimeout(default_timeout)
-        return True
-    except socket.timeout:
-        print(f"Timeout при отправке email на {user_email}")
-        return False
-    except Exception as e:
-        print(f"Ошибка отправки email: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+
+def append_query_param(url, name, value):
+    """Добавить параметр в query string URL (с сохранением остальных и #fragment)"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query.append((name, value))
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
 
 # Middleware для аутентификации
@@ -117,27 +240,35 @@ def token_required(f):
     """Декоратор для проверки JWT токена"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization'].split(' ')[1]
+        token = request.headers.get('Authorization', '').partition(' ')[2]
 
         if not token:
             return jsonify({'error': 'Требуется токен'}), 401
 
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
-            if not current_user:
-                return jsonify({'error': 'Пользователь не найден'}), 401
-        except:
+            current_user = auth_cache.authenticate(token)
+        except jwt.InvalidTokenError:
             return jsonify({'error': 'Неверный токен'}), 401
 
+        if not current_user:
+            return jsonify({'error': 'Пользователь не найден'}), 401
+        if not current_user.is_active:
+            return jsonify({'error': 'Аккаунт деактивирован'}), 403
+
         return f(current_user, *args, **kwargs)
 
     return decorated
 
 
+@app.errorhandler(HasherBusy)
+def password_hasher_busy(e):
+    """Пул хеширования паролей переполнен"""
+    response = jsonify({'error': 'Сервер перегружен, повторите попытку позже'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['PASSWORD_HASH_RETRY_AFTER'])
+    return response
+
+
 # =======================
 # Маршруты для страниц
 # =======================
@@ -209,7 +340,7 @@ def register():
         company_name=data.get('company_name'),
         phone=data.get('phone')
     )
-    user.set_password(data['password'])
+    user.password_hash = password_hasher.hash(data['password'])
 
     db.session.add(user)
     db.session.commit()
@@ -230,9 +361,18 @@ def login():
 
     user = User.query.filter_by(email=data['email']).first()
 
-    if not user or not user.check_password(data['password']):
+    if not user or not password_hasher.verify(user.password_hash, data['password']):
         return jsonify({'error': 'Неверный email или пароль'}), 401
 
+    # Параметры хеширования изменились - пересчитать хеш, пока известен пароль
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = password_hasher.hash(data['password'])
+            db.session.commit()
+            password_hasher.rehashed += 1
+        except HasherBusy:
+            pass
+
     # Генерация JWT токена
     token = jwt.encode({
         'user_id': user.id,
@@ -270,38 +410,28 @@ def request_password_reset():
         password_reset = PasswordReset(
             user_id=user.id,
             reset_token=reset_token,
-            expires_at=datetime.utcnow() + timedelta(hours=24)  # Действителен 24 часа
+            expires_at=utcnow() + timedelta(hours=24)  # Действителен 24 часа
         )
 
         db.session.add(password_reset)
-        db.session.commit()
 
-        # Проверяем настроен ли SMTP перед попыткой отправки
-        smtp_configured = bool(app.config.get('MAIL_USERNAME') and app.config.get('MAIL_PASSWORD'))
-
-        if smtp_configured:
-            # Пытаемся отправить email
-            email_sent = send_password_reset_email(user.email, reset_token)
-
-            if email_sent:
-                return jsonify({
-                    'message': 'Инструкция для восстановления пароля отправлена на email'
-                }), 200
-            else:
-                # Email не отправлен, возвращаем ссылку
-                reset_url = f"{request.host_url.rstrip('/')}/reset-password?token={reset_token}"
-                return jsonify({
-                    'message': 'Не удалось отправить email. Используйте эту ссылку для восстановления пароля',
-                    'reset_url': reset_url
-                }), 200
-        else:
-            # SMTP не настроен - режим разработки
-            reset_url = f"{request.host_url.rstrip('/')}/reset-password?token={reset_token}"
+        if app.config['MAIL_ENABLED']:
+            # Письмо сохраняется в той же транзакции, что и токен
+            send_password_reset_email(user.email, reset_token)
+            db.session.commit()
             return jsonify({
-                'message': 'Email не настроен. Используйте эту ссылку для восстановления пароля',
-                'reset_url': reset_url
+                'message': 'Инструкция для восстановления пароля отправлена на email'
             }), 200
 
+        db.session.commit()
+
+        # Отправка писем не настроена - режим разработки
+        reset_url = f"{request.host_url.rstrip('/')}/reset-password?token={reset_token}"
+        return jsonify({
+            'message': 'Email не настроен. Используйте эту ссылку для восстановления пароля',
+            'reset_url': reset_url
+        }), 200
+
     except Exception as e:
         print(f"Ошибка в password-reset/request: {e}")
         import traceback
@@ -354,7 +484,7 @@ def confirm_password_reset():
 
     # Обновление пароля пользователя
     user = User.query.get(password_reset.user_id)
-    user.set_password(data['new_password'])
+    user.password_hash = password_hasher.hash(data['new_password'])
 
     # Отметка токена как использованного
     password_reset.used = True
@@ -369,16 +499,66 @@ def confirm_password_reset():
 # =======================
 
 @app.route('/api/offers', methods=['GET'])
+@catalog_version.conditional
 def get_offers():
-    """Получить список офферов"""
-    offers = Offer.query.filter_by(is_active=True).all()
-    base_url = request.host_url.rstrip('/')
-    return jsonify([offer.to_dict() for offer in offers])
+    """Получить список офферов (постранично: limit, cursor; фильтры category, company_id)"""
+    category = request.args.get('category') or None
+    company_id = request.args.get('company_id', type=int)
+
+    try:
+        limit, cursor = pagination.parse_args(request.args)
+
+        # Готовые байты из кеша воркера, если поколение каталога не менялось
+        body = catalog_cache.offers_page(limit, cursor, category=category, company_id=company_id)
+        if body is not None:
+            return app.response_class(body, mimetype='application/json')
+
+        query = serializers.OFFER.query().filter_by(is_active=True)
+        if category is not None:
+            query = query.filter(Offer.category == category)
+        if company_id is not None:
+            query = query.filter(Offer.company_id == company_id)
+
+        rows, next_cursor = pagination.paginate(query, (Offer.id,), limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    body = serializers.page(serializers.OFFER.encode_all(rows), next_cursor)
+    return app.response_class(body, mimetype='application/json')
+
+
+@app.route('/api/offers/search', methods=['GET'])
+@catalog_version.conditional
+def search_offers():
+    """Поиск активных офферов (q, category, min_commission, sort; постранично: limit, cursor)
+
+    Результаты упорядочены по релевантности (BM25) или по sort: newest,
+    price_high, price_low, commission. facets - число найденных офферов по
+    категориям без учёта фильтра category.
+    """
+    try:
+        q, category, min_commission, sort = search.parse_args(request.args)
+        limit, cursor = pagination.parse_args(request.args)
+        ids, next_cursor, facets, total = search.search(q, category, min_commission, sort, limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = serializers.OFFER.query().filter(Offer.id.in_(ids)).all() if ids else []
+    position = {offer_id: i for i, offer_id in enumerate(ids)}
+    rows.sort(key=lambda row: position[row.id])
+
+    body = serializers.search_page(serializers.OFFER.encode_all(rows), next_cursor, facets, total)
+    return app.response_class(body, mimetype='application/json')
 
 
 @app.route('/api/offers/<int:offer_id>', methods=['GET'])
+@catalog_version.conditional
 def get_offer(offer_id):
     """Получить конкретный оффер"""
+    body = catalog_cache.offer(offer_id)
+    if body is not None:
+        return app.response_class(body, mimetype='application/json')
+
     offer = Offer.query.get_or_404(offer_id)
     return jsonify(offer.to_dict())
 
@@ -478,7 +658,7 @@ def create_affiliate_link(current_user):
     link = AffiliateLink(
         partner_id=current_user.id,
         offer_id=offer.id,
-        tracking_code=AffiliateLink.generate_tracking_code(),
+        tracking_code=AffiliateLink.generate_tracking_codes(1)[0],
         utm_source=data.get('utm_source'),
         utm_medium=data.get('utm_medium'),
         utm_campaign=data.get('utm_campaign'),
@@ -497,13 +677,105 @@ def create_affiliate_link(current_user):
     }), 201
 
 
+@app.route('/api/affiliate-links/bulk', methods=['POST'])
+@token_required
+def create_affiliate_links_bulk(current_user):
+    """Создать партнёрские ссылки на несколько офферов одним запросом
+
+    Тело: {"links": [{"offer_id": 1, "utm_source": "telegram", ...}, ...]}.
+    Офферы и уже существующие ссылки партнёра читаются одним запросом
+    каждый, новые ссылки вставляются в одной транзакции. Результат
+    возвращается в порядке запроса.
+    """
+    if current_user.user_type != 'partner':
+        return jsonify({'error': 'Только партнёры могут создавать ссылки'}), 403
+
+    data = request.get_json(silent=True) or {}
+    items = data.get('links')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Укажите список ссылок links'}), 400
+    if len(items) > app.config['LINKS_BULK_MAX']:
+        return jsonify({'error': f"Не больше {app.config['LINKS_BULK_MAX']} ссылок за запрос"}), 400
+    if not all(isinstance(item, dict) and type(item.get('offer_id')) is int for item in items):
+        return jsonify({'error': 'У каждой ссылки должен быть числовой offer_id'}), 400
+
+    offer_ids = {item['offer_id'] for item in items}
+    known_offers = {
+        offer_id for (offer_id,) in db.session.query(Offer.id).filter(Offer.id.in_(offer_ids))
+    }
+
+    # Ссылка на оффер у партнёра одна: существующие возвращаются как есть
+    links = {
+        link.offer_id: link for link in AffiliateLink.query.filter(
+            AffiliateLink.partner_id == current_user.id,
+            AffiliateLink.offer_id.in_(known_offers)
+        )
+    }
+    existing = set(links)
+
+    new_items = {}
+    for item in items:
+        offer_id = item['offer_id']
+        if offer_id in known_offers and offer_id not in links and offer_id not in new_items:
+            new_items[offer_id] = item
+
+    if new_items:
+        codes = AffiliateLink.generate_tracking_codes(len(new_items))
+        rows = [
+            {
+                'partner_id': current_user.id,
+                'offer_id': offer_id,
+                'tracking_code': tracking_code,
+                **{field: item.get(field) for field in serializers.UTM_FIELDS}
+            }
+            for (offer_id, item), tracking_code in zip(new_items.items(), codes)
+        ]
+        # Один executemany вместо INSERT ... RETURNING на каждую ссылку
+        db.session.execute(insert(AffiliateLink), rows)
+        links.update(
+            (link.offer_id, link)
+            for link in AffiliateLink.query.filter(AffiliateLink.tracking_code.in_(codes))
+        )
+
+    base_url = request.host_url.rstrip('/')
+    results = []
+    for item in items:
+        offer_id = item['offer_id']
+        if offer_id not in known_offers:
+            results.append({'offer_id': offer_id, 'error': 'Оффер не найден'})
+        else:
+            results.append({
+                'offer_id': offer_id,
+                'created': offer_id not in existing,
+                'link': links[offer_id].to_dict(base_url)
+            })
+
+    if new_items:
+        db.session.commit()
+
+    return jsonify({
+        'message': f'Создано ссылок: {len(new_items)}',
+        'created': len(new_items),
+        'links': results
+    }), 201 if new_items else 200
+
+
 @app.route('/api/affiliate-links', methods=['GET'])
 @token_required
 def get_affiliate_links(current_user):
-    """Получить партнёрские ссылки пользователя"""
-    links = AffiliateLink.query.filter_by(partner_id=current_user.id).all()
+    """Получить партнёрские ссылки пользователя (постранично: limit, cursor)"""
+    query = serializers.AFFILIATE_LINK.query().filter_by(partner_id=current_user.id)
+
+    try:
+        limit, cursor = pagination.parse_args(request.args)
+        rows, next_cursor = pagination.paginate(query, (AffiliateLink.id,), limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     base_url = request.host_url.rstrip('/')
-    return jsonify([link.to_dict(base_url) for link in links])
+    body = serializers.page(serializers.AFFILIATE_LINK.encode_all(rows, base_url), next_cursor)
+    return app.response_class(body, mimetype='application/json')
 
 
 # =======================
@@ -513,7 +785,14 @@ def get_affiliate_links(current_user):
 @app.route('/track/<tracking_code>')
 def track_click(tracking_code):
     """Отследить клик по партнёрской ссылке"""
-    link = AffiliateLink.query.filter_by(tracking_code=tracking_code).first_or_404()
+    # При попадании в кеш редирект не читает из БД
+    link = tracking_cache.resolve(tracking_code)
+    if link is None:
+        abort(404)
+
+    # Неактивная ссылка или оффер - клик не засчитывается
+    if not link.is_active:
+        return redirect(url_for('offers_page'))
 
     # Получение UTM параметров из query string
     utm_source = request.args.get('utm_source')
@@ -522,32 +801,140 @@ def track_click(tracking_code):
     utm_content = request.args.get('utm_content')
     utm_term = request.args.get('utm_term')
 
-    # Создание записи о клике с UTM параметрами
-    click = Click(
-        affiliate_link_id=link.id,
-        partner_id=link.partner_id,
-        offer_id=link.offer_id,
-        ip_address=request.remote_addr,
-        user_agent=request.user_agent.string,
-        referrer=request.referrer,
-        utm_source=utm_source,
-        utm_medium=utm_medium,
-        utm_campaign=utm_campaign,
-        utm_content=utm_content,
-        utm_term=utm_term
-    )
-
-    db.session.add(click)
-    db.session.commit()
+    # Повторный клик в окне дедупликации (без запроса к БД)
+    is_duplicate = click_dedup.is_duplicate(request.remote_addr, request.user_agent.string, tracking_code)
+    if is_duplicate and click_dedup.mode == 'skip':
+        # Клик не записывается; click_id остаётся у рекламодателя от первого клика
+        return redirect(link.product_url or url_for('offers_page'))
+
+    # Публичный id клика: рекламодатель вернёт его в постбэке
+    click_id = secrets.token_urlsafe(12)
+
+    # Клик ставится в очередь и записывается в БД пачкой в фоне
+    click_writer.enqueue({
+        'affiliate_link_id': link.link_id,
+        'partner_id': link.partner_id,
+        'offer_id': link.offer_id,
+        'click_id': click_id,
+        'is_duplicate': is_duplicate,
+        'ip_address': request.remote_addr,
+        'user_agent': request.user_agent.string,
+        'referrer': request.referrer,
+        'utm_source': utm_source,
+        'utm_medium': utm_medium,
+        'utm_campaign': utm_campaign,
+        'utm_content': utm_content,
+        'utm_term': utm_term
+    })
 
     # Редирект на продукт
-    offer = Offer.query.get(link.offer_id)
-    if offer.product_url:
-        return redirect(offer.product_url)
+    if link.product_url:
+        return redirect(append_query_param(link.product_url, app.config['CLICK_ID_PARAM'], click_id))
     else:
         return redirect(url_for('offers_page'))
 
 
+def postback_signature(click_id, amount='', order_id=''):
+    """Подпись постбэка: HMAC-SHA256 строки "click_id:amount:order_id" (hex)
+
+    Ключ - POSTBACK_SECRET; amount и order_id - как переданы в запросе
+    (пустая строка, если параметра нет).
+    """
+    message = f'{click_id}:{amount}:{order_id}'.encode()
+    return hmac.new(app.config['POSTBACK_SECRET'].encode(), message, hashlib.sha256).hexdigest()
+
+
+@app.route('/postback', methods=['GET', 'POST'])
+def postback():
+    """Постбэк рекламодателя: конверсия по click_id из URL редиректа
+
+    Параметры (query string, форма или JSON): click_id, amount, order_id
+    и signature (см. postback_signature). click_id виден посетителю в URL
+    редиректа, поэтому без подписи постбэк не принимается; без
+    POSTBACK_SECRET постбэки отключены. Клик ищется по уникальному
+    индексу click_id. Повторный order_id не создаёт конверсию, ответ 200
+    со статусом duplicate - рекламодатель может безопасно повторять запрос.
+    """
+    params = request.get_json(silent=True) or request.values
+
+    if not app.config['POSTBACK_SECRET']:
+        return jsonify({'error': 'Постбэки отключены: не задан POSTBACK_SECRET'}), 403
+
+    click_id = params.get('click_id')
+    if not click_id:
+        return jsonify({'error': 'Укажите click_id'}), 400
+
+    expected = postback_signature(click_id, params.get('amount', ''), params.get('order_id', ''))
+    if not hmac.compare_digest(str(params.get('signature', '')), expected):
+        return jsonify({'error': 'Неверная подпись постбэка'}), 403
+
+    amount = params.get('amount')
+    if amount is not None:
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            amount = None
+        # not > 0 отсекает и NaN
+        if amount is None or not amount > 0 or not Money.fits(amount):
+            return jsonify({'error': f'amount должен быть положительным числом меньше {Money.MAX}'}), 400
+
+    order_id = params.get('order_id') or None
+    if order_id is not None:
+        order_id = str(order_id)[:100]
+
+    query = db.session.query(
+        Click.affiliate_link_id, Click.partner_id, Click.offer_id
+    ).filter(Click.click_id == str(click_id))
+    click = query.first()
+    if click is None:
+        # Клик мог ещё не дойти из очереди записи этого воркера
+        click_writer.flush()
+        click = query.first()
+    if click is None:
+        # Поздний постбэк: клик уже перенесён в архивную партицию
+        click = partitions.find_click(str(click_id), 'affiliate_link_id', 'partner_id', 'offer_id')
+    if click is None:
+        return jsonify({'error': 'Клик не найден'}), 404
+
+    if order_id and db.session.query(Conversion.id).filter(Conversion.order_id == order_id).first():
+        return jsonify({'status': 'duplicate', 'order_id': order_id})
+
+    offer = db.session.get(Offer, click.offer_id)
+    link = db.session.get(AffiliateLink, click.affiliate_link_id)
+    commission = offer.calculate_commission()
+
+    conversion = Conversion(
+        affiliate_link_id=click.affiliate_link_id,
+        partner_id=click.partner_id,
+        offer_id=click.offer_id,
+        click_id=str(click_id),
+        order_id=order_id,
+        # Без amount - цена оффера
+        sale_amount=amount or offer.price,
+        commission_amount=commission['partner_commission'],
+        platform_fee=commission['platform_fee']
+    )
+
+    db.session.add(conversion)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Тот же order_id одновременно пришёл в другом постбэке
+        db.session.rollback()
+        return jsonify({'status': 'duplicate', 'order_id': order_id})
+    except DataError:
+        # Значение не поместилось в колонку (PostgreSQL проверяет точность NUMERIC)
+        db.session.rollback()
+        return jsonify({'error': 'Некорректные значения постбэка'}), 400
+    rollups.record_conversions([(conversion, link)])
+    db.session.commit()
+
+    return jsonify({
+        'status': 'created',
+        'conversion': conversion.to_dict()
+    }), 201
+
+
 @app.route('/api/conversions', methods=['POST'])
 @token_required
 def create_conversion(current_user):
@@ -561,6 +948,10 @@ def create_conversion(current_user):
     link = AffiliateLink.query.get_or_404(data['affiliate_link_id'])
     offer = Offer.query.get(link.offer_id)
 
+    order_id = data.get('order_id')
+    if order_id and Conversion.query.filter_by(order_id=order_id).first():
+        return jsonify({'error': 'Конверсия с таким order_id уже зарегистрирована'}), 409
+
     # Расчёт комиссий
     commission = offer.calculate_commission()
 
@@ -568,13 +959,20 @@ def create_conversion(current_user):
         affiliate_link_id=link.id,
         partner_id=link.partner_id,
         offer_id=link.offer_id,
-        order_id=data.get('order_id'),
+        order_id=order_id,
         sale_amount=data['sale_amount'],
         commission_amount=commission['partner_commission'],
         platform_fee=commission['platform_fee']
     )
 
     db.session.add(conversion)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Тот же order_id одновременно записал другой запрос
+        db.session.rollback()
+        return jsonify({'error': 'Конверсия с таким order_id уже зарегистрирована'}), 409
+    rollups.record_conversions([(conversion, link)])
     db.session.commit()
 
     return jsonify({
@@ -583,6 +981,100 @@ def create_conversion(current_user):
     }), 201
 
 
+@app.route('/api/conversions/batch', methods=['POST'])
+@token_required
+def create_conversions_batch(current_user):
+    """Загрузить пачку конверсий (только компании, по своим офферам)
+
+    Тело - JSON-массив или NDJSON (Content-Type: application/x-ndjson),
+    строка: {"order_id": "...", "sale_amount": 500000, "affiliate_link_id": 1}
+    или с "tracking_code" вместо affiliate_link_id. Строки записываются
+    транзакциями по CONVERSION_BATCH_CHUNK; уже известные order_id
+    пропускаются как duplicate.
+    """
+    if current_user.user_type != 'company':
+        return jsonify({'error': 'Только компании могут загружать конверсии'}), 403
+
+    try:
+        rows = conversion_import.read_rows(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results = list(conversion_import.ingest(rows, current_user.id, app.config['CONVERSION_BATCH_CHUNK']))
+
+    summary = {'created': 0, 'duplicate': 0, 'error': 0}
+    for result in results:
+        summary[result['status']] += 1
+
+    return jsonify({
+        'created': summary['created'],
+        'duplicates': summary['duplicate'],
+        'errors': summary['error'],
+        'results': results
+    })
+
+
+@app.route('/api/conversions/status', methods=['POST'])
+@token_required
+def change_conversions_status(current_user):
+    """Сменить статус конверсий по своим офферам (только компании)
+
+    Тело: {"status": "approved", "ids": [1, 2, 3]} или
+    {"status": "approved", "filter": {"offer_id": 1, "date_from": "2024-01-01",
+    "date_to": "2024-01-31", "status": "pending"}}. Допустимые переходы:
+    pending -> approved, pending/approved -> rejected, approved -> paid.
+    """
+    if current_user.user_type != 'company':
+        return jsonify({'error': 'Только компании могут менять статус конверсий'}), 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or ('ids' in data) == ('filter' in data):
+        return jsonify({'error': 'Укажите status и либо ids, либо filter'}), 400
+
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in ids
+        ):
+            return jsonify({'error': 'ids - непустой список ID конверсий'}), 400
+        if len(ids) > app.config['CONVERSION_STATUS_MAX_IDS']:
+            return jsonify({'error': f"Не больше {app.config['CONVERSION_STATUS_MAX_IDS']} ids за запрос"}), 400
+        ids = set(ids)
+
+    filters = data.get('filter') or {}
+    if not isinstance(filters, dict):
+        return jsonify({'error': 'filter - объект'}), 400
+    offer_id = filters.get('offer_id')
+    if offer_id is not None and (isinstance(offer_id, bool) or not isinstance(offer_id, int)):
+        return jsonify({'error': 'offer_id - целое число'}), 400
+
+    try:
+        date_from, date_to = stats.parse_period(filters)
+        changed = ledger.change_status(
+            current_user.id, data.get('status'), ids=ids, offer_id=offer_id,
+            date_from=date_from, date_to=date_to, status=filters.get('status')
+        )
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    db.session.commit()
+
+    updated = sum(count for count, _ in changed.values())
+    result = {
+        'status': data['status'],
+        'updated': updated,
+        'from': {
+            status: {'count': count, 'commission_amount': amount}
+            for status, (count, amount) in changed.items()
+        }
+    }
+    if ids is not None:
+        # Чужие, несуществующие и уже в другом статусе
+        result['skipped'] = len(ids) - updated
+    return jsonify(result)
+
+
 # =======================
 # API: Статистика
 # =======================
@@ -590,67 +1082,145 @@ def create_conversion(current_user):
 @app.route('/api/stats/partner', methods=['GET'])
 @token_required
 def get_partner_stats(current_user):
-    """Получить статистику партнёра"""
+    """Получить статистику партнёра
+
+    Параметры: date_from, date_to (YYYY-MM-DD), group_by (day, offer, utm_source, utm_campaign)
+    """
     if current_user.user_type != 'partner':
         return jsonify({'error': 'Только для партнёров'}), 403
 
-    # Клики
-    total_clicks = Click.query.filter_by(partner_id=current_user.id).count()
+    try:
+        date_from, date_to, group_by = stats.parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # Конверсии
-    conversions = Conversion.query.filter_by(partner_id=current_user.id).all()
-    total_conversions = len(conversions)
+    # Клики, конверсии и заработок считаются в БД
+    totals = stats.summary(partner_id=current_user.id, date_from=date_from, date_to=date_to)
+    total_clicks = totals['clicks']
+    total_conversions = totals['conversions']
 
-    # Заработок
-    total_earnings = sum(c.commission_amount for c in conversions if c.status == 'approved')
-    pending_earnings = sum(c.commission_amount for c in conversions if c.status == 'pending')
+    # Конверсионная способность - по кликам без повторных
+    unique_clicks = total_clicks - totals['duplicate_clicks']
+    conversion_rate = (total_conversions / unique_clicks * 100) if unique_clicks > 0 else 0
 
-    # Конверсионная способность
-    conversion_rate = (total_conversions / total_clicks * 100) if total_clicks > 0 else 0
+    recent_conversions = stats.recent_conversions(partner_id=current_user.id,
+                                                  date_from=date_from, date_to=date_to)
 
-    return jsonify({
+    result = {
         'total_clicks': total_clicks,
+        'unique_clicks': sketches.unique_clicks(partner_id=current_user.id, date_from=date_from, date_to=date_to),
+        'duplicate_clicks': totals['duplicate_clicks'],
         'total_conversions': total_conversions,
         'conversion_rate': round(conversion_rate, 2),
-        'total_earnings': total_earnings,
-        'pending_earnings': pending_earnings,
+        'total_earnings': totals['approved_amount'],
+        'pending_earnings': totals['pending_amount'],
         'balance': current_user.balance,
-        'recent_conversions': [c.to_dict() for c in conversions[-10:]]
-    })
+        'recent_conversions': [c.to_dict() for c in recent_conversions]
+    }
+
+    if group_by:
+        result['breakdown'] = stats.summary(partner_id=current_user.id, date_from=date_from,
+                                            date_to=date_to, group_by=group_by)
+
+    return jsonify(result)
 
 
 @app.route('/api/stats/company', methods=['GET'])
 @token_required
 def get_company_stats(current_user):
-    """Получить статистику компании"""
+    """Получить статистику компании
+
+    Параметры: date_from, date_to (YYYY-MM-DD), group_by (day, partner, offer, utm_source, utm_campaign)
+    """
     if current_user.user_type != 'company':
         return jsonify({'error': 'Только для компаний'}), 403
 
-    # Офферы компании
-    offers = Offer.query.filter_by(company_id=current_user.id).all()
-    offer_ids = [o.id for o in offers]
+    try:
+        date_from, date_to, group_by = stats.parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # Клики по офферам
-    total_clicks = Click.query.filter(Click.offer_id.in_(offer_ids)).count()
+    # Клики, конверсии, продажи и партнёры считаются в БД
+    totals = stats.summary(company_id=current_user.id, date_from=date_from, date_to=date_to)
 
-    # Конверсии
-    conversions = Conversion.query.filter(Conversion.offer_id.in_(offer_ids)).all()
-    total_conversions = len(conversions)
-    total_sales = sum(c.sale_amount for c in conversions)
+    recent_conversions = stats.recent_conversions(company_id=current_user.id,
+                                                  date_from=date_from, date_to=date_to)
 
-    # Партнёры
-    unique_partners = len(set(c.partner_id for c in conversions))
+    result = {
+        'total_offers': Offer.query.filter_by(company_id=current_user.id).count(),
+        'total_clicks': totals['clicks'],
+        'unique_clicks': sketches.unique_clicks(company_id=current_user.id, date_from=date_from, date_to=date_to),
+        'duplicate_clicks': totals['duplicate_clicks'],
+        'total_conversions': totals['conversions'],
+        'total_sales': totals['sales_amount'],
+        'unique_partners': totals['unique_partners'],
+        'recent_conversions': [c.to_dict() for c in recent_conversions]
+    }
 
-    return jsonify({
-        'total_offers': len(offers),
-        'total_clicks': total_clicks,
-        'total_conversions': total_conversions,
-        'total_sales': total_sales,
-        'unique_partners': unique_partners,
-        'recent_conversions': [c.to_dict() for c in conversions[-10:]]
+    if group_by:
+        result['breakdown'] = stats.summary(company_id=current_user.id, date_from=date_from,
+                                            date_to=date_to, group_by=group_by)
+
+    return jsonify(result)
+
+
+# =======================
+# API: Выгрузка
+# =======================
+
+def export_response(current_user, kind):
+    """Потоковый ответ с выгрузкой кликов или конверсий пользователя"""
+    if current_user.user_type == 'partner':
+        owner = {'partner_id': current_user.id}
+    elif current_user.user_type == 'company':
+        owner = {'company_id': current_user.id}
+    else:
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    try:
+        export_format, compress, date_from, date_to, utm = exports.parse_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if kind == 'clicks':
+        # Клики из очереди записи этого воркера тоже попадут в выгрузку
+        click_writer.flush()
+
+    body = exports.stream(kind, export_format, compress, date_from=date_from, date_to=date_to, utm=utm, **owner)
+    filename = f"{kind}-{utcnow():%Y%m%d}.{export_format}"
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = exports.FORMATS[export_format]
+
+    return app.response_class(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'Cache-Control': 'no-store'
     })
 
 
+@app.route('/api/export/clicks', methods=['GET'])
+@token_required
+def export_clicks(current_user):
+    """Выгрузить клики партнёра или по офферам компании (CSV или NDJSON)
+
+    Параметры: format (csv, ndjson), gzip (1, true), date_from, date_to (YYYY-MM-DD),
+    utm_source, utm_medium, utm_campaign, utm_content, utm_term
+    """
+    return export_response(current_user, 'clicks')
+
+
+@app.route('/api/export/conversions', methods=['GET'])
+@token_required
+def export_conversions(current_user):
+    """Выгрузить конверсии партнёра или по офферам компании (CSV или NDJSON)
+
+    Параметры те же, что у /api/export/clicks; UTM-фильтры применяются к ссылке конверсии
+    """
+    return export_response(current_user, 'conversions')
+
+
 # =======================
 # API: Выплаты
 # =======================
@@ -664,20 +1234,19 @@ def request_payout(current_user):
 
     data = request.get_json()
 
-    if 'amount' not in data or data['amount'] <= 0:
+    amount = data.get('amount')
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
         return jsonify({'error': 'Укажите корректную сумму'}), 400
 
-    if data['amount'] > current_user.balance:
+    # Проверка баланса и списание - одним условным UPDATE
+    try:
+        payout = ledger.request_payout(
+            current_user.id, round(amount, 2), data.get('payment_method'), data.get('payment_details')
+        )
+    except ledger.InsufficientFunds:
+        db.session.rollback()
         return jsonify({'error': 'Недостаточно средств на балансе'}), 400
 
-    payout = Payout(
-        partner_id=current_user.id,
-        amount=data['amount'],
-        payment_method=data.get('payment_method'),
-        payment_details=data.get('payment_details')
-    )
-
-    db.session.add(payout)
     db.session.commit()
 
     return jsonify({
@@ -689,9 +1258,59 @@ def request_payout(current_user):
 @app.route('/api/payouts', methods=['GET'])
 @token_required
 def get_payouts(current_user):
-    """Получить историю выплат"""
-    payouts = Payout.query.filter_by(partner_id=current_user.id).all()
-    return jsonify([p.to_dict() for p in payouts])
+    """Получить историю выплат, новые первыми (постранично: limit, cursor)"""
+    query = serializers.PAYOUT.query().filter_by(partner_id=current_user.id)
+
+    try:
+        limit, cursor = pagination.parse_args(request.args)
+        rows, next_cursor = pagination.paginate(
+            query, (Payout.requested_at, Payout.id), limit, cursor, descending=True
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    body = serializers.page(serializers.PAYOUT.encode_all(rows), next_cursor)
+    return app.response_class(body, mimetype='application/json')
+
+
+@app.route('/api/ledger', methods=['GET'])
+@token_required
+def get_ledger(current_user):
+    """Журнал начислений и списаний партнёра, новые первыми (постранично: limit, cursor)"""
+    if current_user.user_type != 'partner':
+        return jsonify({'error': 'Только для партнёров'}), 403
+
+    query = serializers.LEDGER_ENTRY.query().filter_by(partner_id=current_user.id)
+
+    try:
+        limit, cursor = pagination.parse_args(request.args)
+        rows, next_cursor = pagination.paginate(query, (LedgerEntry.id,), limit, cursor, descending=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    body = serializers.page(serializers.LEDGER_ENTRY.encode_all(rows), next_cursor)
+    return app.response_class(body, mimetype='application/json')
+
+
+# =======================
+# API: Мониторинг
+# =======================
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Счётчики внутренних очередей текущего воркера"""
+    return jsonify({
+        'pid': os.getpid(),
+        'click_writer': click_writer.stats(),
+        'click_dedup': click_dedup.stats(),
+        'tracking_cache': tracking_cache.stats(),
+        'catalog': catalog_version.stats(),
+        'catalog_cache': catalog_cache.stats(),
+        'auth_cache': auth_cache.stats(),
+        'password_hasher': password_hasher.stats(),
+        'mail_outbox': mail_outbox.stats(),
+        'sqlite': sqlite_tuning.stats()
+    })
 
 
 # =======================
@@ -701,10 +1320,98 @@ def get_payouts(current_user):
 @app.cli.command()
 def init_db():
     """Инициализировать базу данных"""
-    db.create_all()
+    migrations.upgrade()
     print('База данных инициализирована!')
 
 
+@app.cli.command()
+def db_upgrade():
+    """Применить невыполненные миграции схемы"""
+    applied = migrations.upgrade()
+    if applied:
+        print(f"Применены миграции: {', '.join(str(v) for v in applied)}")
+    else:
+        print('Схема уже актуальна')
+
+
+@app.cli.command()
+def db_check_indexes():
+    """Проверить через EXPLAIN QUERY PLAN, что запросы используют индексы"""
+    if db.engine.dialect.name != 'sqlite':
+        print('Проверка планов запросов поддерживается только для SQLite')
+        return
+
+    failed = 0
+    for index_name, used, plan in migrations.check_indexes():
+        print(f"{'✓' if used else '✗'} {index_name}: {plan}")
+        failed += not used
+
+    if failed:
+        raise SystemExit(f'Индексов не используется: {failed}')
+
+
+@app.cli.command()
+def backfill_rollups():
+    """Пересчитать суточные агрегаты и скетчи уникальных посетителей по истории"""
+    rows = rollups.backfill()
+    print(f'Суточные агрегаты пересчитаны: {rows} строк')
+    rows = sketches.backfill()
+    print(f'Скетчи уникальных посетителей пересчитаны: {rows} строк')
+
+
+@app.cli.command()
+def rollover_clicks():
+    """Перенести клики закрытых месяцев в архивные партиции clicks_YYYYMM"""
+    moved = partitions.rollover(app.config['CLICK_HOT_MONTHS'])
+    for name, rows in moved:
+        print(f'{name}: перенесено {rows} кликов')
+    if not moved:
+        print('Нет кликов для переноса')
+        return
+
+    if app.config['CLICK_ROLLOVER_COMPACT']:
+        partitions.compact()
+        print('Место в БД освобождено (VACUUM)')
+
+
+@app.cli.command()
+def settle_conversions():
+    """Подтвердить конверсии старше CONVERSION_HOLD_DAYS дней и начислить комиссии"""
+    count, total = ledger.settle(app.config['CONVERSION_HOLD_DAYS'], app.config['SETTLEMENT_BATCH'])
+    print(f'Подтверждено конверсий: {count}, начислено: {total}')
+
+
+@app.cli.command()
+@click.argument('payout_id', type=int)
+@click.option('--failed', is_flag=True, help='Выплата не прошла: вернуть сумму на баланс')
+def close_payout(payout_id, failed):
+    """Завершить выплату (completed или, с --failed, failed)"""
+    status = 'failed' if failed else 'completed'
+    if not ledger.close_payout(payout_id, status):
+        raise SystemExit(f'Выплата {payout_id} не найдена или уже завершена')
+    db.session.commit()
+    print(f'Выплата {payout_id}: {status}')
+
+
+@app.cli.command()
+def ledger_check():
+    """Сверить User.balance с суммой записей журнала"""
+    mismatched = ledger.check()
+    for partner_id, balance, total in mismatched:
+        print(f'✗ пользователь {partner_id}: баланс {balance}, по журналу {total}')
+    if mismatched:
+        raise SystemExit(f'Расхождений: {len(mismatched)}')
+    print('Балансы совпадают с журналом')
+
+
+@app.cli.command()
+def mail_outbox_flush():
+    """Отправить все готовые письма из очереди"""
+    processed = mail_outbox.flush()
+    print(f'Обработано писем: {processed}, отправлено: {mail_outbox.sent}, '
+          f'отложено: {mail_outbox.retried}, с ошибкой: {mail_outbox.failed}')
+
+
 @app.cli.command()
 def seed_db():
     """Заполнить БД тестовыми данными"""
@@ -766,5 +1473,5 @@ def seed_db():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        migrations.upgrade()
     app.run(debug=True, host='0.0.0.0', port=5000)
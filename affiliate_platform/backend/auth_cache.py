@@ -0,0 +1,219 @@
+"""
+Кеш аутентификации для token_required: JWT и поля пользователя без запроса к БД
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import jwt
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .models import db, User
+from .shared_counter import SharedCounter
+
+
+# Поля пользователя, нужные для проверки доступа, и баланс партнёра
+AuthFields = namedtuple('AuthFields', ['id', 'user_type', 'is_active', 'balance'])
+
+# Изменение этих полей сбрасывает кеш во всех воркерах
+USER_FIELDS = ('password_hash', 'user_type', 'is_active', 'balance')
+
+# Ключ session.info: пользователи, чьи записи сбрасываются после коммита
+PENDING = 'auth_cache_pending'
+
+
+def balance_changed(session, user_ids):
+    """Отметить, что коммит session меняет баланс пользователей user_ids
+
+    Журнал баланса меняет users.balance UPDATE-запросами мимо ORM, их
+    событие after_flush не видит. После коммита записи этих пользователей
+    сбрасываются так же, как при смене пароля; после отката - нет.
+    """
+    session.info.setdefault(PENDING, set()).update(user_ids)
+
+
+class AuthUser:
+    """Текущий пользователь запроса: id, user_type, is_active и balance из кеша
+
+    Остальные атрибуты (email, full_name и т.д.) читаются из ORM-объекта,
+    который загружается из БД при первом обращении.
+    """
+
+    def __init__(self, fields):
+        self.id = fields.id
+        self.user_type = fields.user_type
+        self.is_active = fields.is_active
+        self.balance = fields.balance
+        self._user = None
+
+    def __getattr__(self, name):
+        # Вызывается только для атрибутов, которых нет в кеше
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return getattr(self._user, name)
+
+
+class AuthCache:
+    """LRU-кеши воркера с TTL: токен -> user_id и user_id -> AuthFields
+
+    Запись токена живёт не дольше TTL и срока действия самого JWT.
+    Коммит, который меняет пароль, тип, активность или баланс пользователя
+    (или удаляет его), увеличивает общий счётчик AUTH_VERSION_FILE -
+    при следующем запросе каждый воркер очищает свои кеши. Без файла
+    счётчика в других воркерах запись живёт до истечения TTL.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._counter = None
+        self._generation = None
+        self._tokens = OrderedDict()
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Счётчики
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('AUTH_CACHE_SIZE', 10000)
+        app.config.setdefault('AUTH_CACHE_TTL', 30)
+        app.config.setdefault('AUTH_VERSION_FILE', None)
+
+        self.app = app
+        app.extensions['auth_cache'] = self
+
+        if app.config['AUTH_VERSION_FILE']:
+            try:
+                self._counter = SharedCounter(app.config['AUTH_VERSION_FILE'])
+            except OSError as e:
+                app.logger.warning(f"Общий счётчик кеша авторизации недоступен: {e}")
+
+        event.listen(Session, 'after_flush', self._collect_changes)
+        event.listen(Session, 'after_commit', self._apply_invalidation)
+        event.listen(Session, 'after_rollback', self._discard_changes)
+
+    def authenticate(self, token):
+        """Пользователь по JWT: AuthUser или None, если пользователя нет
+
+        Невалидный или просроченный токен - jwt.InvalidTokenError.
+        """
+        self._check_generation()
+
+        now = time.monotonic()
+        user_id = self._get(self._tokens, token, now)
+        if user_id is None:
+            data = jwt.decode(token, self.app.config['SECRET_KEY'], algorithms=['HS256'])
+            if 'user_id' not in data:
+                raise jwt.InvalidTokenError('В токене нет user_id')
+            user_id = data['user_id']
+
+            # Не дольше срока действия самого токена
+            expires_at = now + self.app.config['AUTH_CACHE_TTL']
+            if 'exp' in data:
+                expires_at = min(expires_at, now + data['exp'] - time.time())
+            self._put(self._tokens, token, user_id, expires_at)
+
+        fields = self._get(self._users, user_id, now)
+        if fields is None:
+            self.misses += 1
+            row = db.session.query(
+                User.id, User.user_type, User.is_active, User.balance
+            ).filter(User.id == user_id).first()
+            if row is None:
+                return None
+            fields = AuthFields(row.id, row.user_type, row.is_active is not False, row.balance)
+            self._put(self._users, user_id, fields, now + self.app.config['AUTH_CACHE_TTL'])
+        else:
+            self.hits += 1
+
+        return AuthUser(fields)
+
+    def invalidate_user(self, user_id):
+        """Сбросить поля пользователя и его токены в этом воркере"""
+        with self._lock:
+            self._users.pop(user_id, None)
+            for token in [t for t, (uid, _) in self._tokens.items() if uid == user_id]:
+                del self._tokens[token]
+
+    def clear(self):
+        """Очистить кеши воркера"""
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+    def _get(self, entries, key, now):
+        """Значение из LRU (None при промахе или истёкшем TTL)"""
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < now:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def _put(self, entries, key, value, expires_at):
+        """Положить значение в LRU, вытеснив самые старые записи"""
+        with self._lock:
+            entries[key] = (value, expires_at)
+            entries.move_to_end(key)
+            while len(entries) > self.app.config['AUTH_CACHE_SIZE']:
+                entries.popitem(last=False)
+
+    def _check_generation(self):
+        """Очистить кеши, если пользователей изменил другой воркер"""
+        if self._counter is None:
+            return
+
+        generation = self._counter.current()
+        if generation != self._generation:
+            self.clear()
+            self._generation = generation
+
+    def _collect_changes(self, session, flush_context):
+        """Запомнить пользователей, у которых изменились поля доступа"""
+        pending = session.info.setdefault(PENDING, set())
+
+        for obj in list(session.dirty) + list(session.deleted):
+            if isinstance(obj, User):
+                attrs = inspect(obj).attrs
+                if obj in session.deleted or any(attrs[f].history.has_changes() for f in USER_FIELDS):
+                    pending.add(obj.id)
+
+    def _apply_invalidation(self, session):
+        """После коммита сбросить записи здесь и оповестить другие воркеры"""
+        pending = session.info.pop(PENDING, None)
+        if not pending:
+            return
+
+        for user_id in pending:
+            self.invalidate_user(user_id)
+        self.invalidations += len(pending)
+
+        if self._counter is not None:
+            self._counter.bump()
+
+    def _discard_changes(self, session):
+        """Изменения откатились - сбрасывать нечего"""
+        session.info.pop(PENDING, None)
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        return {
+            'tokens': len(self._tokens),
+            'users': len(self._users),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
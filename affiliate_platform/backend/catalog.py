@@ -0,0 +1,248 @@
+"""
+Версия каталога офферов для ETag и условных GET
+"""
+import bisect
+import threading
+from collections import namedtuple
+from functools import wraps
+
+from flask import make_response, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .models import Offer
+from . import pagination, serializers
+from .shared_counter import SharedCounter
+
+
+# Активный оффер в кеше: поля фильтров и готовый JSON-объект (str)
+CachedOffer = namedtuple('CachedOffer', ['id', 'category', 'company_id', 'body'])
+
+# Снимок каталога для одного поколения
+Snapshot = namedtuple('Snapshot', ['generation', 'ids', 'offers', 'by_id'])
+
+
+class CatalogVersion:
+    """Поколение каталога офферов, общее для всех воркеров (SharedCounter)
+
+    Любой коммит, который создаёт, меняет или удаляет оффер, увеличивает
+    счётчик. Если файл счётчика недоступен, условные GET отключаются.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._counter = None
+
+        # Счётчики
+        self.not_modified = 0
+        self.bumps = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('CATALOG_VERSION_FILE', None)
+        app.config.setdefault('CATALOG_MAX_AGE', 60)
+
+        self.app = app
+        app.extensions['catalog_version'] = self
+
+        if app.config['CATALOG_VERSION_FILE']:
+            try:
+                self._counter = SharedCounter(app.config['CATALOG_VERSION_FILE'])
+            except OSError as e:
+                app.logger.warning(f"Версия каталога недоступна, ETag отключены: {e}")
+
+        event.listen(Session, 'after_flush', self._collect_changes)
+        event.listen(Session, 'after_commit', self._apply_changes)
+        event.listen(Session, 'after_rollback', self._discard_changes)
+
+    def current(self):
+        """Текущее поколение (None, если счётчик недоступен)"""
+        if self._counter is None:
+            return None
+        return self._counter.current()
+
+    def bump(self):
+        """Увеличить поколение после изменения офферов"""
+        if self._counter is None:
+            return
+
+        self._counter.bump()
+        self.bumps += 1
+
+    def etag(self):
+        """ETag для текущего поколения"""
+        version = self.current()
+        return None if version is None else f'catalog-{version:x}'
+
+    def conditional(self, f):
+        """Декоратор публичных GET каталога: ETag, 304 и Cache-Control
+
+        If-None-Match сравнивается с поколением до вызова view, поэтому
+        ответ 304 не обращается к БД.
+        """
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            # Поколение читается до запроса к БД: если оффер изменится
+            # в процессе, ответ уйдёт со старым ETag и обновится позже
+            etag = self.etag()
+            if etag is None:
+                return f(*args, **kwargs)
+
+            if request.if_none_match.contains(etag):
+                self.not_modified += 1
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = self.app.config['CATALOG_MAX_AGE']
+            return response
+
+        return decorated
+
+    def _collect_changes(self, session, flush_context):
+        """Отметить сессию, если во flush участвовали офферы"""
+        if any(isinstance(obj, Offer) for obj in (*session.new, *session.dirty, *session.deleted)):
+            session.info['catalog_changed'] = True
+
+    def _apply_changes(self, session):
+        """Увеличить поколение после успешного коммита"""
+        if session.info.pop('catalog_changed', False):
+            self.bump()
+
+    def _discard_changes(self, session):
+        """Изменения откатились - каталог прежний"""
+        session.info.pop('catalog_changed', None)
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        return {
+            'version': self.current(),
+            'bumps': self.bumps,
+            'not_modified': self.not_modified
+        }
+
+
+class CatalogCache:
+    """Кеш сериализованных активных офферов в памяти воркера
+
+    Хранит JSON каждого активного оффера, отсортированные по id. Снимок
+    действителен, пока не изменилось поколение CatalogVersion, поэтому
+    правка оффера в одном воркере сбрасывает кеш во всех. Страницы
+    /api/offers собираются из готового JSON без обращения к БД.
+    """
+
+    def __init__(self, version, app=None):
+        self.version = version
+        self.app = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+        # Счётчики
+        self.hits = 0
+        self.reloads = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('CATALOG_CACHE', True)
+
+        self.app = app
+        app.extensions['catalog_cache'] = self
+
+    def _current(self):
+        """Снимок для текущего поколения (None, если кеш отключён)"""
+        generation = self.version.current()
+        if generation is None or not self.app.config['CATALOG_CACHE']:
+            return None
+
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.generation == generation:
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            # Пока ждали блокировку, снимок мог загрузить соседний поток
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.generation == generation:
+                self.hits += 1
+                return snapshot
+
+            # Поколение прочитано до запроса: изменение во время загрузки
+            # увеличит его, и следующий запрос загрузит снимок заново
+            projection = serializers.OFFER
+            offers = [
+                CachedOffer(row.id, row.category, row.company_id, projection.encode(row))
+                for row in projection.query().filter_by(is_active=True).order_by(Offer.id)
+            ]
+            snapshot = Snapshot(
+                generation=generation,
+                ids=[offer.id for offer in offers],
+                offers=offers,
+                by_id={offer.id: offer for offer in offers}
+            )
+            self._snapshot = snapshot
+            self.reloads += 1
+
+        return snapshot
+
+    def offers_page(self, limit, cursor=None, category=None, company_id=None):
+        """Тело ответа GET /api/offers (None, если кеш отключён)
+
+        Повторяет выборку pagination.paginate: id > курсора, по возрастанию id.
+        При некорректном курсоре - ValueError.
+        """
+        snapshot = self._current()
+        if snapshot is None:
+            return None
+
+        start = 0
+        if cursor:
+            # decode_cursor пропускает для Offer.id только int: bisect
+            # по списку id не сравнивает его со строкой или None
+            last_id, = pagination.decode_cursor(cursor, (Offer.id,))
+            start = bisect.bisect_right(snapshot.ids, last_id)
+
+        items = []
+        for offer in snapshot.offers[start:]:
+            if category is not None and offer.category != category:
+                continue
+            if company_id is not None and offer.company_id != company_id:
+                continue
+            items.append(offer)
+            if len(items) > limit:
+                break
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = pagination.encode_cursor([items[-1].id])
+
+        return serializers.page([offer.body for offer in items], next_cursor)
+
+    def offer(self, offer_id):
+        """Тело ответа GET /api/offers/<id> (None - оффера нет в кеше)"""
+        snapshot = self._current()
+        if snapshot is None:
+            return None
+
+        offer = snapshot.by_id.get(offer_id)
+        return (offer.body + '\n').encode() if offer is not None else None
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        snapshot = self._snapshot
+        return {
+            'size': len(snapshot.offers) if snapshot else 0,
+            'generation': snapshot.generation if snapshot else None,
+            'hits': self.hits,
+            'reloads': self.reloads
+        }
@@ -0,0 +1,144 @@
+"""
+Отсев повторных кликов в скользящем окне с фиксированной памятью
+"""
+import hashlib
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray: ложноположительные ответы возможны, ложноотрицательные - нет"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного digest
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def contains(self, digest):
+        """Возможно, digest уже добавлен"""
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(digest))
+
+    def add(self, digest):
+        """Добавить digest"""
+        bits = self.bits
+        for p in self._positions(digest):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def clear(self):
+        """Очистить фильтр"""
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class ClickDeduplicator:
+    """Повторные клики (ip, user_agent, tracking_code) без обращения к БД
+
+    Два фильтра Блума сменяют друг друга каждые CLICK_DEDUP_WINDOW секунд:
+    клик повторный, если такой же был в текущем или предыдущем поколении,
+    то есть не раньше чем window (и не позже чем 2 * window) секунд назад.
+    Память фиксирована и задаётся CLICK_DEDUP_CAPACITY (кликов за окно)
+    и CLICK_DEDUP_ERROR_RATE. Если за окно пришло больше CLICK_DEDUP_CAPACITY
+    кликов, поколение сменяется раньше: переполненный фильтр отвечал бы
+    "повтор" почти на любой клик, а так окно лишь сокращается.
+    Состояние своё у каждого воркера.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._current = None
+        self._previous = None
+        self._rotated_at = None
+        self._lock = threading.Lock()
+
+        # Счётчики
+        self.checked = 0
+        self.duplicates = 0
+        self.rotations = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('CLICK_DEDUP_MODE', 'flag')  # flag, skip или off
+        app.config.setdefault('CLICK_DEDUP_WINDOW', 300)
+        app.config.setdefault('CLICK_DEDUP_CAPACITY', 100000)
+        app.config.setdefault('CLICK_DEDUP_ERROR_RATE', 0.001)
+
+        if app.config['CLICK_DEDUP_MODE'] not in ('flag', 'skip', 'off'):
+            raise ValueError(f"CLICK_DEDUP_MODE: неизвестный режим {app.config['CLICK_DEDUP_MODE']!r}")
+
+        self.app = app
+        app.extensions['click_dedup'] = self
+
+        capacity = app.config['CLICK_DEDUP_CAPACITY']
+        error_rate = app.config['CLICK_DEDUP_ERROR_RATE']
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = BloomFilter(capacity, error_rate)
+        self._rotated_at = time.monotonic()
+
+    @property
+    def mode(self):
+        """Режим: flag - записать с is_duplicate, skip - не записывать, off - не проверять"""
+        return self.app.config['CLICK_DEDUP_MODE']
+
+    def is_duplicate(self, ip_address, user_agent, tracking_code):
+        """Был ли такой клик в окне; клик запоминается"""
+        if self.mode == 'off':
+            return False
+
+        # Ключ - один digest: ip, хеш user_agent и код ссылки
+        agent = hashlib.blake2b((user_agent or '').encode(), digest_size=8).digest()
+        digest = hashlib.blake2b(
+            f"{ip_address}\x00{tracking_code}\x00".encode() + agent, digest_size=16
+        ).digest()
+
+        with self._lock:
+            self._rotate()
+            self.checked += 1
+            if self._current.contains(digest) or self._previous.contains(digest):
+                self.duplicates += 1
+                return True
+            self._current.add(digest)
+            return False
+
+    def _rotate(self):
+        """Сменить поколение, если окно истекло или текущий фильтр заполнен"""
+        now = time.monotonic()
+        elapsed = now - self._rotated_at
+        window = self.app.config['CLICK_DEDUP_WINDOW']
+        if elapsed < window and self._current.count < self._current.capacity:
+            return
+
+        if elapsed >= 2 * window:
+            # Кликов не было дольше двух окон - оба поколения устарели
+            self._previous.clear()
+        else:
+            self._previous, self._current = self._current, self._previous
+        self._current.clear()
+        self._rotated_at = now
+        self.rotations += 1
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        return {
+            'mode': self.mode,
+            'window': self.app.config['CLICK_DEDUP_WINDOW'],
+            'checked': self.checked,
+            'duplicates': self.duplicates,
+            'rotations': self.rotations,
+            'current_generation': self._current.count,
+            'capacity': self._current.capacity,
+            'memory_bytes': len(self._current.bits) + len(self._previous.bits)
+        }
@@ -0,0 +1,186 @@
+"""
+Буферизованная запись кликов (write-behind) для /track/<tracking_code>
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+from .models import db, utcnow, Click
+from . import dimensions, rollups, sketches
+
+
+class ClickWriter:
+    """Очередь кликов в памяти процесса с пакетной записью в БД
+
+    Клики складываются в ограниченную очередь и записываются фоновым потоком
+    одной транзакцией, когда набирается CLICK_BATCH_SIZE строк или проходит
+    CLICK_FLUSH_INTERVAL секунд. Редирект не ждёт записи в SQLite.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+        # Счётчики
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_flush_at = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('CLICK_WRITE_BEHIND', True)
+        app.config.setdefault('CLICK_BATCH_SIZE', 200)
+        app.config.setdefault('CLICK_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('CLICK_QUEUE_MAX', 10000)
+
+        self.app = app
+        app.extensions['click_writer'] = self
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        """Запустить фоновый поток (лениво, уже внутри воркера gunicorn)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+
+            # После fork очередь и поток родителя недействительны
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.app.config['CLICK_QUEUE_MAX'])
+                self._pid = os.getpid()
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='click-writer', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, row):
+        """Поставить клик в очередь на запись
+
+        row - словарь с колонками Click. Возвращает False, если клик отброшен.
+        """
+        row.setdefault('clicked_at', utcnow())
+
+        if not self.app.config['CLICK_WRITE_BEHIND']:
+            self._write([row])
+            return True
+
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.enqueued += 1
+        return True
+
+    def _drain(self, limit):
+        """Забрать из очереди до limit строк без ожидания"""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Цикл фонового потока"""
+        batch_size = self.app.config['CLICK_BATCH_SIZE']
+        interval = self.app.config['CLICK_FLUSH_INTERVAL']
+
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + interval
+
+            while len(batch) < batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            self._write(batch)
+
+    def _write(self, rows):
+        """Записать пачку кликов одной транзакцией"""
+        if not rows:
+            return
+
+        # Те же обрезанные значения UTM попадут и в суточные агрегаты
+        rows = [dimensions.clip(row) for row in rows]
+
+        with self._write_lock, self.app.app_context():
+            try:
+                db.session.execute(insert(Click), dimensions.encode_clicks(rows))
+                rollups.record_clicks(rows)
+                sketches.record_clicks(rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.dropped += len(rows)
+                self.app.logger.error(f"Ошибка записи {len(rows)} кликов: {e}")
+                return
+            finally:
+                db.session.remove()
+
+        self.written += len(rows)
+        self.flushes += 1
+        self.last_flush_at = utcnow()
+
+    def flush(self):
+        """Синхронно записать всё, что накопилось в очереди"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+
+        batch_size = self.app.config['CLICK_BATCH_SIZE']
+        while True:
+            batch = self._drain(batch_size)
+            if not batch:
+                break
+            self._write(batch)
+
+    def shutdown(self):
+        """Остановить фоновый поток и дописать очередь (при завершении воркера)"""
+        if self._pid != os.getpid():
+            return
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.app.config['CLICK_FLUSH_INTERVAL'] * 2 + 1)
+        self.flush()
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        return {
+            'queue_depth': self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None
+        }
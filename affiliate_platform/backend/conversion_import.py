@@ -0,0 +1,214 @@
+"""
+Пакетная загрузка конверсий от рекламодателя (JSON-массив или NDJSON)
+"""
+import json
+import math
+from itertools import islice
+
+from sqlalchemy import insert, or_
+from sqlalchemy.exc import DataError, IntegrityError
+
+from .models import db, utcnow, Money, Offer, AffiliateLink, Conversion
+from . import rollups
+
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonlines', 'application/x-jsonlines')
+
+# Попыток записать пачку, которой мешают параллельные загрузки
+CHUNK_ATTEMPTS = 3
+
+
+class InvalidRow:
+    """Строка NDJSON, которая не разобралась как JSON"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def read_rows(request):
+    """Строки загрузки из тела запроса
+
+    NDJSON читается из потока построчно, не загружая тело целиком.
+    JSON - массив объектов или {"conversions": [...]}. Некорректное тело -
+    ValueError.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        return _read_ndjson(request.stream)
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('conversions')
+    if not isinstance(data, list):
+        raise ValueError('Ожидается JSON-массив конверсий или NDJSON')
+    return iter(data)
+
+
+def _read_ndjson(stream):
+    """Объекты NDJSON по строкам; некорректная строка - InvalidRow"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield InvalidRow(f'Некорректный JSON: {e}')
+
+
+def ingest(rows, company_id, chunk_size):
+    """Загрузить конверсии пачками по chunk_size строк, каждая - отдельной транзакцией
+
+    Принимаются только ссылки на офферы компании company_id. Конверсии
+    с уже известным order_id пропускаются. Пачка, которую не удалось
+    записать за CHUNK_ATTEMPTS попыток, возвращается ошибками по строкам.
+    Генерирует результат по каждой строке в порядке загрузки.
+    """
+    commissions = {}
+    rows = enumerate(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+
+        for _ in range(CHUNK_ATTEMPTS):
+            try:
+                results = _ingest_chunk(chunk, company_id, commissions)
+                break
+            except IntegrityError:
+                # Тот же order_id только что записал параллельный запрос:
+                # после отката он уже виден и попадёт в дубликаты
+                db.session.rollback()
+            except DataError:
+                # Значение, которое СУБД не приняла: повтор не поможет
+                db.session.rollback()
+                results = [_chunk_error(index, row) for index, row in chunk]
+                break
+        else:
+            results = [_chunk_error(index, row) for index, row in chunk]
+
+        yield from results
+
+
+def _chunk_error(index, row):
+    """Результат строки пачки, которую не удалось записать"""
+    result = {'row': index, 'status': 'error', 'error': 'Не удалось записать пачку, повторите загрузку'}
+    if isinstance(row, dict) and isinstance(row.get('order_id'), str):
+        result['order_id'] = row['order_id']
+    return result
+
+
+def _by_link_id(row):
+    """Ссылка указана по id (иначе - по tracking_code)"""
+    return type(row.get('affiliate_link_id')) is int
+
+
+def _validate(row):
+    """Текст ошибки для некорректной строки или None"""
+    if isinstance(row, InvalidRow):
+        return row.error
+    if not isinstance(row, dict):
+        return 'Строка должна быть JSON-объектом'
+
+    order_id = row.get('order_id')
+    if not isinstance(order_id, str) or not order_id or len(order_id) > 100:
+        return 'Укажите order_id (строка до 100 символов)'
+
+    amount = row.get('sale_amount')
+    if (isinstance(amount, bool) or not isinstance(amount, (int, float))
+            or not math.isfinite(amount) or amount <= 0 or not Money.fits(amount)):
+        return f'sale_amount должен быть положительным числом меньше {Money.MAX}'
+
+    if not _by_link_id(row) and not isinstance(row.get('tracking_code'), str):
+        return 'Укажите affiliate_link_id или tracking_code'
+
+    return None
+
+
+def _ingest_chunk(chunk, company_id, commissions):
+    """Проверить и записать одну пачку строк, вернуть результаты"""
+    results = {}
+    valid = []
+    for index, row in chunk:
+        error = _validate(row)
+        if error:
+            results[index] = {'row': index, 'status': 'error', 'error': error}
+        else:
+            valid.append((index, row))
+
+    # Ссылки пачки одним запросом, только на офферы этой компании
+    link_ids = {row['affiliate_link_id'] for _, row in valid if _by_link_id(row)}
+    codes = {row['tracking_code'] for _, row in valid if not _by_link_id(row)}
+    links_by_id = {}
+    links_by_code = {}
+    if valid:
+        query = db.session.query(
+            AffiliateLink.id, AffiliateLink.tracking_code, AffiliateLink.partner_id, AffiliateLink.offer_id,
+            AffiliateLink.utm_source, AffiliateLink.utm_campaign
+        ).join(Offer, Offer.id == AffiliateLink.offer_id).filter(
+            Offer.company_id == company_id,
+            or_(AffiliateLink.id.in_(link_ids), AffiliateLink.tracking_code.in_(codes))
+        )
+        for link in query:
+            links_by_id[link.id] = link
+            links_by_code[link.tracking_code] = link
+
+    # Комиссии офферов считаются один раз на всю загрузку
+    offer_ids = {link.offer_id for link in links_by_id.values()} - commissions.keys()
+    if offer_ids:
+        for offer in Offer.query.filter(Offer.id.in_(offer_ids)):
+            commissions[offer.id] = offer.calculate_commission()
+
+    order_ids = {row['order_id'] for _, row in valid}
+    known = {
+        order_id for (order_id,) in db.session.query(Conversion.order_id).filter(
+            Conversion.order_id.in_(order_ids)
+        )
+    } if order_ids else set()
+
+    now = utcnow()
+    conversions = []
+    created = []
+    for index, row in valid:
+        order_id = row['order_id']
+        if _by_link_id(row):
+            link = links_by_id.get(row['affiliate_link_id'])
+        else:
+            link = links_by_code.get(row['tracking_code'])
+
+        if link is None:
+            results[index] = {'row': index, 'order_id': order_id, 'status': 'error', 'error': 'Ссылка не найдена'}
+            continue
+        if order_id in known:
+            results[index] = {'row': index, 'order_id': order_id, 'status': 'duplicate'}
+            continue
+
+        known.add(order_id)
+        commission = commissions[link.offer_id]
+        conversions.append({
+            'affiliate_link_id': link.id,
+            'partner_id': link.partner_id,
+            'offer_id': link.offer_id,
+            'order_id': order_id,
+            'sale_amount': row['sale_amount'],
+            'commission_amount': commission['partner_commission'],
+            'platform_fee': commission['platform_fee'],
+            'status': 'pending',
+            'created_at': now
+        })
+        created.append((index, order_id, link))
+
+    if conversions:
+        db.session.execute(insert(Conversion), conversions)
+        rollups.record_conversion_rows(
+            dict(conversion, utm_source=link.utm_source, utm_campaign=link.utm_campaign)
+            for conversion, (_, _, link) in zip(conversions, created)
+        )
+        ids = dict(db.session.query(Conversion.order_id, Conversion.id).filter(
+            Conversion.order_id.in_([order_id for _, order_id, _ in created])
+        ))
+        db.session.commit()
+
+        for index, order_id, _ in created:
+            results[index] = {'row': index, 'order_id': order_id, 'status': 'created', 'conversion_id': ids[order_id]}
+
+    return [results[index] for index, _ in chunk]
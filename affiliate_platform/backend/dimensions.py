@@ -0,0 +1,148 @@
+"""
+Справочники повторяющихся значений кликов: user_agent, referrer, набор UTM
+
+В таблицах кликов (clicks и архивных clicks_YYYYMM) хранятся только
+целочисленные id значений, IP - упакованным в 4 или 16 байт (PackedIP).
+Различных значений на порядки меньше, чем кликов, поэтому строка клика
+становится в несколько раз короче.
+"""
+from sqlalchemy import func, select, tuple_
+
+from .models import db, UserAgent, Referrer, UtmTuple
+from .serializers import UTM_FIELDS
+from . import rollups
+
+
+# Колонки кликов, вынесенные в справочники:
+# имя -> (таблица справочника, колонка с id в кликах, колонка значения)
+DECODED = {
+    'user_agent': (UserAgent.__table__, 'user_agent_id', 'value'),
+    'referrer': (Referrer.__table__, 'referrer_id', 'value'),
+    **{field: (UtmTuple.__table__, 'utm_id', field) for field in UTM_FIELDS}
+}
+
+# Длина колонки значения справочника (user_agent, referrer, поля UTM)
+LENGTHS = {name: table.c[value].type.length for name, (table, _, value) in DECODED.items()}
+
+LOOKUP_CHUNK = 500
+
+
+def clip(row):
+    """Клик со значениями справочников, обрезанными до длины их колонок
+
+    Длинный User-Agent или referrer от клиента иначе не поместился бы в
+    справочник, и в PostgreSQL INSERT отклонил бы всю пачку кликов.
+    """
+    if all(len(row.get(name) or '') <= length for name, length in LENGTHS.items()):
+        return row
+    return {
+        name: value[:LENGTHS[name]] if name in LENGTHS and isinstance(value, str) else value
+        for name, value in row.items()
+    }
+
+
+def select_columns(table, *names):
+    """SELECT колонок кликов names из table со значениями из справочников
+
+    table - clicks или архивная партиция. Справочники присоединяются
+    (LEFT JOIN) только те, чьи колонки запрошены; пустые UTM - NULL, как
+    до переноса в справочник.
+    """
+    source = table
+    joined = set()
+    columns = []
+    for name in names:
+        if name not in DECODED:
+            columns.append(table.c[name])
+            continue
+
+        dimension, key, value = DECODED[name]
+        if dimension.name not in joined:
+            source = source.outerjoin(dimension, dimension.c.id == table.c[key])
+            joined.add(dimension.name)
+
+        column = dimension.c[value]
+        if name in UTM_FIELDS:
+            column = func.nullif(column, '', type_=column.type)
+        columns.append(column.label(name))
+
+    return select(*columns).select_from(source)
+
+
+def utm_ids(utm):
+    """Подзапрос id наборов UTM с заданными значениями ({поле: значение})"""
+    table = UtmTuple.__table__
+    return select(table.c.id).where(*(table.c[field] == value for field, value in utm.items()))
+
+
+def _lookup(table, names, keys):
+    """{ключ: id} для имеющихся в справочнике ключей (кортежей значений names)"""
+    columns = [table.c[name] for name in names]
+    found = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        if len(columns) == 1:
+            condition = columns[0].in_([key[0] for key in chunk])
+        else:
+            condition = tuple_(*columns).in_(chunk)
+        for row in db.session.execute(select(table.c.id, *columns).where(condition)):
+            found[tuple(row[1:])] = row[0]
+    return found
+
+
+def _ids(table, names, keys):
+    """id значений справочника; недостающие добавляются
+
+    Вставка с ON CONFLICT DO NOTHING: то же значение может одновременно
+    добавлять другой воркер. Коммит делает вызывающий код.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    found = _lookup(table, names, keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for start in range(0, len(missing), LOOKUP_CHUNK):
+            db.session.execute(
+                rollups._insert(table).values([
+                    dict(zip(names, key)) for key in missing[start:start + LOOKUP_CHUNK]
+                ]).on_conflict_do_nothing(index_elements=[table.c[name] for name in names])
+            )
+        found.update(_lookup(table, names, missing))
+    return found
+
+
+def _utm_key(row):
+    """Ключ набора UTM клика или None, если меток нет"""
+    key = tuple(row.get(field) or '' for field in UTM_FIELDS)
+    return key if any(key) else None
+
+
+def encode_clicks(rows):
+    """Клики со строковыми значениями -> строки для INSERT в clicks
+
+    rows - словари с колонками клика, как их ставит в очередь /track
+    (user_agent, referrer, utm_*); в результате вместо них id справочников.
+    Слишком длинные значения обрезаются (см. clip). Справочники читаются
+    тремя запросами на пачку.
+    """
+    rows = [clip(row) for row in rows]
+    user_agents = _ids(UserAgent.__table__, ('value',), {
+        (row['user_agent'],) for row in rows if row.get('user_agent')
+    })
+    referrers = _ids(Referrer.__table__, ('value',), {
+        (row['referrer'],) for row in rows if row.get('referrer')
+    })
+    utms = _ids(UtmTuple.__table__, UTM_FIELDS, {
+        key for key in map(_utm_key, rows) if key is not None
+    })
+
+    encoded = []
+    for row in rows:
+        click = {name: value for name, value in row.items() if name not in DECODED}
+        click['user_agent_id'] = user_agents.get((row.get('user_agent'),))
+        click['referrer_id'] = referrers.get((row.get('referrer'),))
+        click['utm_id'] = utms.get(_utm_key(row))
+        encoded.append(click)
+    return encoded
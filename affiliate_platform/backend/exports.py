@@ -0,0 +1,178 @@
+"""
+Потоковая выгрузка кликов и конверсий в CSV и NDJSON
+
+Строки читаются с сервера пачками (yield_per, в PostgreSQL - серверный
+курсор) и сразу уходят в ответ кусками по CHUNK_SIZE, так что память
+не зависит от размера выгрузки.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+
+from .models import db, AffiliateLink, Click, Conversion
+from . import dimensions, partitions, stats
+from .serializers import Projection, UTM_FIELDS
+
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+BATCH_SIZE = 1000  # строк в одной выборке с сервера
+CHUNK_SIZE = 64 * 1024  # символов в одном куске ответа
+
+CLICK_FIELDS = (
+    'id', 'click_id', 'affiliate_link_id', 'partner_id', 'offer_id', 'ip_address', 'user_agent',
+    'referrer', 'clicked_at', 'is_duplicate'
+) + UTM_FIELDS
+
+CONVERSION_FIELDS = (
+    'id', 'affiliate_link_id', 'partner_id', 'offer_id', 'order_id', 'click_id', 'sale_amount',
+    'commission_amount', 'platform_fee', 'status', 'created_at', 'approved_at'
+)
+
+# NDJSON: поля как в to_dict, UTM только непустые
+CLICK = Projection(
+    *dimensions.select_columns(Click.__table__, *CLICK_FIELDS).selected_columns,
+    optional=UTM_FIELDS
+)
+
+# UTM конверсии берутся из ссылки
+CONVERSION = Projection(
+    *(Conversion.__table__.c[name] for name in CONVERSION_FIELDS),
+    *(AffiliateLink.__table__.c[name] for name in UTM_FIELDS),
+    optional=UTM_FIELDS
+)
+
+# Символы, с которых табличный редактор начинает формулу
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_args(args):
+    """Разобрать format, gzip, date_from, date_to и UTM-фильтры из query string
+
+    Возвращает (format, gzip, date_from, date_to, utm), при ошибке - ValueError.
+    """
+    date_from, date_to = stats.parse_period(args)
+
+    export_format = args.get('format', 'csv')
+    if export_format not in FORMATS:
+        raise ValueError(f"format: допустимые значения {', '.join(FORMATS)}")
+
+    compress = args.get('gzip', '').lower() in ('1', 'true')
+    utm = {field: args[field] for field in UTM_FIELDS if args.get(field)}
+    return export_format, compress, date_from, date_to, utm
+
+
+def _click_results(partner_id, company_id, date_from, date_to, utm):
+    """Клики по таблицам: архивные партиции от старых к новым, затем горячая
+
+    Каждая таблица читается в порядке id, запрос к следующей выполняется
+    только после того, как выгружена предыдущая.
+    """
+    for table in partitions.tables(date_from, date_to):
+        query = dimensions.select_columns(table, *CLICK_FIELDS).where(
+            *partitions.in_period(table, date_from, date_to)
+        )
+        if partner_id is not None:
+            query = query.where(table.c.partner_id == partner_id)
+        if company_id is not None:
+            query = query.where(table.c.offer_id.in_(stats.company_offers(company_id).scalar_subquery()))
+        if utm:
+            query = query.where(table.c.utm_id.in_(dimensions.utm_ids(utm)))
+
+        yield db.session.execute(query.order_by(table.c.id).execution_options(yield_per=BATCH_SIZE))
+
+
+def _conversion_results(partner_id, company_id, date_from, date_to, utm):
+    """Конверсии в порядке id с UTM ссылки"""
+    query = db.session.query(*CONVERSION.columns).join(
+        AffiliateLink, AffiliateLink.id == Conversion.affiliate_link_id
+    )
+    query = stats.filter_conversions(query, partner_id, company_id, date_from, date_to)
+    for field, value in utm.items():
+        query = query.filter(getattr(AffiliateLink, field) == value)
+
+    yield query.order_by(Conversion.id).yield_per(BATCH_SIZE)
+
+
+def _csv_value(value):
+    """Значение ячейки CSV"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        # user_agent, referrer и UTM приходят от посетителей: не даём им стать формулой
+        return "'" + value
+    return value
+
+
+def _csv(results, fields):
+    """Куски CSV с заголовком"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(fields)
+    for rows in results:
+        for row in rows:
+            writer.writerow([_csv_value(value) for value in row])
+            if buffer.tell() >= CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson(results, projection):
+    """Куски NDJSON: один JSON-объект на строку"""
+    encode = projection.encode
+    lines = []
+    size = 0
+    for rows in results:
+        for row in rows:
+            line = encode(row)
+            lines.append(line)
+            size += len(line) + 1
+            if size >= CHUNK_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+                size = 0
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip(chunks):
+    """Сжатие gzip на лету"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(kind, export_format, compress=False, partner_id=None, company_id=None,
+           date_from=None, date_to=None, utm=None):
+    """Генератор тела выгрузки (bytes); kind - clicks или conversions
+
+    Запросы выполняются при чтении генератора, поэтому в Flask его нужно
+    оборачивать в stream_with_context.
+    """
+    if kind == 'clicks':
+        results = _click_results(partner_id, company_id, date_from, date_to, utm or {})
+        fields, projection = CLICK_FIELDS, CLICK
+    else:
+        results = _conversion_results(partner_id, company_id, date_from, date_to, utm or {})
+        fields, projection = CONVERSION_FIELDS + UTM_FIELDS, CONVERSION
+
+    if export_format == 'csv':
+        text = _csv(results, fields)
+    else:
+        text = _ndjson(results, projection)
+
+    chunks = (chunk.encode() for chunk in text if chunk)
+    return _gzip(chunks) if compress else chunks
@@ -0,0 +1,274 @@
+"""
+Журнал баланса партнёров (ledger_entries) и смена статусов конверсий
+
+Баланс меняется только здесь и только вместе с записью в журнале:
+User.balance всегда равен сумме записей партнёра (см. check).
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, insert, select
+
+from .models import db, utcnow, User, AffiliateLink, Conversion, Payout, LedgerEntry
+from . import rollups, stats
+from .auth_cache import balance_changed
+
+
+# Виды записей журнала
+KINDS = {
+    'opening_balance': 'Баланс на момент перехода на журнал',
+    'conversion_approved': 'Комиссия за подтверждённую конверсию',
+    'conversion_reversed': 'Списание комиссии отклонённой после подтверждения конверсии',
+    'payout_requested': 'Списание по запросу выплаты',
+    'payout_failed': 'Возврат суммы неудавшейся выплаты'
+}
+
+# Допустимые переходы статуса конверсии: новый статус -> из каких
+TRANSITIONS = {
+    'approved': ('pending',),
+    'rejected': ('pending', 'approved'),
+    'paid': ('approved',)
+}
+
+# Переходы, меняющие баланс: (из, в) -> (вид записи, знак суммы комиссии)
+POSTINGS = {
+    ('pending', 'approved'): ('conversion_approved', 1),
+    ('approved', 'rejected'): ('conversion_reversed', -1)
+}
+
+SETTLE_BATCH = 1000
+
+
+class InsufficientFunds(Exception):
+    """На балансе партнёра меньше запрошенной суммы"""
+
+
+def _post(entries):
+    """Добавить записи в журнал и изменить балансы (без коммита)
+
+    entries - словари с колонками LedgerEntry. Записи вставляются одним
+    INSERT, баланс каждого партнёра меняется одним UPDATE
+    balance = balance + сумма его записей.
+    """
+    if not entries:
+        return
+
+    db.session.execute(insert(LedgerEntry), entries)
+
+    deltas = {}
+    for entry in entries:
+        deltas[entry['partner_id']] = deltas.get(entry['partner_id'], 0) + entry['amount']
+
+    users = User.__table__
+    db.session.execute(
+        users.update().where(users.c.id == bindparam('partner_id')).values(
+            balance=func.coalesce(users.c.balance, 0) + bindparam('delta')
+        ),
+        [{'partner_id': partner_id, 'delta': round(delta, 2)} for partner_id, delta in deltas.items()]
+    )
+    balance_changed(db.session, deltas)
+
+
+def request_payout(partner_id, amount, payment_method=None, payment_details=None):
+    """Создать выплату и списать её сумму с баланса (без коммита)
+
+    Списание - условный UPDATE ... WHERE balance >= amount: из двух
+    одновременных запросов на весь баланс пройдёт только один.
+    Если средств не хватает - InsufficientFunds.
+    """
+    users = User.__table__
+    result = db.session.execute(
+        users.update().where(users.c.id == partner_id, users.c.balance >= amount).values(
+            balance=users.c.balance - amount
+        )
+    )
+    if result.rowcount != 1:
+        raise InsufficientFunds()
+    balance_changed(db.session, [partner_id])
+
+    payout = Payout(
+        partner_id=partner_id,
+        amount=amount,
+        payment_method=payment_method,
+        payment_details=payment_details
+    )
+    db.session.add(payout)
+    db.session.flush()
+
+    db.session.execute(insert(LedgerEntry), [{
+        'partner_id': partner_id,
+        'kind': 'payout_requested',
+        'amount': -amount,
+        'payout_id': payout.id,
+        'created_at': utcnow()
+    }])
+    return payout
+
+
+def close_payout(payout_id, status):
+    """Завершить выплату: completed или failed (без коммита)
+
+    Статус меняется условным UPDATE только у незавершённой выплаты.
+    Для failed списанная при запросе сумма возвращается на баланс.
+    Возвращает False, если выплата не найдена или уже завершена.
+    """
+    if status not in ('completed', 'failed'):
+        raise ValueError(f"Недопустимый статус выплаты: {status}")
+
+    payouts = Payout.__table__
+    closed = db.session.execute(
+        payouts.update().where(
+            payouts.c.id == payout_id, payouts.c.status.in_(('pending', 'processing'))
+        ).values(status=status, completed_at=utcnow()).returning(payouts.c.partner_id)
+    ).first()
+    if closed is None:
+        return False
+
+    if status == 'failed':
+        # Выплаты, запрошенные до журнала, с баланса не списывались
+        debited = db.session.query(func.sum(LedgerEntry.amount)).filter(
+            LedgerEntry.payout_id == payout_id, LedgerEntry.kind == 'payout_requested'
+        ).scalar()
+        if debited:
+            _post([{
+                'partner_id': closed.partner_id,
+                'kind': 'payout_failed',
+                'amount': -debited,
+                'payout_id': payout_id,
+                'created_at': utcnow()
+            }])
+    return True
+
+
+def _transition(conditions, old_status, new_status, now):
+    """Перевести конверсии old_status -> new_status одним UPDATE (без коммита)
+
+    conditions - дополнительные условия WHERE по таблице conversions.
+    UPDATE ... RETURNING отдаёт затронутые строки; по ним одним INSERT
+    добавляются записи журнала (если переход меняет баланс), балансы
+    меняются по партнёрам, комиссии переносятся между колонками статусов
+    суточных агрегатов. Конверсию, чей статус успел смениться, условие
+    status = old_status не пропустит. Возвращает затронутые строки.
+    """
+    conversions = Conversion.__table__
+    values = {'status': new_status}
+    if new_status == 'approved':
+        values['approved_at'] = now
+
+    rows = db.session.execute(
+        conversions.update().where(conversions.c.status == old_status, *conditions).values(**values).returning(
+            conversions.c.id, conversions.c.partner_id, conversions.c.offer_id,
+            conversions.c.affiliate_link_id, conversions.c.commission_amount, conversions.c.created_at
+        )
+    ).all()
+    if not rows:
+        return rows
+
+    if (old_status, new_status) in POSTINGS:
+        kind, sign = POSTINGS[(old_status, new_status)]
+        _post([{
+            'partner_id': row.partner_id,
+            'kind': kind,
+            'amount': sign * row.commission_amount,
+            'conversion_id': row.id,
+            'created_at': now
+        } for row in rows])
+
+    links = dict(db.session.query(
+        AffiliateLink.id, AffiliateLink
+    ).filter(AffiliateLink.id.in_({row.affiliate_link_id for row in rows})))
+    rollups.record_status_changes(({
+        'created_at': row.created_at,
+        'partner_id': row.partner_id,
+        'offer_id': row.offer_id,
+        'commission_amount': row.commission_amount,
+        'status': old_status,
+        'utm_source': links[row.affiliate_link_id].utm_source,
+        'utm_campaign': links[row.affiliate_link_id].utm_campaign
+    } for row in rows), new_status)
+
+    return rows
+
+
+def change_status(company_id, new_status, ids=None, offer_id=None, date_from=None, date_to=None,
+                  status=None, now=None):
+    """Сменить статус конверсий по офферам компании (без коммита)
+
+    Конверсии выбираются по списку ids или по фильтру (offer_id, период
+    создания, текущий status); конверсии чужих офферов не затрагиваются.
+    На каждый допустимый исходный статус (см. TRANSITIONS) - один UPDATE.
+    Возвращает {исходный статус: (число конверсий, сумма комиссий)}.
+    Недопустимый переход - ValueError.
+    """
+    if new_status not in TRANSITIONS:
+        raise ValueError(f"status: допустимые значения {', '.join(TRANSITIONS)}")
+
+    old_statuses = TRANSITIONS[new_status]
+    if status is not None:
+        if status not in old_statuses:
+            raise ValueError(f"Переход {status} -> {new_status} недопустим")
+        old_statuses = (status,)
+
+    conversions = Conversion.__table__
+    conditions = [conversions.c.offer_id.in_(stats.company_offers(company_id).scalar_subquery())]
+    if ids is not None:
+        conditions.append(conversions.c.id.in_(ids))
+    if offer_id is not None:
+        conditions.append(conversions.c.offer_id == offer_id)
+    if date_from:
+        conditions.append(conversions.c.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        conditions.append(conversions.c.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+
+    now = now or utcnow()
+    changed = {}
+    for old_status in old_statuses:
+        rows = _transition(conditions, old_status, new_status, now)
+        changed[old_status] = (len(rows), round(sum((row.commission_amount for row in rows), 0.0), 2))
+    return changed
+
+
+def settle(hold_days, batch_size=SETTLE_BATCH, now=None):
+    """Подтвердить pending-конверсии старше hold_days дней и начислить комиссии
+
+    Каждая пачка из batch_size конверсий - одна транзакция (см. _transition).
+    Возвращает (число конверсий, сумма начислений).
+    """
+    now = now or utcnow()
+    conversions = Conversion.__table__
+    cutoff = conversions.c.created_at < now - timedelta(days=hold_days)
+
+    count = 0
+    total = 0.0
+    while True:
+        candidates = select(conversions.c.id).where(
+            conversions.c.status == 'pending', cutoff
+        ).order_by(conversions.c.id).limit(batch_size)
+        approved = _transition(
+            [conversions.c.id.in_(candidates.scalar_subquery()), cutoff], 'pending', 'approved', now
+        )
+        # Коммит и для пустой пачки: иначе транзакция последнего UPDATE
+        # осталась бы открытой и держала блокировку записи SQLite
+        db.session.commit()
+        if not approved:
+            break
+
+        count += len(approved)
+        total += sum(row.commission_amount for row in approved)
+
+    return count, round(total, 2)
+
+
+def check():
+    """Партнёры, у которых User.balance не равен сумме записей журнала
+
+    Возвращает список (partner_id, balance, сумма журнала).
+    """
+    ledger = db.session.query(
+        LedgerEntry.partner_id, func.sum(LedgerEntry.amount).label('total')
+    ).group_by(LedgerEntry.partner_id).subquery()
+
+    rows = db.session.query(
+        User.id, func.coalesce(User.balance, 0), func.coalesce(ledger.c.total, 0)
+    ).outerjoin(ledger, ledger.c.partner_id == User.id)
+
+    return [(user_id, balance, total) for user_id, balance, total in rows if round(balance - total, 2) != 0]
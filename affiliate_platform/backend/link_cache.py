@@ -0,0 +1,218 @@
+"""
+Кеш разрешения tracking_code для горячего пути /track/<tracking_code>
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .models import db, Offer, AffiliateLink
+from .shared_counter import SharedCounter
+
+
+# Всё, что нужно редиректу, без обращения к ORM
+ResolvedLink = namedtuple('ResolvedLink', ['link_id', 'partner_id', 'offer_id', 'product_url', 'is_active'])
+
+# Поля, изменение которых делает запись кеша устаревшей
+OFFER_FIELDS = ('product_url', 'is_active')
+LINK_FIELDS = ('tracking_code', 'partner_id', 'offer_id', 'is_active')
+
+
+class TrackingCache:
+    """Ограниченный LRU-кеш с TTL: tracking_code -> ResolvedLink
+
+    Записи сбрасываются после коммита, который меняет product_url/is_active
+    оффера или деактивирует ссылку; такой коммит увеличивает общий счётчик
+    TRACKING_VERSION_FILE, и при следующем запросе каждый воркер очищает
+    свой кеш. Без файла счётчика в других воркерах запись живёт не дольше
+    TRACKING_CACHE_TTL секунд.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._counter = None
+        self._generation = None
+        self._entries = OrderedDict()
+        self._by_offer = {}
+        self._lock = threading.Lock()
+
+        # Счётчики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('TRACKING_CACHE_SIZE', 10000)
+        app.config.setdefault('TRACKING_CACHE_TTL', 60)
+        app.config.setdefault('TRACKING_VERSION_FILE', None)
+
+        self.app = app
+        app.extensions['tracking_cache'] = self
+
+        if app.config['TRACKING_VERSION_FILE']:
+            try:
+                self._counter = SharedCounter(app.config['TRACKING_VERSION_FILE'])
+            except OSError as e:
+                app.logger.warning(f"Общий счётчик кеша ссылок недоступен: {e}")
+
+        event.listen(Session, 'after_flush', self._collect_changes)
+        event.listen(Session, 'after_commit', self._apply_invalidation)
+        event.listen(Session, 'after_rollback', self._discard_changes)
+
+    def get(self, tracking_code):
+        """Получить запись из кеша (None при промахе или истёкшем TTL)"""
+        self._check_generation()
+
+        with self._lock:
+            entry = self._entries.get(tracking_code)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            resolved, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(tracking_code)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(tracking_code)
+            self.hits += 1
+            return resolved
+
+    def put(self, tracking_code, resolved):
+        """Положить запись в кеш, вытеснив самую старую при переполнении"""
+        expires_at = time.monotonic() + self.app.config['TRACKING_CACHE_TTL']
+
+        with self._lock:
+            self._remove(tracking_code)
+            self._entries[tracking_code] = (resolved, expires_at)
+            self._by_offer.setdefault(resolved.offer_id, set()).add(tracking_code)
+
+            while len(self._entries) > self.app.config['TRACKING_CACHE_SIZE']:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def resolve(self, tracking_code):
+        """Разрешить tracking_code: из кеша или одним запросом к БД"""
+        resolved = self.get(tracking_code)
+        if resolved is not None:
+            return resolved
+
+        row = db.session.query(
+            AffiliateLink.id,
+            AffiliateLink.partner_id,
+            AffiliateLink.offer_id,
+            Offer.product_url,
+            AffiliateLink.is_active,
+            Offer.is_active
+        ).join(Offer, Offer.id == AffiliateLink.offer_id).filter(
+            AffiliateLink.tracking_code == tracking_code
+        ).first()
+
+        if row is None:
+            return None
+
+        link_id, partner_id, offer_id, product_url, link_active, offer_active = row
+        resolved = ResolvedLink(
+            link_id=link_id,
+            partner_id=partner_id,
+            offer_id=offer_id,
+            product_url=product_url,
+            is_active=bool(link_active) and bool(offer_active)
+        )
+        self.put(tracking_code, resolved)
+        return resolved
+
+    def invalidate_code(self, tracking_code):
+        """Сбросить запись по tracking_code"""
+        with self._lock:
+            self._remove(tracking_code)
+
+    def invalidate_offer(self, offer_id):
+        """Сбросить все записи ссылок оффера"""
+        with self._lock:
+            for tracking_code in list(self._by_offer.get(offer_id, ())):
+                self._remove(tracking_code)
+
+    def clear(self):
+        """Очистить кеш"""
+        with self._lock:
+            self._entries.clear()
+            self._by_offer.clear()
+
+    def _check_generation(self):
+        """Очистить кеш, если офферы или ссылки изменил другой воркер"""
+        if self._counter is None:
+            return
+
+        generation = self._counter.current()
+        if generation != self._generation:
+            self.clear()
+            self._generation = generation
+
+    def _remove(self, tracking_code):
+        """Удалить запись (вызывается под блокировкой)"""
+        entry = self._entries.pop(tracking_code, None)
+        if entry is None:
+            return
+
+        codes = self._by_offer.get(entry[0].offer_id)
+        if codes is not None:
+            codes.discard(tracking_code)
+            if not codes:
+                del self._by_offer[entry[0].offer_id]
+
+    def _collect_changes(self, session, flush_context):
+        """Запомнить изменённые офферы и ссылки до коммита"""
+        pending = session.info.setdefault('tracking_cache_pending', {'offers': set(), 'codes': set()})
+
+        for obj in list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Offer):
+                if obj in session.deleted or _changed(obj, OFFER_FIELDS):
+                    pending['offers'].add(obj.id)
+            elif isinstance(obj, AffiliateLink):
+                if obj in session.deleted or _changed(obj, LINK_FIELDS):
+                    pending['codes'].add(obj.tracking_code)
+                    for value in inspect(obj).attrs.tracking_code.history.deleted:
+                        pending['codes'].add(value)
+
+    def _apply_invalidation(self, session):
+        """Сбросить записи здесь после успешного коммита и оповестить другие воркеры"""
+        pending = session.info.pop('tracking_cache_pending', None)
+        if not pending or not (pending['offers'] or pending['codes']):
+            return
+
+        for offer_id in pending['offers']:
+            self.invalidate_offer(offer_id)
+        for tracking_code in pending['codes']:
+            self.invalidate_code(tracking_code)
+
+        if self._counter is not None:
+            self._counter.bump()
+
+    def _discard_changes(self, session):
+        """Изменения откатились - сбрасывать нечего"""
+        session.info.pop('tracking_cache_pending', None)
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        return {
+            'size': len(self._entries),
+            'generation': self._generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+def _changed(obj, fields):
+    """Изменилось ли хотя бы одно из полей объекта"""
+    attrs = inspect(obj).attrs
+    return any(attrs[field].history.has_changes() for field in fields)
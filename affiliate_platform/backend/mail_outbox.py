@@ -0,0 +1,237 @@
+"""
+Очередь исходящих писем (outbox) и фоновая отправка через SMTP
+"""
+import os
+import smtplib
+import threading
+import uuid
+from datetime import timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import and_, event, or_
+from sqlalchemy.orm import Session
+
+from .models import db, utcnow, EmailOutbox
+
+
+class MailOutbox:
+    """Письма пишутся в таблицу email_outbox в транзакции запроса
+
+    Фоновый поток каждого воркера забирает готовые письма пачкой
+    (условным UPDATE, поэтому одно письмо не отправят два воркера)
+    и отправляет их через одно SMTP-соединение с таймаутом. Неудачные
+    попытки повторяются с экспоненциальной задержкой, после
+    MAIL_MAX_ATTEMPTS письмо помечается failed.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._thread = None
+        self._smtp = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+        # Счётчики
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.connections = 0
+        self.last_error = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('MAIL_ENABLED', False)
+        app.config.setdefault('MAIL_TIMEOUT', 10)
+        app.config.setdefault('MAIL_OUTBOX_INTERVAL', 5)
+        app.config.setdefault('MAIL_OUTBOX_BATCH', 50)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_RETRY_BASE', 30)
+        app.config.setdefault('MAIL_RETRY_MAX', 3600)
+        app.config.setdefault('MAIL_CLAIM_TIMEOUT', 300)
+
+        self.app = app
+        app.extensions['mail_outbox'] = self
+
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+        if app.config['MAIL_ENABLED']:
+            app.before_request(self._ensure_started)
+
+    def enqueue(self, recipient, subject, html):
+        """Добавить письмо в текущую транзакцию (отправится после коммита)"""
+        message = EmailOutbox(recipient=recipient, subject=subject, html=html)
+        db.session.add(message)
+        db.session.info['mail_outbox_wake'] = True
+        return message
+
+    def _after_commit(self, session):
+        """Разбудить отправителя, если в транзакции были письма"""
+        if session.info.pop('mail_outbox_wake', False):
+            self._wake.set()
+
+    def _after_rollback(self, session):
+        session.info.pop('mail_outbox_wake', None)
+
+    def _ensure_started(self):
+        """Запустить поток отправки (лениво, уже внутри воркера gunicorn)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._smtp = None
+            self._thread = threading.Thread(target=self._run, name='mail-outbox', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Цикл фонового потока: отправлять, пока есть готовые письма"""
+        while True:
+            self._wake.wait(self.app.config['MAIL_OUTBOX_INTERVAL'])
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.last_error = str(e)
+                self.app.logger.warning(f"Ошибка отправки писем: {e}")
+
+    def flush(self):
+        """Отправлять пачки, пока есть готовые письма, затем закрыть соединение
+
+        Возвращает количество обработанных писем.
+        """
+        processed = 0
+        try:
+            while True:
+                count = self.process()
+                if not count:
+                    return processed
+                processed += count
+        finally:
+            self._disconnect()
+
+    def process(self):
+        """Забрать пачку готовых писем и отправить её
+
+        Соединение остаётся открытым до конца цикла отправки.
+        Возвращает количество обработанных писем.
+        """
+        with self._send_lock, self.app.app_context():
+            messages = self._claim()
+            if not messages:
+                return 0
+
+            for message in messages:
+                self._send(message)
+
+            db.session.commit()
+            return len(messages)
+
+    def _claim(self):
+        """Пометить готовые письма как sending и вернуть их"""
+        config = self.app.config
+        now = utcnow()
+        token = uuid.uuid4().hex
+
+        ready = or_(
+            and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+            # Отправитель умер, не закончив пачку
+            and_(EmailOutbox.status == 'sending',
+                 EmailOutbox.claimed_at < now - timedelta(seconds=config['MAIL_CLAIM_TIMEOUT']))
+        )
+        candidates = db.session.query(EmailOutbox.id).filter(ready).order_by(EmailOutbox.id).limit(
+            config['MAIL_OUTBOX_BATCH']
+        )
+
+        db.session.query(EmailOutbox).filter(EmailOutbox.id.in_(candidates.scalar_subquery()), ready).update(
+            {'status': 'sending', 'claim_token': token, 'claimed_at': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        return EmailOutbox.query.filter_by(claim_token=token, status='sending').order_by(EmailOutbox.id).all()
+
+    def _send(self, message):
+        """Отправить одно письмо и записать результат (без коммита)"""
+        config = self.app.config
+        message.attempts = (message.attempts or 0) + 1
+
+        try:
+            self._connection().send_message(self._build(message))
+        except (smtplib.SMTPException, OSError) as e:
+            permanent = isinstance(e, smtplib.SMTPRecipientsRefused) or (
+                isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+            )
+            # Соединение могло оборваться - следующее письмо откроет новое
+            self._disconnect()
+
+            message.last_error = str(e)[:500]
+            self.last_error = message.last_error
+            if permanent or message.attempts >= config['MAIL_MAX_ATTEMPTS']:
+                message.status = 'failed'
+                self.failed += 1
+            else:
+                delay = min(config['MAIL_RETRY_BASE'] * 2 ** (message.attempts - 1), config['MAIL_RETRY_MAX'])
+                message.status = 'pending'
+                message.next_attempt_at = utcnow() + timedelta(seconds=delay)
+                self.retried += 1
+            return
+
+        message.status = 'sent'
+        message.sent_at = utcnow()
+        message.last_error = None
+        self.sent += 1
+
+    def _build(self, message):
+        """EmailMessage из строки outbox"""
+        email = EmailMessage()
+        email['From'] = self.app.config['MAIL_DEFAULT_SENDER']
+        email['To'] = message.recipient
+        email['Subject'] = message.subject
+        email.set_content(message.html, subtype='html')
+        return email
+
+    def _connection(self):
+        """Открытое SMTP-соединение (одно на всю пачку писем)"""
+        if self._smtp is None:
+            config = self.app.config
+            smtp = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
+            try:
+                if config.get('MAIL_USE_TLS'):
+                    smtp.starttls()
+                if config.get('MAIL_USERNAME'):
+                    smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self.connections += 1
+        return self._smtp
+
+    def _disconnect(self):
+        """Закрыть SMTP-соединение"""
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        return {
+            'enabled': self.app.config['MAIL_ENABLED'],
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'connections': self.connections,
+            'last_error': self.last_error
+        }
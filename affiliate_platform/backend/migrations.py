@@ -0,0 +1,369 @@
+"""
+Версионные миграции схемы базы данных
+
+Применяются один раз до запуска воркеров (flask db-upgrade в start.sh,
+release-фаза Procfile), а не при импорте приложения: пересчёты по всей
+истории кликов не должны выполняться внутри загрузки воркера gunicorn.
+"""
+import os
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy import inspect, literal, text
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки, как и раньше
+    fcntl = None
+
+from .models import db, utcnow, PackedIP
+from . import rollups, sketches
+from .serializers import UTM_FIELDS
+
+
+# Строк кликов на один UPDATE при упаковке IP
+ENCODE_BATCH = 10000
+
+
+def _create_indexes(*names):
+    """Миграция: создать индексы, объявленные в моделях (если их ещё нет)"""
+    def migrate():
+        indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+        for name in names:
+            indexes[name].create(db.session.connection(), checkfirst=True)
+    return migrate
+
+
+def _add_columns(table_name, *names):
+    """Миграция: добавить колонки, объявленные в модели (если их ещё нет)"""
+    def migrate():
+        connection = db.session.connection()
+        column_names = {column['name'] for column in inspect(connection).get_columns(table_name)}
+        table = db.metadata.tables[table_name]
+        for name in names:
+            if name in column_names:
+                continue
+            column = table.c[name]
+            ddl = f"ALTER TABLE {table_name} ADD COLUMN {name} {column.type.compile(dialect=connection.dialect)}"
+            # Значение по умолчанию из модели - для уже существующих строк
+            if column.default is not None and column.default.is_scalar:
+                default = literal(column.default.arg, column.type).compile(
+                    dialect=connection.dialect, compile_kwargs={'literal_binds': True}
+                )
+                ddl += f" DEFAULT {default}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            connection.execute(text(ddl))
+    return migrate
+
+
+def _encode_click_table(connection, name):
+    """Перевести таблицу кликов name на справочники и упакованный IP
+
+    Справочники пополняются одним INSERT ... SELECT DISTINCT, id
+    проставляются одним UPDATE на колонку; IP упаковываются в Python
+    пачками по id. Старые строковые колонки удаляются, упакованный IP
+    занимает место колонки ip_address.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns(name)}
+    if 'user_agent' not in columns:
+        # Таблица уже создана по новой модели
+        return
+
+    blob = PackedIP().impl.compile(dialect=connection.dialect)
+    for column in ('user_agent_id', 'referrer_id', 'utm_id'):
+        connection.execute(text(f"ALTER TABLE {name} ADD COLUMN {column} INTEGER"))
+    connection.execute(text(f"ALTER TABLE {name} ADD COLUMN ip_packed {blob}"))
+
+    for dimension, column in (('user_agents', 'user_agent'), ('referrers', 'referrer')):
+        connection.execute(text(
+            f"INSERT INTO {dimension} (value) SELECT DISTINCT {column} FROM {name} "
+            f"WHERE {column} <> '' AND {column} NOT IN (SELECT value FROM {dimension})"
+        ))
+        connection.execute(text(
+            f"UPDATE {name} SET {column}_id = (SELECT id FROM {dimension} WHERE value = {name}.{column}) "
+            f"WHERE {column} <> ''"
+        ))
+
+    fields = ', '.join(UTM_FIELDS)
+    values = ', '.join(f"COALESCE({field}, '')" for field in UTM_FIELDS)
+    has_utm = ' OR '.join(f"{field} <> ''" for field in UTM_FIELDS)
+    match = ' AND '.join(f"u.{field} = COALESCE({name}.{field}, '')" for field in UTM_FIELDS)
+    connection.execute(text(
+        f"INSERT INTO utm_tuples ({fields}) SELECT DISTINCT {values} FROM {name} "
+        f"WHERE ({has_utm}) AND NOT EXISTS (SELECT 1 FROM utm_tuples u WHERE {match})"
+    ))
+    connection.execute(text(
+        f"UPDATE {name} SET utm_id = (SELECT u.id FROM utm_tuples u WHERE {match}) WHERE {has_utm}"
+    ))
+
+    packed_ip = PackedIP()
+    last_id = 0
+    while True:
+        rows = connection.execute(text(
+            f"SELECT id, ip_address FROM {name} WHERE id > :last_id AND ip_address IS NOT NULL "
+            f"ORDER BY id LIMIT {ENCODE_BATCH}"
+        ), {'last_id': last_id}).all()
+        if not rows:
+            break
+        updates = [
+            {'id': row_id, 'ip': packed}
+            for row_id, packed in ((row_id, packed_ip.process_bind_param(ip, None)) for row_id, ip in rows)
+            if packed is not None
+        ]
+        if updates:
+            connection.execute(text(f"UPDATE {name} SET ip_packed = :ip WHERE id = :id"), updates)
+        last_id = rows[-1][0]
+
+    for column in ('user_agent', 'referrer', *UTM_FIELDS, 'ip_address'):
+        connection.execute(text(f"ALTER TABLE {name} DROP COLUMN {column}"))
+    connection.execute(text(f"ALTER TABLE {name} RENAME COLUMN ip_packed TO ip_address"))
+
+
+def _encode_clicks():
+    """Миграция: строковые колонки кликов (и архивных партиций) - в справочники"""
+    def migrate():
+        connection = db.session.connection()
+        names = ['clicks'] + [row[0] for row in connection.execute(text("SELECT name FROM click_partitions"))]
+        for name in names:
+            _encode_click_table(connection, name)
+    return migrate
+
+
+def _opening_balances():
+    """Миграция: ненулевые балансы партнёров - начальными записями журнала"""
+    def migrate():
+        db.session.execute(
+            text(
+                "INSERT INTO ledger_entries (partner_id, kind, amount, created_at) "
+                "SELECT id, 'opening_balance', balance, :now FROM users WHERE balance <> 0"
+            ),
+            {'now': utcnow()}
+        )
+    return migrate
+
+
+# Индекс offers_fts хранит текст уже с ё -> е (см. search.normalize)
+_FTS_VALUES = ", ".join(
+    f"replace(replace(new.{column}, 'ё', 'е'), 'Ё', 'Е')" for column in ('title', 'description', 'category')
+)
+
+OFFERS_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS offers_fts USING fts5("
+    "title, description, category, tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS offers_fts_insert AFTER INSERT ON offers BEGIN "
+    f"INSERT INTO offers_fts (rowid, title, description, category) VALUES (new.id, {_FTS_VALUES}); END",
+    "CREATE TRIGGER IF NOT EXISTS offers_fts_update AFTER UPDATE OF title, description, category ON offers BEGIN "
+    "DELETE FROM offers_fts WHERE rowid = old.id; "
+    f"INSERT INTO offers_fts (rowid, title, description, category) VALUES (new.id, {_FTS_VALUES}); END",
+    "CREATE TRIGGER IF NOT EXISTS offers_fts_delete AFTER DELETE ON offers BEGIN "
+    "DELETE FROM offers_fts WHERE rowid = old.id; END",
+    "DELETE FROM offers_fts",
+    "INSERT INTO offers_fts (rowid, title, description, category) "
+    f"SELECT id, {_FTS_VALUES.replace('new.', '')} FROM offers",
+]
+
+
+def _offers_fts():
+    """Миграция: полнотекстовый индекс офферов (только SQLite с FTS5)"""
+    def migrate():
+        connection = db.session.connection()
+        if connection.dialect.name != 'sqlite':
+            return
+        if not connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+            return
+        for statement in OFFERS_FTS:
+            connection.execute(text(statement))
+    return migrate
+
+
+def _rebuild(module):
+    """Миграция: пересчитать производную таблицу по накопленной истории
+
+    module - rollups или sketches (функция rebuild без коммита). Иначе
+    после обновления существующей базы статистика показывала бы только
+    то, что записано после него.
+    """
+    def migrate():
+        module.rebuild()
+    return migrate
+
+
+def _steps(*migrations):
+    """Миграция из нескольких шагов в одной транзакции"""
+    def migrate():
+        for step in migrations:
+            step()
+    return migrate
+
+
+# (версия, описание, функция). Порядок и номера версий не меняются,
+# новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'Составные индексы под запросы статистики, списков и сброса пароля', _create_indexes(
+        'ix_offers_active_id',
+        'ix_offers_company_active',
+        'ix_affiliate_links_partner_offer',
+        'ix_clicks_partner_clicked',
+        'ix_clicks_offer_clicked',
+        'ix_conversions_partner_created',
+        'ix_conversions_offer_created',
+        'ix_conversions_status_created',
+        'ix_daily_stats_partner_day',
+        'ix_daily_stats_offer_day',
+        'ix_payouts_partner_requested',
+        'ix_password_resets_user_used'
+    )),
+    (2, 'Индекс под постраничный список ссылок партнёра', _create_indexes(
+        'ix_affiliate_links_partner_id'
+    )),
+    (3, 'click_id у кликов и конверсий для постбэков рекламодателя', _steps(
+        _add_columns('clicks', 'click_id'),
+        _add_columns('conversions', 'click_id'),
+        _create_indexes('ix_clicks_click_id')
+    )),
+    (4, 'Отметка повторных кликов и их счётчик в суточных агрегатах', _steps(
+        _add_columns('clicks', 'is_duplicate'),
+        _add_columns('daily_stats', 'duplicate_clicks')
+    )),
+    (5, 'Справочники user_agent, referrer и UTM, упакованный IP в кликах', _encode_clicks()),
+    (6, 'Журнал баланса партнёров: текущие балансы - начальными записями', _opening_balances()),
+    (7, 'Полнотекстовый индекс офферов offers_fts (SQLite FTS5)', _offers_fts()),
+    (8, 'Суточные агрегаты daily_stats по накопленной истории', _rebuild(rollups)),
+    (9, 'Скетчи уникальных посетителей по накопленной истории', _rebuild(sketches)),
+]
+
+
+# Запросы в форме, которую выполняет приложение, и индекс,
+# который SQLite должен для них выбрать (EXPLAIN QUERY PLAN)
+INDEX_CHECKS = [
+    ('ix_offers_active_id',
+     "SELECT * FROM offers WHERE is_active = 1 AND id > 0 ORDER BY id LIMIT 51"),
+    ('ix_offers_company_active',
+     "SELECT count(*) FROM offers WHERE company_id = 1"),
+    ('ix_affiliate_links_partner_offer',
+     "SELECT * FROM affiliate_links WHERE partner_id = 1 AND offer_id = 1"),
+    ('ix_affiliate_links_partner_id',
+     "SELECT * FROM affiliate_links WHERE partner_id = 1 AND id > 0 ORDER BY id LIMIT 51"),
+    ('ix_clicks_partner_clicked',
+     "SELECT count(*) FROM clicks WHERE partner_id = 1 AND clicked_at >= '2024-01-01'"),
+    ('ix_clicks_offer_clicked',
+     "SELECT count(*) FROM clicks WHERE offer_id = 1 AND clicked_at >= '2024-01-01'"),
+    ('ix_clicks_click_id',
+     "SELECT * FROM clicks WHERE click_id = 'k2Jx9QbTfV0aRw1c'"),
+    ('ix_conversions_partner_created',
+     "SELECT * FROM conversions WHERE partner_id = 1 ORDER BY created_at DESC LIMIT 10"),
+    ('ix_conversions_offer_created',
+     "SELECT * FROM conversions WHERE offer_id IN (SELECT id FROM offers WHERE company_id = 1) "
+     "ORDER BY created_at DESC LIMIT 10"),
+    ('ix_conversions_status_created',
+     "SELECT id FROM conversions WHERE status = 'pending' AND created_at < '2024-01-01'"),
+    ('ix_daily_stats_partner_day',
+     "SELECT sum(clicks) FROM daily_stats WHERE partner_id = 1 AND day >= '2024-01-01'"),
+    ('ix_daily_stats_offer_day',
+     "SELECT sum(clicks) FROM daily_stats WHERE offer_id IN (SELECT id FROM offers WHERE company_id = 1)"),
+    ('ix_payouts_partner_requested',
+     "SELECT * FROM payouts WHERE partner_id = 1 ORDER BY requested_at DESC, id DESC LIMIT 51"),
+    ('ix_ledger_entries_partner_id',
+     "SELECT * FROM ledger_entries WHERE partner_id = 1 ORDER BY id DESC LIMIT 51"),
+    ('ix_password_resets_user_used',
+     "SELECT * FROM password_resets WHERE user_id = 1 AND used = 0"),
+]
+
+
+def _ensure_version_table():
+    """Создать таблицу учёта применённых миграций"""
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+    db.session.commit()
+
+
+def applied_versions():
+    """Номера применённых миграций"""
+    _ensure_version_table()
+    return {row[0] for row in db.session.execute(text("SELECT version FROM schema_migrations"))}
+
+
+@contextmanager
+def _exclusive(path):
+    """Монопольная блокировка файла path на время миграций
+
+    Второй процесс на той же машине ждёт, пока первый закончит, и затем
+    видит уже применённые версии, вместо того чтобы упасть с "database is
+    locked" посреди тех же миграций.
+    """
+    if fcntl is None or not path:
+        yield
+        return
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def upgrade():
+    """Привести схему к актуальной версии
+
+    Недостающие таблицы создаются по моделям, затем по порядку применяются
+    ещё не выполненные миграции - каждая в своей транзакции. Процессы одной
+    машины выполняют upgrade по очереди (MIGRATIONS_LOCK_FILE).
+    Возвращает список применённых версий.
+    """
+    with _exclusive(current_app.config.get('MIGRATIONS_LOCK_FILE')):
+        return _upgrade()
+
+
+def _upgrade():
+    """upgrade под блокировкой"""
+    db.create_all()
+
+    done = applied_versions()
+    applied = []
+
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+
+        try:
+            migrate()
+            db.session.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {'v': version, 'n': name, 't': utcnow()}
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Миграцию мог применить процесс на другой машине
+            if version in applied_versions():
+                continue
+            raise
+
+        applied.append(version)
+
+    return applied
+
+
+def check_indexes():
+    """Проверить через EXPLAIN QUERY PLAN, что запросы используют свои индексы
+
+    Возвращает список (индекс, используется ли, план запроса).
+    Поддерживается только SQLite.
+    """
+    results = []
+
+    for index_name, sql in INDEX_CHECKS:
+        plan = [row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        used = any(index_name in detail for detail in plan)
+        results.append((index_name, used, '; '.join(plan)))
+
+    return results
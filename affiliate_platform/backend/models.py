@@ -1,14 +1,64 @@
 """
 Модели базы данных для партнёрской платформы
 """
-from datetime import datetime
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.types import TypeDecorator
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
+import socket
 import string
 
 db = SQLAlchemy()
 
+class Money(TypeDecorator):
+    """Денежная сумма: NUMERIC(14, 2) в любой БД, float в Python (как было с Float)"""
+    impl = db.Numeric(14, 2, asdecimal=False)
+    cache_ok = True
+
+    # Суммы от MAX и больше не помещаются в NUMERIC(14, 2)
+    MAX = 10 ** 12
+
+    @classmethod
+    def fits(cls, value):
+        """Сумма помещается в колонку (после округления до копеек)"""
+        return abs(round(value, 2)) < cls.MAX
+
+    def process_result_value(self, value, dialect):
+        # SQLite хранит целые суммы в NUMERIC как INTEGER
+        return float(value) if value is not None else None
+
+
+class PackedIP(TypeDecorator):
+    """IP-адрес: 4 байта (IPv4) или 16 (IPv6) в БД, строка в Python"""
+    impl = db.LargeBinary(16)
+    cache_ok = True
+
+    @property
+    def python_type(self):
+        return str
+
+    def process_bind_param(self, value, dialect):
+        if not value:
+            return None
+        family = socket.AF_INET6 if ':' in value else socket.AF_INET
+        try:
+            return socket.inet_pton(family, value)
+        except OSError:
+            # Не IP (например, мусор из заголовка прокси) - не сохраняется
+            return None
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        value = bytes(value)
+        return socket.inet_ntop(socket.AF_INET6 if len(value) == 16 else socket.AF_INET, value)
+
+
+def utcnow():
+    """Текущее время UTC без tzinfo (так даты хранятся во всех БД)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 
 class User(db.Model):
     """Модель пользователя (компания или партнёр)"""
@@ -21,8 +71,8 @@ class User(db.Model):
     full_name = db.Column(db.String(200))
     company_name = db.Column(db.String(200))
     phone = db.Column(db.String(50))
-    balance = db.Column(db.Float, default=0.0)  # Баланс для партнёров
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    balance = db.Column(Money(), default=0.0)  # Баланс для партнёров
+    created_at = db.Column(db.DateTime, default=utcnow)
     is_active = db.Column(db.Boolean, default=True)
 
     # Связи
@@ -58,6 +108,10 @@ class User(db.Model):
 class Offer(db.Model):
     """Модель оффера (товар/услуга от компании)"""
     __tablename__ = 'offers'
+    __table_args__ = (
+        db.Index('ix_offers_active_id', 'is_active', 'id'),  # каталог активных офферов
+        db.Index('ix_offers_company_active', 'company_id', 'is_active'),  # офферы компании
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -65,12 +119,12 @@ class Offer(db.Model):
     description = db.Column(db.Text)
     product_url = db.Column(db.String(500))
     image_url = db.Column(db.String(500))
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(Money(), nullable=False)
     commission_percent = db.Column(db.Float, nullable=False)  # % от продажи
     platform_percent = db.Column(db.Float, default=2.0)  # % платформы (по умолчанию 20% от комиссии)
     category = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     # Связи
     affiliate_links = db.relationship('AffiliateLink', backref='offer', lazy=True)
@@ -111,12 +165,16 @@ class Offer(db.Model):
 class AffiliateLink(db.Model):
     """Модель партнёрской ссылки"""
     __tablename__ = 'affiliate_links'
+    __table_args__ = (
+        db.Index('ix_affiliate_links_partner_offer', 'partner_id', 'offer_id'),
+        db.Index('ix_affiliate_links_partner_id', 'partner_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     offer_id = db.Column(db.Integer, db.ForeignKey('offers.id'), nullable=False)
     tracking_code = db.Column(db.String(50), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow)
     is_active = db.Column(db.Boolean, default=True)
 
     # UTM параметры для отслеживания источников трафика
@@ -136,6 +194,30 @@ class AffiliateLink(db.Model):
         characters = string.ascii_letters + string.digits
         return ''.join(secrets.choice(characters) for _ in range(length))
 
+    @staticmethod
+    def generate_tracking_codes(count, length=10):
+        """Сгенерировать count кодов, которых ещё нет в БД
+
+        Занятые коды проверяются одним запросом IN на каждый раунд;
+        совпавшие генерируются заново.
+        """
+        codes = set()
+        while len(codes) < count:
+            candidates = set()
+            while len(candidates) < count - len(codes):
+                code = AffiliateLink.generate_tracking_code(length)
+                if code not in codes:
+                    candidates.add(code)
+
+            taken = {
+                code for (code,) in db.session.query(AffiliateLink.tracking_code).filter(
+                    AffiliateLink.tracking_code.in_(candidates)
+                )
+            }
+            codes |= candidates - taken
+
+        return list(codes)
+
     def get_tracking_url(self, base_url, include_utm=True):
         """Получить полную ссылку для отслеживания с UTM параметрами"""
         url = f"{base_url}/track/{self.tracking_code}"
@@ -188,22 +270,57 @@ class AffiliateLink(db.Model):
 class Click(db.Model):
     """Модель клика по партнёрской ссылке"""
     __tablename__ = 'clicks'
+    __table_args__ = (
+        db.Index('ix_clicks_partner_clicked', 'partner_id', 'clicked_at'),
+        db.Index('ix_clicks_offer_clicked', 'offer_id', 'clicked_at'),
+        db.Index('ix_clicks_click_id', 'click_id', unique=True),  # постбэк по click_id
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     affiliate_link_id = db.Column(db.Integer, db.ForeignKey('affiliate_links.id'), nullable=False)
     partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     offer_id = db.Column(db.Integer, db.ForeignKey('offers.id'), nullable=False)
-    ip_address = db.Column(db.String(50))
-    user_agent = db.Column(db.String(500))
-    referrer = db.Column(db.String(500))
-    clicked_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    # UTM параметры из ссылки для аналитики
-    utm_source = db.Column(db.String(100))
-    utm_medium = db.Column(db.String(100))
-    utm_campaign = db.Column(db.String(200))
-    utm_content = db.Column(db.String(200))
-    utm_term = db.Column(db.String(200))
+    click_id = db.Column(db.String(32))  # публичный id клика, передаётся рекламодателю в URL
+    ip_address = db.Column(PackedIP())
+    clicked_at = db.Column(db.DateTime, default=utcnow)
+    is_duplicate = db.Column(db.Boolean, default=False)  # повторный клик в окне дедупликации
+
+    # Повторяющиеся строки - id из справочников (см. dimensions.py)
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('user_agents.id'))
+    referrer_id = db.Column(db.Integer, db.ForeignKey('referrers.id'))
+    utm_id = db.Column(db.Integer, db.ForeignKey('utm_tuples.id'))  # UTM параметры из ссылки
+
+    user_agent_entry = db.relationship('UserAgent', lazy=True)
+    referrer_entry = db.relationship('Referrer', lazy=True)
+    utm = db.relationship('UtmTuple', lazy=True)
+
+    @property
+    def user_agent(self):
+        return self.user_agent_entry.value if self.user_agent_entry else None
+
+    @property
+    def referrer(self):
+        return self.referrer_entry.value if self.referrer_entry else None
+
+    @property
+    def utm_source(self):
+        return (self.utm.utm_source or None) if self.utm else None
+
+    @property
+    def utm_medium(self):
+        return (self.utm.utm_medium or None) if self.utm else None
+
+    @property
+    def utm_campaign(self):
+        return (self.utm.utm_campaign or None) if self.utm else None
+
+    @property
+    def utm_content(self):
+        return (self.utm.utm_content or None) if self.utm else None
+
+    @property
+    def utm_term(self):
+        return (self.utm.utm_term or None) if self.utm else None
 
     def to_dict(self):
         """Преобразовать в словарь"""
@@ -212,8 +329,10 @@ class Click(db.Model):
             'affiliate_link_id': self.affiliate_link_id,
             'partner_id': self.partner_id,
             'offer_id': self.offer_id,
+            'click_id': self.click_id,
             'ip_address': self.ip_address,
-            'clicked_at': self.clicked_at.isoformat()
+            'clicked_at': self.clicked_at.isoformat(),
+            'is_duplicate': bool(self.is_duplicate)
         }
 
         # Добавить UTM параметры если они есть
@@ -231,20 +350,59 @@ class Click(db.Model):
         return result
 
 
+class UserAgent(db.Model):
+    """Справочник User-Agent кликов"""
+    __tablename__ = 'user_agents'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(500), unique=True, nullable=False)
+
+
+class Referrer(db.Model):
+    """Справочник referrer кликов"""
+    __tablename__ = 'referrers'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(500), unique=True, nullable=False)
+
+
+class UtmTuple(db.Model):
+    """Справочник наборов UTM-меток кликов"""
+    __tablename__ = 'utm_tuples'
+    __table_args__ = (
+        db.UniqueConstraint('utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term',
+                            name='uq_utm_tuples_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # '' вместо NULL для уникального ключа
+    utm_source = db.Column(db.String(100), nullable=False, default='')
+    utm_medium = db.Column(db.String(100), nullable=False, default='')
+    utm_campaign = db.Column(db.String(200), nullable=False, default='')
+    utm_content = db.Column(db.String(200), nullable=False, default='')
+    utm_term = db.Column(db.String(200), nullable=False, default='')
+
+
 class Conversion(db.Model):
     """Модель конверсии (продажи)"""
     __tablename__ = 'conversions'
+    __table_args__ = (
+        db.Index('ix_conversions_partner_created', 'partner_id', 'created_at'),
+        db.Index('ix_conversions_offer_created', 'offer_id', 'created_at'),
+        db.Index('ix_conversions_status_created', 'status', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     affiliate_link_id = db.Column(db.Integer, db.ForeignKey('affiliate_links.id'), nullable=False)
     partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     offer_id = db.Column(db.Integer, db.ForeignKey('offers.id'), nullable=False)
     order_id = db.Column(db.String(100), unique=True)
-    sale_amount = db.Column(db.Float, nullable=False)
-    commission_amount = db.Column(db.Float, nullable=False)  # Комиссия партнёра
-    platform_fee = db.Column(db.Float, nullable=False)  # Комиссия платформы
+    click_id = db.Column(db.String(32))  # клик, к которому привязан постбэк
+    sale_amount = db.Column(Money(), nullable=False)
+    commission_amount = db.Column(Money(), nullable=False)  # Комиссия партнёра
+    platform_fee = db.Column(Money(), nullable=False)  # Комиссия платформы
     status = db.Column(db.String(50), default='pending')  # pending, approved, rejected, paid
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow)
     approved_at = db.Column(db.DateTime)
 
     def to_dict(self):
@@ -255,6 +413,7 @@ class Conversion(db.Model):
             'partner_id': self.partner_id,
             'offer_id': self.offer_id,
             'order_id': self.order_id,
+            'click_id': self.click_id,
             'sale_amount': self.sale_amount,
             'commission_amount': self.commission_amount,
             'platform_fee': self.platform_fee,
@@ -264,17 +423,67 @@ class Conversion(db.Model):
         }
 
 
+class DailyStat(db.Model):
+    """Суточные агрегаты кликов и конверсий (обновляются при записи)"""
+    __tablename__ = 'daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'partner_id', 'offer_id', 'utm_source', 'utm_campaign',
+                            name='uq_daily_stats_key'),
+        db.Index('ix_daily_stats_partner_day', 'partner_id', 'day'),
+        db.Index('ix_daily_stats_offer_day', 'offer_id', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    offer_id = db.Column(db.Integer, db.ForeignKey('offers.id'), nullable=False)
+    utm_source = db.Column(db.String(100), nullable=False, default='')  # '' вместо NULL для ключа
+    utm_campaign = db.Column(db.String(200), nullable=False, default='')
+
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    duplicate_clicks = db.Column(db.Integer, nullable=False, default=0)  # из них повторных
+    conversions = db.Column(db.Integer, nullable=False, default=0)
+    sales_amount = db.Column(Money(), nullable=False, default=0.0)
+
+    # Суммы комиссий партнёра по статусам конверсий
+    pending_amount = db.Column(Money(), nullable=False, default=0.0)
+    approved_amount = db.Column(Money(), nullable=False, default=0.0)
+    rejected_amount = db.Column(Money(), nullable=False, default=0.0)
+    paid_amount = db.Column(Money(), nullable=False, default=0.0)
+
+    def to_dict(self):
+        """Преобразовать в словарь"""
+        return {
+            'day': self.day.isoformat(),
+            'partner_id': self.partner_id,
+            'offer_id': self.offer_id,
+            'utm_source': self.utm_source,
+            'utm_campaign': self.utm_campaign,
+            'clicks': self.clicks,
+            'duplicate_clicks': self.duplicate_clicks,
+            'conversions': self.conversions,
+            'sales_amount': self.sales_amount,
+            'pending_amount': self.pending_amount,
+            'approved_amount': self.approved_amount,
+            'rejected_amount': self.rejected_amount,
+            'paid_amount': self.paid_amount
+        }
+
+
 class Payout(db.Model):
     """Модель выплаты партнёру"""
     __tablename__ = 'payouts'
+    __table_args__ = (
+        db.Index('ix_payouts_partner_requested', 'partner_id', 'requested_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money(), nullable=False)
     payment_method = db.Column(db.String(50))  # card, bank_transfer, wallet, etc.
     payment_details = db.Column(db.String(500))
     status = db.Column(db.String(50), default='pending')  # pending, processing, completed, failed
-    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    requested_at = db.Column(db.DateTime, default=utcnow)
     completed_at = db.Column(db.DateTime)
 
     def to_dict(self):
@@ -290,16 +499,53 @@ class Payout(db.Model):
         }
 
 
+class LedgerEntry(db.Model):
+    """Запись журнала баланса партнёра: начисление (+) или списание (-)
+
+    Записи только добавляются; User.balance - материализованная сумма
+    записей партнёра и меняется в той же транзакции, что и журнал.
+    """
+    __tablename__ = 'ledger_entries'
+    __table_args__ = (
+        db.Index('ix_ledger_entries_partner_id', 'partner_id', 'id'),
+        # Конверсия начисляется (и списывается) не больше одного раза
+        db.Index('ix_ledger_entries_conversion_kind', 'conversion_id', 'kind', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(30), nullable=False)  # см. ledger.KINDS
+    amount = db.Column(Money(), nullable=False)
+    conversion_id = db.Column(db.Integer, db.ForeignKey('conversions.id'))
+    payout_id = db.Column(db.Integer, db.ForeignKey('payouts.id'))
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    def to_dict(self):
+        """Преобразовать в словарь"""
+        return {
+            'id': self.id,
+            'partner_id': self.partner_id,
+            'kind': self.kind,
+            'amount': self.amount,
+            'conversion_id': self.conversion_id,
+            'payout_id': self.payout_id,
+            'created_at': self.created_at.isoformat()
+        }
+
+
 class PasswordReset(db.Model):
     """Модель для восстановления пароля"""
     __tablename__ = 'password_resets'
+    __table_args__ = (
+        db.Index('ix_password_resets_user_used', 'user_id', 'used'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     reset_token = db.Column(db.String(100), unique=True, nullable=False)
     expires_at = db.Column(db.DateTime, nullable=False)
     used = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     @staticmethod
     def generate_reset_token(length=32):
@@ -308,7 +554,7 @@ class PasswordReset(db.Model):
 
     def is_expired(self):
         """Проверить, истёк ли токен"""
-        return datetime.utcnow() > self.expires_at
+        return utcnow() > self.expires_at
 
     def to_dict(self):
         """Преобразовать в словарь"""
@@ -320,3 +566,83 @@ class PasswordReset(db.Model):
             'used': self.used,
             'created_at': self.created_at.isoformat()
         }
+
+
+class ClickPartition(db.Model):
+    """Архивная партиция кликов за месяц (таблица clicks_YYYYMM)"""
+    __tablename__ = 'click_partitions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    period_start = db.Column(db.Date, nullable=False)  # первый день месяца
+    period_end = db.Column(db.Date, nullable=False)  # первый день следующего месяца
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    sealed_at = db.Column(db.DateTime, default=utcnow)
+
+    def to_dict(self):
+        """Преобразовать в словарь"""
+        return {
+            'name': self.name,
+            'period_start': self.period_start.isoformat(),
+            'period_end': self.period_end.isoformat(),
+            'rows': self.rows,
+            'sealed_at': self.sealed_at.isoformat()
+        }
+
+
+class VisitorSketch(db.Model):
+    """Суточный скетч HyperLogLog уникальных посетителей оффера или партнёра"""
+    __tablename__ = 'visitor_sketches'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'scope', 'owner_id', name='uq_visitor_sketches_key'),
+        db.Index('ix_visitor_sketches_owner_day', 'scope', 'owner_id', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    scope = db.Column(db.String(20), nullable=False)  # offer или partner
+    owner_id = db.Column(db.Integer, nullable=False)  # id оффера или партнёра
+    registers = db.Column(db.LargeBinary, nullable=False)  # регистры, сжатые zlib
+
+    def to_dict(self):
+        """Преобразовать в словарь"""
+        return {
+            'day': self.day.isoformat(),
+            'scope': self.scope,
+            'owner_id': self.owner_id
+        }
+
+
+class EmailOutbox(db.Model):
+    """Исходящее письмо: записывается в транзакции запроса, отправляется в фоне"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next', 'status', 'next_attempt_at'),  # выборка готовых к отправке
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=utcnow)
+    claim_token = db.Column(db.String(32))  # какой отправитель забрал письмо
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        """Преобразовать в словарь"""
+        return {
+            'id': self.id,
+            'recipient': self.recipient,
+            'subject': self.subject,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat(),
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+        }
@@ -0,0 +1,95 @@
+"""
+Постраничная выдача списков по ключу (keyset) с непрозрачным курсором
+"""
+import base64
+import json
+import math
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, tuple_
+
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(values):
+    """Значения ключа последней строки -> строка курсора"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _decode_value(column, value):
+    """Значение ключа из курсора -> значение для сравнения с column
+
+    DateTime - строка ISO, Integer - целое, остальные колонки ключа
+    (цена, комиссия, ранг) - конечное число. Иначе ValueError.
+    """
+    if isinstance(column.type, DateTime):
+        if not isinstance(value, str):
+            raise ValueError
+        return datetime.fromisoformat(value)
+    # bool - подкласс int, но в ключе не встречается
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(column.type, Integer):
+        if not isinstance(value, int):
+            raise ValueError
+    elif not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError
+    return value
+
+
+def decode_cursor(cursor, columns):
+    """Строка курсора -> значения ключа, при ошибке - ValueError
+
+    Тип каждого значения проверяется по его колонке: подделанный курсор
+    (["a"], [null], [{"x": 1}]) - ошибка запроса, а не ошибка БД.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [_decode_value(column, v) for column, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise ValueError('Некорректный cursor')
+
+
+def parse_args(args):
+    """Разобрать limit и cursor из query string
+
+    Возвращает (limit, cursor), при ошибке - ValueError.
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError('limit должен быть числом')
+
+    if limit < 1:
+        raise ValueError('limit должен быть больше 0')
+
+    return min(limit, MAX_LIMIT), args.get('cursor') or None
+
+
+def paginate(query, columns, limit, cursor=None, descending=False):
+    """Страница запроса: WHERE (ключ) > (курсор) ORDER BY ключ LIMIT
+
+    columns - колонки ключа, последняя должна быть уникальной (обычно id).
+    Запрос может выбирать объекты или кортежи колонок, в которые входит ключ.
+    Возвращает (строки страницы, курсор следующей страницы или None).
+    """
+    if cursor:
+        key, values = tuple_(*columns), tuple_(*decode_cursor(cursor, columns))
+        query = query.filter(key < values if descending else key > values)
+
+    order = [c.desc() for c in columns] if descending else list(columns)
+    # Одна лишняя строка показывает, есть ли следующая страница
+    items = query.order_by(*order).limit(limit + 1).all()
+
+    if len(items) <= limit:
+        return items, None
+
+    items = items[:limit]
+    return items, encode_cursor([getattr(items[-1], c.key) for c in columns])
@@ -0,0 +1,178 @@
+"""
+Помесячные архивные партиции кликов (clicks_YYYYMM)
+
+Горячая таблица clicks (модель Click) хранит текущий месяц - в неё
+пишет /track. Закрытые месяцы переносятся командой rollover в
+отдельные таблицы clicks_YYYYMM и больше не меняются; реестр партиций -
+таблица click_partitions.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Column, Index, MetaData, Table, func, insert, select, text, union_all
+
+from .models import db, utcnow, Click, ClickPartition
+from . import dimensions
+
+
+# Архивные таблицы не создаются через db.create_all - только при переносе
+_metadata = MetaData()
+
+
+def month_start(value):
+    """Первый день месяца"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    """Первый день месяца через months месяцев (months может быть отрицательным)"""
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    """Имя архивной таблицы месяца"""
+    return f"clicks_{month:%Y%m}"
+
+
+def archive_table(name):
+    """Table архивной партиции: колонки Click, свои имена индексов"""
+    table = _metadata.tables.get(name)
+    if table is not None:
+        return table
+
+    columns = [
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in Click.__table__.columns
+    ]
+    return Table(
+        name, _metadata, *columns,
+        Index(f'ix_{name}_click_id', 'click_id', unique=True),
+        Index(f'ix_{name}_partner_clicked', 'partner_id', 'clicked_at'),
+        Index(f'ix_{name}_offer_clicked', 'offer_id', 'clicked_at')
+    )
+
+
+def sealed(date_from=None, date_to=None):
+    """Архивные партиции, пересекающиеся с периодом [date_from, date_to], новые первыми"""
+    query = ClickPartition.query
+    if date_from:
+        query = query.filter(ClickPartition.period_end > date_from)
+    if date_to:
+        query = query.filter(ClickPartition.period_start <= date_to)
+    return query.order_by(ClickPartition.period_start.desc()).all()
+
+
+def tables(date_from=None, date_to=None):
+    """Таблицы кликов за период по времени: архивные партиции от старых к новым, горячая последней"""
+    archived = [archive_table(partition.name) for partition in reversed(sealed(date_from, date_to))]
+    return archived + [Click.__table__]
+
+
+def in_period(table, date_from=None, date_to=None):
+    """Условия на clicked_at таблицы кликов для периода [date_from, date_to]"""
+    conditions = []
+    if date_from:
+        conditions.append(table.c.clicked_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        conditions.append(table.c.clicked_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return conditions
+
+
+def select_clicks(*names, date_from=None, date_to=None):
+    """Колонки Click из горячей таблицы и нужных архивных партиций
+
+    Партиции вне периода в UNION ALL не попадают. Возвращает подзапрос
+    с колонками names (значения справочников уже подставлены).
+    """
+    parts = [
+        dimensions.select_columns(table, *names).where(*in_period(table, date_from, date_to))
+        for table in tables(date_from, date_to)
+    ]
+    return union_all(*parts).subquery('clicks')
+
+
+def find_click(click_id, *names):
+    """Клик по click_id в архивных партициях (новые первыми) или None
+
+    Поиск по уникальному индексу каждой партиции, без сканирования.
+    """
+    for partition in sealed():
+        table = archive_table(partition.name)
+        row = db.session.execute(
+            dimensions.select_columns(table, *names).where(table.c.click_id == click_id)
+        ).first()
+        if row is not None:
+            return row
+    return None
+
+
+def _move_month(month):
+    """Перенести клики месяца из горячей таблицы в его партицию (одна транзакция)
+
+    Возвращает (имя партиции, строк) или None, если кликов за месяц нет.
+    """
+    name = partition_name(month)
+    table = archive_table(name)
+    hot = Click.__table__
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(add_months(month, 1), datetime.min.time())
+    in_month = (hot.c.clicked_at >= start) & (hot.c.clicked_at < end)
+
+    # Месяцы без кликов пропускаются, пустые партиции не создаются
+    if db.session.execute(select(hot.c.id).where(in_month).limit(1)).first() is None:
+        return None
+
+    connection = db.session.connection()
+    table.create(connection, checkfirst=True)
+
+    names = [column.name for column in hot.columns]
+    moved = db.session.execute(
+        insert(table).from_select(names, select(*(hot.c[n] for n in names)).where(in_month))
+    ).rowcount
+    db.session.execute(hot.delete().where(in_month))
+
+    partition = ClickPartition.query.filter_by(name=name).first()
+    if partition is None:
+        partition = ClickPartition(name=name, period_start=month, period_end=add_months(month, 1), rows=0)
+        db.session.add(partition)
+    partition.rows += moved
+    partition.sealed_at = utcnow()
+
+    db.session.commit()
+    return name, moved
+
+
+def rollover(hot_months=1, today=None):
+    """Перенести в архив все месяцы старше hot_months последних
+
+    Каждый месяц переносится своей транзакцией. Горячая таблица после
+    этого содержит только текущие месяцы. Возвращает [(имя партиции, строк)].
+    """
+    cutoff = add_months(month_start(today or utcnow().date()), -(hot_months - 1))
+    oldest = db.session.query(func.min(Click.clicked_at)).filter(
+        Click.clicked_at < datetime.combine(cutoff, datetime.min.time())
+    ).scalar()
+    if oldest is None:
+        return []
+
+    moved = []
+    month = month_start(oldest)
+    while month < cutoff:
+        result = _move_month(month)
+        if result is not None:
+            moved.append(result)
+        month = add_months(month, 1)
+    return moved
+
+
+def compact():
+    """Вернуть место после переноса: VACUUM (SQLite) или VACUUM ANALYZE clicks (PostgreSQL)
+
+    Выполняется вне транзакции; в SQLite блокирует запись на время работы.
+    """
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text("VACUUM ANALYZE clicks"))
+        else:
+            connection.execute(text("VACUUM"))
+            connection.execute(text("ANALYZE"))
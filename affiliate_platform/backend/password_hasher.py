@@ -0,0 +1,154 @@
+"""
+Хеширование паролей в отдельном ограниченном пуле потоков
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    """Пул хеширования занят - запрос нужно повторить позже"""
+
+
+class PasswordHasher:
+    """Пул хеширования паролей с ограниченной очередью
+
+    Не больше PASSWORD_HASH_WORKERS вычислений KDF одновременно и не больше
+    PASSWORD_HASH_QUEUE_MAX ожидающих. Сверх этого hash/verify сразу
+    бросают HasherBusy: вызывающий код отвечает 503, а не занимает воркер
+    на время очереди.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._prefixes = {}
+
+        # Счётчики
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.in_flight = 0
+        self.hash_seconds = 0.0
+        self.hash_seconds_max = 0.0
+        self.wait_seconds = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению"""
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        app.config.setdefault('PASSWORD_HASH_SALT_LENGTH', 16)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_MAX', 16)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+        app.config.setdefault('PASSWORD_HASH_RETRY_AFTER', 1)
+
+        self.app = app
+        app.extensions['password_hasher'] = self
+
+    def _ensure_started(self):
+        """Создать пул (лениво, уже внутри воркера: потоки не переживают fork)"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            config = self.app.config
+            self._executor = ThreadPoolExecutor(
+                max_workers=config['PASSWORD_HASH_WORKERS'],
+                thread_name_prefix='password-hash'
+            )
+            self._slots = threading.BoundedSemaphore(
+                config['PASSWORD_HASH_WORKERS'] + config['PASSWORD_HASH_QUEUE_MAX']
+            )
+            self.in_flight = 0
+            self._pid = os.getpid()
+
+    def _run(self, function, *args):
+        """Выполнить функцию в пуле и дождаться результата"""
+        self._ensure_started()
+
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+
+        submitted = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.in_flight -= 1
+                    self.completed += 1
+                    self.hash_seconds += elapsed
+                    self.hash_seconds_max = max(self.hash_seconds_max, elapsed)
+                    self.wait_seconds += started - submitted
+                self._slots.release()
+
+        future = self._executor.submit(task)
+        try:
+            return future.result(timeout=self.app.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            # Задача досчитается в пуле и освободит слот сама
+            self.rejected += 1
+            raise HasherBusy()
+
+    def hash(self, password):
+        """Хеш пароля с текущими параметрами"""
+        return self._run(
+            generate_password_hash, password,
+            self.app.config['PASSWORD_HASH_METHOD'], self.app.config['PASSWORD_HASH_SALT_LENGTH']
+        )
+
+    def verify(self, password_hash, password):
+        """Проверить пароль по хешу (любого поддерживаемого метода)"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def _prefix(self, method):
+        """Префикс хеша (метод с параметрами), который даёт method
+
+        werkzeug дописывает параметры по умолчанию: 'scrypt' сохраняется
+        как scrypt:32768:8:1, 'pbkdf2' - как pbkdf2:sha256:600000. Префикс
+        берётся из пробного хеша и запоминается для каждого method.
+        """
+        prefix = self._prefixes.get(method)
+        if prefix is None:
+            prefix = generate_password_hash('x', method).split('$', 1)[0]
+            self._prefixes[method] = prefix
+        return prefix
+
+    def needs_rehash(self, password_hash):
+        """Хеш посчитан с другими параметрами, чем заданы сейчас"""
+        return password_hash.split('$', 1)[0] != self._prefix(self.app.config['PASSWORD_HASH_METHOD'])
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        completed = self.completed or 1
+        workers = self.app.config['PASSWORD_HASH_WORKERS']
+        return {
+            'method': self.app.config['PASSWORD_HASH_METHOD'].split(':', 1)[0],
+            'workers': workers,
+            'queue_max': self.app.config['PASSWORD_HASH_QUEUE_MAX'],
+            'in_flight': self.in_flight,
+            'queue_depth': max(self.in_flight - workers, 0),
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'rehashed': self.rehashed,
+            'hash_ms_avg': round(self.hash_seconds / completed * 1000, 2),
+            'hash_ms_max': round(self.hash_seconds_max * 1000, 2),
+            'wait_ms_avg': round(self.wait_seconds / completed * 1000, 2)
+        }
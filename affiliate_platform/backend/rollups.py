@@ -0,0 +1,200 @@
+"""
+Инкрементальные суточные агрегаты (daily_stats) для статистики
+"""
+from datetime import date, datetime
+
+from sqlalchemy import case, func, true
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, utcnow, DailyStat, UtmTuple
+from . import partitions, stats
+
+
+# Ключ агрегата
+KEY_FIELDS = ('day', 'partner_id', 'offer_id', 'utm_source', 'utm_campaign')
+
+# Счётчики, которые прибавляются при upsert
+COUNTER_FIELDS = ('clicks', 'duplicate_clicks', 'conversions', 'sales_amount',
+                  'pending_amount', 'approved_amount', 'rejected_amount', 'paid_amount')
+
+# Статус конверсии -> колонка с суммой комиссий
+STATUS_FIELDS = {
+    'pending': 'pending_amount',
+    'approved': 'approved_amount',
+    'rejected': 'rejected_amount',
+    'paid': 'paid_amount'
+}
+
+UPSERT_CHUNK = 500
+
+
+def _day(value):
+    """Привести datetime/строку из БД к дате"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _key(day, partner_id, offer_id, utm_source, utm_campaign):
+    """Ключ агрегата (NULL в UTM хранится как '')"""
+    return (_day(day), partner_id, offer_id, utm_source or '', utm_campaign or '')
+
+
+def _empty(key):
+    """Строка агрегата с нулевыми счётчиками"""
+    row = dict(zip(KEY_FIELDS, key))
+    for field in COUNTER_FIELDS:
+        row[field] = 0
+    return row
+
+
+def _insert(table):
+    """INSERT с поддержкой ON CONFLICT для текущего диалекта"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def _upsert(rows):
+    """Прибавить счётчики к агрегатам (создавая недостающие строки)
+
+    Вызывается внутри транзакции вызывающего кода, коммит не делает.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+
+    table = DailyStat.__table__
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = _insert(table).values(rows[start:start + UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[field] for field in KEY_FIELDS],
+            set_={field: table.c[field] + stmt.excluded[field] for field in COUNTER_FIELDS}
+        )
+        db.session.execute(stmt)
+
+
+def record_clicks(rows):
+    """Учесть пачку записанных кликов (словари с колонками Click)"""
+    totals = {}
+    for row in rows:
+        key = _key(row['clicked_at'], row['partner_id'], row['offer_id'],
+                   row.get('utm_source'), row.get('utm_campaign'))
+        total = totals.setdefault(key, _empty(key))
+        total['clicks'] += 1
+        if row.get('is_duplicate'):
+            total['duplicate_clicks'] += 1
+
+    _upsert(totals.values())
+
+
+def record_conversions(conversions):
+    """Учесть новые конверсии
+
+    conversions - список пар (Conversion, AffiliateLink): UTM берутся из ссылки.
+    """
+    record_conversion_rows({
+        'created_at': conversion.created_at or utcnow(),
+        'partner_id': conversion.partner_id,
+        'offer_id': conversion.offer_id,
+        'sale_amount': conversion.sale_amount,
+        'commission_amount': conversion.commission_amount,
+        'status': conversion.status,
+        'utm_source': link.utm_source,
+        'utm_campaign': link.utm_campaign
+    } for conversion, link in conversions)
+
+
+def record_conversion_rows(rows):
+    """Учесть пачку записанных конверсий (словари с колонками Conversion и UTM ссылки)"""
+    totals = {}
+    for conversion in rows:
+        key = _key(conversion['created_at'], conversion['partner_id'], conversion['offer_id'],
+                   conversion.get('utm_source'), conversion.get('utm_campaign'))
+        row = totals.setdefault(key, _empty(key))
+        row['conversions'] += 1
+        row['sales_amount'] += conversion['sale_amount']
+        row[STATUS_FIELDS[conversion.get('status') or 'pending']] += conversion['commission_amount']
+
+    _upsert(totals.values())
+
+
+def record_status_changes(rows, new_status):
+    """Перенести комиссии конверсий из прежнего статуса в new_status
+
+    rows - словари с колонками Conversion (status - прежний статус) и UTM
+    ссылки; сумма вычитается из колонки прежнего статуса и добавляется
+    в колонку нового.
+    """
+    totals = {}
+    for conversion in rows:
+        old_status = conversion.get('status') or 'pending'
+        if old_status == new_status:
+            continue
+        key = _key(conversion['created_at'], conversion['partner_id'], conversion['offer_id'],
+                   conversion.get('utm_source'), conversion.get('utm_campaign'))
+        row = totals.setdefault(key, _empty(key))
+        row[STATUS_FIELDS[old_status]] -= conversion['commission_amount']
+        row[STATUS_FIELDS[new_status]] += conversion['commission_amount']
+
+    _upsert(totals.values())
+
+
+def backfill():
+    """Пересчитать daily_stats по всей истории кликов и конверсий и закоммитить
+
+    Возвращает количество строк daily_stats.
+    """
+    rows = rebuild()
+    db.session.commit()
+    return rows
+
+
+def rebuild():
+    """Пересчитать daily_stats по всей истории (без коммита)
+
+    Агрегирует на стороне БД (GROUP BY), в Python попадают только строки
+    агрегатов. Возвращает количество строк daily_stats.
+    """
+    db.session.query(DailyStat).delete(synchronize_session=False)
+
+    totals = {}
+
+    # Горячая таблица и архивные партиции; группировка по id набора UTM,
+    # значения меток подставляются уже к агрегатам
+    clicks = partitions.select_clicks(
+        'id', 'clicked_at', 'partner_id', 'offer_id', 'utm_id', 'is_duplicate'
+    ).c
+    click_day = func.date(clicks.clicked_at)
+    grouped = db.session.query(
+        click_day.label('day'), clicks.partner_id, clicks.offer_id, clicks.utm_id,
+        func.count(clicks.id).label('clicks'),
+        func.count(case((clicks.is_duplicate == true(), clicks.id))).label('duplicate_clicks')
+    ).group_by(click_day, clicks.partner_id, clicks.offer_id, clicks.utm_id).subquery()
+    click_rows = db.session.query(
+        grouped.c.day, grouped.c.partner_id, grouped.c.offer_id, UtmTuple.utm_source, UtmTuple.utm_campaign,
+        grouped.c.clicks, grouped.c.duplicate_clicks
+    ).outerjoin(UtmTuple, UtmTuple.id == grouped.c.utm_id)
+
+    for day, partner_id, offer_id, utm_source, utm_campaign, clicks, duplicate_clicks in click_rows:
+        key = _key(day, partner_id, offer_id, utm_source, utm_campaign)
+        row = totals.setdefault(key, _empty(key))
+        row['clicks'] += clicks
+        row['duplicate_clicks'] += duplicate_clicks
+
+    conversion_rows = stats.conversion_totals(group_by=('day', 'partner', 'offer', 'utm_source', 'utm_campaign'))
+
+    for day, partner_id, offer_id, utm_source, utm_campaign, count, sales, *by_status in conversion_rows:
+        key = _key(day, partner_id, offer_id, utm_source, utm_campaign)
+        row = totals.setdefault(key, _empty(key))
+        row['conversions'] += count
+        row['sales_amount'] += sales
+        # by_status: пары (количество, сумма комиссий) в порядке CONVERSION_STATUSES
+        for status, amount in zip(stats.CONVERSION_STATUSES, by_status[1::2]):
+            row[STATUS_FIELDS[status]] += amount
+
+    _upsert(totals.values())
+
+    return len(totals)
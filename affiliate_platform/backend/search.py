@@ -0,0 +1,195 @@
+"""
+Полнотекстовый поиск офферов (SQLite FTS5) с фасетами по категориям
+
+Индекс offers_fts (title, description, category) обновляется триггерами
+на offers (см. миграцию 7), так что его не нужно поддерживать в коде
+создания и изменения оффера. Токенизатор unicode61 приводит к нижнему
+регистру и кириллицу; русских окончаний FTS5 не знает, поэтому слова
+запроса укорачиваются до основы (stem) и ищутся как префиксы.
+В PostgreSQL и других СУБД без FTS5 - поиск подстрок через ILIKE.
+"""
+import re
+
+from sqlalchemy import Column, Float, Integer, MetaData, Text, Table, func, literal_column, null, select, tuple_, union_all
+
+from .models import db, Offer
+from . import pagination
+
+
+# Отдельные метаданные: db.create_all() не должен создавать её обычной таблицей
+FTS = Table(
+    'offers_fts', MetaData(),
+    Column('rowid', Integer),
+    Column('title', Text),
+    Column('description', Text),
+    Column('category', Text),
+    Column('offers_fts', Text)  # скрытая колонка FTS5 для MATCH и bm25
+)
+
+# Веса колонок в bm25: совпадение в названии важнее, чем в описании
+WEIGHTS = (10.0, 1.0, 5.0)
+
+# Сортировки: имя -> (колонки ключа страницы в matches, по убыванию)
+SORTS = {
+    'relevance': (('rank', 'id'), False),
+    'newest': (('id',), True),
+    'price_high': (('price', 'id'), True),
+    'price_low': (('price', 'id'), False),
+    'commission': (('commission_percent', 'id'), True)
+}
+
+# Окончания русских слов, от длинных к коротким
+ENDINGS = (
+    'иями', 'ями', 'ами', 'иям', 'ием', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ой', 'ей', 'ий', 'ый', 'ом', 'ем', 'ам', 'ям',
+    'ах', 'ях', 'ов', 'ев', 'ию', 'ью', 'ия', 'ья',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'
+)
+MIN_STEM = 3
+
+_WORD = re.compile(r'\w+')
+_CYRILLIC = re.compile(r'[а-я]')
+
+
+def normalize(text):
+    """Нижний регистр и ё -> е (unicode61 не считает их одной буквой)"""
+    return text.lower().replace('ё', 'е')
+
+
+def stem(word):
+    """Основа русского слова: без самого длинного окончания, не короче MIN_STEM"""
+    if not _CYRILLIC.search(word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def terms(q):
+    """Основы слов запроса (слова из одной буквы отбрасываются)"""
+    return [stem(word) for word in _WORD.findall(normalize(q)) if len(word) > 1]
+
+
+_fts_available = False
+
+
+def fts_available():
+    """Есть ли индекс offers_fts (SQLite с FTS5 после миграции 7)
+
+    Положительный ответ запоминается в процессе: индекс не удаляется.
+    """
+    global _fts_available
+    if not _fts_available and db.engine.dialect.name == 'sqlite':
+        _fts_available = db.inspect(db.engine).has_table('offers_fts')
+    return _fts_available
+
+
+def _fts_query(words):
+    """Запрос FTS5: все основы как префиксы ("курс"* "python"*)"""
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _matches(words, min_commission):
+    """CTE активных офферов, подходящих под запрос, с рангом bm25"""
+    offers = Offer.__table__
+    query = select(
+        offers.c.id, offers.c.category, offers.c.price, offers.c.commission_percent
+    ).where(offers.c.is_active.is_(True))
+
+    if words and fts_available():
+        query = query.add_columns(func.bm25(FTS.c.offers_fts, *WEIGHTS).label('rank')).join(
+            FTS, FTS.c.rowid == offers.c.id
+        ).where(FTS.c.offers_fts.match(_fts_query(words)))
+    else:
+        # Без ранжирования: сортировка relevance совпадает с порядком id
+        query = query.add_columns(literal_column('0.0', Float).label('rank'))
+        for word in words:
+            pattern = '%' + word.replace('_', '\\_') + '%'
+            query = query.where(
+                offers.c.title.ilike(pattern, escape='\\')
+                | offers.c.description.ilike(pattern, escape='\\')
+                | offers.c.category.ilike(pattern, escape='\\')
+            )
+
+    if min_commission is not None:
+        query = query.where(offers.c.commission_percent >= min_commission)
+
+    # Выборка по индексу выполняется один раз для страницы и для фасетов
+    return query.cte('matches').prefix_with('MATERIALIZED')
+
+
+def parse_args(args):
+    """Разобрать q, category, min_commission и sort из query string
+
+    Возвращает (q, category, min_commission, sort), при ошибке - ValueError.
+    """
+    q = args.get('q', '').strip()
+    category = args.get('category') or None
+
+    min_commission = args.get('min_commission')
+    if min_commission:
+        try:
+            min_commission = float(min_commission)
+        except ValueError:
+            raise ValueError('min_commission должен быть числом')
+    else:
+        min_commission = None
+
+    sort = args.get('sort') or ('relevance' if q else 'newest')
+    if sort not in SORTS:
+        raise ValueError(f"sort: допустимые значения {', '.join(SORTS)}")
+
+    return q, category, min_commission, sort
+
+
+def search(q='', category=None, min_commission=None, sort='relevance', limit=pagination.DEFAULT_LIMIT, cursor=None):
+    """Страница результатов поиска и фасеты одним запросом
+
+    Возвращает (id офферов страницы по порядку, курсор следующей страницы
+    или None, {категория: число офферов}, всего найдено). Фасеты считаются
+    без учёта фильтра category, total - с ним. Некорректный cursor -
+    ValueError.
+    """
+    matches = _matches(terms(q), min_commission)
+    key_names, descending = SORTS[sort]
+    key = [matches.c[name] for name in key_names]
+
+    page = select(*key)  # ключ всегда заканчивается id
+    if category is not None:
+        page = page.where(matches.c.category == category)
+    if cursor:
+        values = tuple_(*pagination.decode_cursor(cursor, key))
+        page = page.where(tuple_(*key) < values if descending else tuple_(*key) > values)
+    order = [column.desc() for column in key] if descending else key
+    page = page.order_by(*order).limit(limit + 1).subquery()
+
+    # Строки страницы (category = NULL) и фасеты (id = NULL) в одном ответе
+    hits = select(
+        page.c.id, null().label('category'), null().label('count'),
+        func.row_number().over(order_by=[
+            page.c[column.name].desc() if descending else page.c[column.name] for column in key
+        ]).label('position'),
+        *(page.c[column.name].label(f'key_{i}') for i, column in enumerate(key))
+    )
+    facets = select(
+        null(), matches.c.category, func.count(), null(),
+        *(null() for _ in key)
+    ).group_by(matches.c.category)
+
+    rows = db.session.execute(union_all(hits, facets)).all()
+
+    counts = {row.category: row.count for row in rows if row.id is None}
+    if category is not None:
+        total = counts.get(category, 0)
+    else:
+        total = sum(counts.values())
+    facet_counts = {name: count for name, count in counts.items() if name is not None}
+
+    hits = sorted((row for row in rows if row.id is not None), key=lambda row: row.position)
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = pagination.encode_cursor(list(hits[-1][4:]))
+
+    return [row.id for row in hits], next_cursor, facet_counts, total
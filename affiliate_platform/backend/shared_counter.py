@@ -0,0 +1,55 @@
+"""
+Счётчик поколений, общий для всех воркеров на одной машине
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+_COUNTER = struct.Struct('<Q')
+
+
+class SharedCounter:
+    """64-битный счётчик в файле, отображённом в память (mmap)
+
+    Чтение не делает ни системных вызовов, ни запросов к БД, поэтому его
+    можно проверять на каждом запросе. Изменение в одном воркере сразу
+    видно остальным. Если файл не открывается - OSError из конструктора.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _COUNTER.size:
+                os.ftruncate(fd, _COUNTER.size)
+            self._map = mmap.mmap(fd, _COUNTER.size)
+        finally:
+            os.close(fd)
+
+        # Новый файл начинается не с нуля, чтобы не повторить значения,
+        # выданные до пересоздания файла
+        if self.current() == 0:
+            _COUNTER.pack_into(self._map, 0, time.time_ns())
+
+    def current(self):
+        """Текущее значение"""
+        return _COUNTER.unpack_from(self._map)[0]
+
+    def bump(self):
+        """Увеличить счётчик
+
+        Новое значение не меньше текущего времени в наносекундах: даже если
+        два воркера увеличат счётчик одновременно, он всё равно изменится.
+        """
+        with self._lock:
+            value = max(self.current() + 1, time.time_ns())
+            _COUNTER.pack_into(self._map, 0, value)
+        return value
@@ -0,0 +1,187 @@
+"""
+Уникальные посетители: суточные скетчи HyperLogLog по офферу и партнёру
+"""
+import hashlib
+import math
+import zlib
+
+from sqlalchemy import and_, or_, select, update
+
+from .models import db, Offer, VisitorSketch
+from . import partitions
+from .rollups import _day, _insert
+
+
+# 2^12 регистров: 4 КБ на скетч (меньше после сжатия),
+# стандартная ошибка оценки 1.04 / sqrt(4096) ~ 1.6%
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+_POWERS = [2.0 ** -k for k in range(65)]
+
+BACKFILL_BATCH = 10000
+
+
+def visitor_hash(ip_address, user_agent):
+    """64-битный хеш посетителя (ip + user_agent)"""
+    key = f"{ip_address or ''}\x00{user_agent or ''}".encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """Скетч HyperLogLog: оценка числа различных значений в фиксированной памяти
+
+    Скетчи объединяются поэлементным максимумом регистров, поэтому
+    суточные скетчи складываются в любой период без потери точности.
+    """
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers else bytearray(REGISTERS)
+
+    def add(self, value_hash):
+        """Учесть значение по его 64-битному хешу"""
+        index = value_hash >> (64 - PRECISION)
+        rest = value_hash & ((1 << (64 - PRECISION)) - 1)
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Объединить с другим скетчем (на месте)"""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Оценка числа различных значений"""
+        registers = self.registers
+        estimate = _ALPHA * REGISTERS * REGISTERS / sum(_POWERS[r] for r in registers)
+
+        # Поправка для малых значений: linear counting по пустым регистрам
+        zeros = registers.count(0)
+        if zeros and estimate <= 2.5 * REGISTERS:
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        """Сжатое представление для БД"""
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Скетч из сжатого представления (пустые данные - пустой скетч)"""
+        return cls(zlib.decompress(data) if data else None)
+
+
+def _collect(rows, sketches):
+    """Разложить клики по скетчам (day, scope, owner_id)"""
+    for row in rows:
+        day = _day(row['clicked_at'])
+        value_hash = visitor_hash(row.get('ip_address'), row.get('user_agent'))
+        for scope, owner_id in (('offer', row['offer_id']), ('partner', row['partner_id'])):
+            key = (day, scope, owner_id)
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = HyperLogLog()
+            sketch.add(value_hash)
+
+
+def _merge_into_db(sketches):
+    """Объединить скетчи с сохранёнными в БД
+
+    Сначала недостающие строки вставляются пустыми (ON CONFLICT DO
+    NOTHING), затем строки читаются с блокировкой (FOR UPDATE в PostgreSQL;
+    в SQLite транзакция уже держит блокировку записи) и обновляются.
+    Коммит делает вызывающий код.
+    """
+    if not sketches:
+        return
+
+    table = VisitorSketch.__table__
+    db.session.execute(
+        _insert(table).values([
+            {'day': day, 'scope': scope, 'owner_id': owner_id, 'registers': b''}
+            for day, scope, owner_id in sketches
+        ]).on_conflict_do_nothing(index_elements=[table.c.day, table.c.scope, table.c.owner_id])
+    )
+
+    keys = or_(*(
+        and_(VisitorSketch.day == day, VisitorSketch.scope == scope, VisitorSketch.owner_id == owner_id)
+        for day, scope, owner_id in sketches
+    ))
+    stored = db.session.query(
+        VisitorSketch.id, VisitorSketch.day, VisitorSketch.scope, VisitorSketch.owner_id, VisitorSketch.registers
+    ).filter(keys).with_for_update()
+
+    updates = []
+    for row in stored:
+        sketch = sketches[(_day(row.day), row.scope, row.owner_id)]
+        sketch.merge(HyperLogLog.from_bytes(row.registers))
+        updates.append({'id': row.id, 'registers': sketch.to_bytes()})
+
+    db.session.execute(update(VisitorSketch), updates)
+
+
+def record_clicks(rows):
+    """Учесть пачку записанных кликов (словари с колонками Click)"""
+    sketches = {}
+    _collect(rows, sketches)
+    _merge_into_db(sketches)
+
+
+def unique_clicks(partner_id=None, company_id=None, date_from=None, date_to=None):
+    """Оценка уникальных посетителей партнёра или офферов компании за период
+
+    Объединяет суточные скетчи: стоимость зависит от числа дней
+    (и офферов компании), а не от числа кликов. Ошибка - STANDARD_ERROR.
+    """
+    query = db.session.query(VisitorSketch.registers)
+    if partner_id is not None:
+        query = query.filter(VisitorSketch.scope == 'partner', VisitorSketch.owner_id == partner_id)
+    if company_id is not None:
+        offers = db.session.query(Offer.id).filter(Offer.company_id == company_id)
+        query = query.filter(VisitorSketch.scope == 'offer', VisitorSketch.owner_id.in_(offers.scalar_subquery()))
+    if date_from:
+        query = query.filter(VisitorSketch.day >= date_from)
+    if date_to:
+        query = query.filter(VisitorSketch.day <= date_to)
+
+    total = HyperLogLog()
+    for (registers,) in query:
+        if registers:
+            total.merge(HyperLogLog.from_bytes(registers))
+    return total.count()
+
+
+def backfill():
+    """Пересчитать скетчи по всей истории кликов и закоммитить
+
+    Возвращает количество скетчей.
+    """
+    count = rebuild()
+    db.session.commit()
+    return count
+
+
+def rebuild():
+    """Пересчитать скетчи по всей истории кликов (без коммита)
+
+    Клики читаются потоком пачками, скетчи собираются в памяти
+    (4 КБ на день и оффер/партнёра). Возвращает количество скетчей.
+    """
+    db.session.query(VisitorSketch).delete(synchronize_session=False)
+
+    sketches = {}
+    clicks = partitions.select_clicks('clicked_at', 'partner_id', 'offer_id', 'ip_address', 'user_agent')
+    rows = db.session.execute(select(clicks).execution_options(yield_per=BACKFILL_BATCH))
+    _collect((row._asdict() for row in rows), sketches)
+
+    items = list(sketches.items())
+    for start in range(0, len(items), BACKFILL_BATCH):
+        db.session.execute(VisitorSketch.__table__.insert(), [
+            {'day': day, 'scope': scope, 'owner_id': owner_id, 'registers': sketch.to_bytes()}
+            for (day, scope, owner_id), sketch in items[start:start + BACKFILL_BATCH]
+        ])
+
+    return len(sketches)
@@ -0,0 +1,128 @@
+"""
+Профиль SQLite для нескольких воркеров: WAL, busy_timeout и PRAGMA на соединение
+"""
+import os
+import threading
+
+from sqlalchemy import event, text
+
+from .models import db
+
+
+# Ключ конфигурации -> PRAGMA. busy_timeout первым: смена journal_mode
+# сама требует блокировки, пока соседний воркер пишет
+PRAGMAS = (
+    ('SQLITE_BUSY_TIMEOUT', 'busy_timeout'),
+    ('SQLITE_JOURNAL_MODE', 'journal_mode'),
+    ('SQLITE_SYNCHRONOUS', 'synchronous'),
+    ('SQLITE_CACHE_SIZE', 'cache_size'),
+    ('SQLITE_MMAP_SIZE', 'mmap_size'),
+    ('SQLITE_TEMP_STORE', 'temp_store'),
+)
+
+DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',  # в WAL не теряет целостность, fsync только на чекпоинте
+    'SQLITE_BUSY_TIMEOUT': 5000,  # мс ожидания блокировки вместо "database is locked"
+    'SQLITE_CACHE_SIZE': -20000,  # отрицательное значение - в КиБ (~20 МБ)
+    'SQLITE_MMAP_SIZE': 268435456,  # 256 МБ
+    'SQLITE_TEMP_STORE': 'MEMORY',
+    'SQLITE_CHECKPOINT_INTERVAL': 60,  # секунд, 0 - отключить
+    'SQLITE_CHECKPOINT_MODE': 'PASSIVE',
+}
+
+
+def apply_pragmas(dbapi_connection, config):
+    """Выполнить PRAGMA из конфигурации на DBAPI-соединении sqlite3"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for key, pragma in PRAGMAS:
+            value = config.get(key)
+            if value is not None:
+                cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+
+class SQLiteTuning:
+    """Настройка каждого нового соединения SQLite и периодический WAL checkpoint"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        # Счётчики
+        self.checkpoints = 0
+        self.last_checkpoint = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Подключить к приложению (после db.init_app)"""
+        for key, value in DEFAULTS.items():
+            app.config.setdefault(key, value)
+
+        self.app = app
+        app.extensions['sqlite_tuning'] = self
+
+        with app.app_context():
+            engine = db.engine
+
+        if engine.dialect.name != 'sqlite':
+            return
+
+        config = app.config
+
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, config)
+
+        if config['SQLITE_CHECKPOINT_INTERVAL']:
+            app.before_request(self._ensure_started)
+
+    def _ensure_started(self):
+        """Запустить поток чекпоинтов (лениво, уже внутри воркера)"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='wal-checkpoint', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Цикл фонового потока"""
+        while not self._stop.wait(self.app.config['SQLITE_CHECKPOINT_INTERVAL']):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                self.app.logger.warning(f"WAL checkpoint не выполнен: {e}")
+
+    def checkpoint(self):
+        """Перенести WAL в основной файл базы
+
+        Возвращает (busy, страниц в WAL, перенесено страниц).
+        """
+        mode = self.app.config['SQLITE_CHECKPOINT_MODE']
+
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                result = tuple(connection.execute(text(f"PRAGMA wal_checkpoint({mode})")).one())
+
+        self.checkpoints += 1
+        self.last_checkpoint = result
+        return result
+
+    def stats(self):
+        """Счётчики для мониторинга"""
+        return {
+            'checkpoints': self.checkpoints,
+            'last_checkpoint': list(self.last_checkpoint) if self.last_checkpoint else None
+        }
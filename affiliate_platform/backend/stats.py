@@ -0,0 +1,175 @@
+"""
+Агрегирующие запросы статистики на стороне БД
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, func
+
+from .models import db, Offer, AffiliateLink, Conversion, DailyStat
+
+
+CONVERSION_STATUSES = ('pending', 'approved', 'rejected', 'paid')
+
+# Допустимые значения group_by для суточных агрегатов
+ROLLUP_GROUPS = {
+    'day': DailyStat.day,
+    'partner': DailyStat.partner_id,
+    'offer': DailyStat.offer_id,
+    'utm_source': DailyStat.utm_source,
+    'utm_campaign': DailyStat.utm_campaign
+}
+
+# Те же группировки по сырым конверсиям (UTM берутся из ссылки)
+CONVERSION_GROUPS = {
+    'day': func.date(Conversion.created_at),
+    'partner': Conversion.partner_id,
+    'offer': Conversion.offer_id,
+    'utm_source': AffiliateLink.utm_source,
+    'utm_campaign': AffiliateLink.utm_campaign
+}
+
+
+def parse_period(args):
+    """Разобрать date_from и date_to из query string
+
+    Возвращает (date_from, date_to), при ошибке - ValueError.
+    """
+    try:
+        date_from = date.fromisoformat(args['date_from']) if args.get('date_from') else None
+        date_to = date.fromisoformat(args['date_to']) if args.get('date_to') else None
+    except (TypeError, ValueError):
+        raise ValueError('Даты указываются в формате YYYY-MM-DD')
+
+    if date_from and date_to and date_from > date_to:
+        raise ValueError('date_from не может быть позже date_to')
+
+    return date_from, date_to
+
+
+def parse_filters(args):
+    """Разобрать date_from, date_to и group_by из query string
+
+    Возвращает (date_from, date_to, group_by), при ошибке - ValueError.
+    """
+    date_from, date_to = parse_period(args)
+
+    group_by = [g for g in args.get('group_by', '').split(',') if g]
+    unknown = [g for g in group_by if g not in ROLLUP_GROUPS]
+    if unknown:
+        raise ValueError(f"Недопустимый group_by: {', '.join(unknown)}")
+
+    return date_from, date_to, group_by
+
+
+def company_offers(company_id):
+    """Подзапрос ID офферов компании (фильтр владельца и в выгрузке, и в журнале)"""
+    return db.session.query(Offer.id).filter(Offer.company_id == company_id)
+
+
+def filter_conversions(query, partner_id, company_id, date_from, date_to):
+    """Применить к запросу по конверсиям фильтры владельца и периода"""
+    if partner_id is not None:
+        query = query.filter(Conversion.partner_id == partner_id)
+    if company_id is not None:
+        query = query.filter(Conversion.offer_id.in_(company_offers(company_id)))
+    if date_from:
+        query = query.filter(Conversion.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.filter(Conversion.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return query
+
+
+def _format(value):
+    """Значение группы для JSON"""
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def summary(partner_id=None, company_id=None, date_from=None, date_to=None, group_by=()):
+    """Итоги по суточным агрегатам: SUM, COUNT DISTINCT с CASE
+
+    Без group_by возвращает один словарь, с group_by - список словарей
+    с ключами групп и теми же итогами.
+    """
+    group_columns = [ROLLUP_GROUPS[g] for g in group_by]
+
+    query = db.session.query(
+        *group_columns,
+        func.coalesce(func.sum(DailyStat.clicks), 0),
+        func.coalesce(func.sum(DailyStat.conversions), 0),
+        func.coalesce(func.sum(DailyStat.sales_amount), 0),
+        func.coalesce(func.sum(DailyStat.pending_amount), 0),
+        func.coalesce(func.sum(DailyStat.approved_amount), 0),
+        func.coalesce(func.sum(DailyStat.rejected_amount), 0),
+        func.coalesce(func.sum(DailyStat.paid_amount), 0),
+        func.count(func.distinct(case((DailyStat.conversions > 0, DailyStat.partner_id)))),
+        func.coalesce(func.sum(DailyStat.duplicate_clicks), 0)
+    )
+
+    if partner_id is not None:
+        query = query.filter(DailyStat.partner_id == partner_id)
+    if company_id is not None:
+        query = query.filter(DailyStat.offer_id.in_(company_offers(company_id)))
+    if date_from:
+        query = query.filter(DailyStat.day >= date_from)
+    if date_to:
+        query = query.filter(DailyStat.day <= date_to)
+
+    if group_columns:
+        query = query.group_by(*group_columns).order_by(*group_columns)
+
+    results = []
+    for row in query:
+        groups, totals = row[:len(group_columns)], row[len(group_columns):]
+        result = {g: _format(v) for g, v in zip(group_by, groups)}
+        result.update({
+            'clicks': totals[0],
+            'conversions': totals[1],
+            'sales_amount': totals[2],
+            'pending_amount': totals[3],
+            'approved_amount': totals[4],
+            'rejected_amount': totals[5],
+            'paid_amount': totals[6],
+            'unique_partners': totals[7],
+            'duplicate_clicks': totals[8]
+        })
+        results.append(result)
+
+    return results if group_columns else results[0]
+
+
+def conversion_totals(partner_id=None, company_id=None, date_from=None, date_to=None, group_by=()):
+    """Итоги по сырым конверсиям: COUNT и SUM с CASE по статусу
+
+    Возвращает список кортежей: значения групп, количество, сумма продаж,
+    затем количество и сумма комиссий для каждого статуса из CONVERSION_STATUSES.
+    """
+    group_columns = [CONVERSION_GROUPS[g] for g in group_by]
+
+    status_columns = []
+    for status in CONVERSION_STATUSES:
+        status_columns.append(func.count(case((Conversion.status == status, Conversion.id))))
+        status_columns.append(func.coalesce(
+            func.sum(case((Conversion.status == status, Conversion.commission_amount))), 0
+        ))
+
+    query = db.session.query(
+        *group_columns,
+        func.count(Conversion.id),
+        func.coalesce(func.sum(Conversion.sale_amount), 0),
+        *status_columns
+    )
+
+    if 'utm_source' in group_by or 'utm_campaign' in group_by:
+        query = query.join(AffiliateLink, AffiliateLink.id == Conversion.affiliate_link_id)
+    query = filter_conversions(query, partner_id, company_id, date_from, date_to)
+
+    if group_columns:
+        query = query.group_by(*group_columns)
+
+    return query.all()
+
+
+def recent_conversions(partner_id=None, company_id=None, date_from=None, date_to=None, limit=10):
+    """Последние конверсии: ORDER BY created_at DESC LIMIT"""
+    query = filter_conversions(Conversion.query, partner_id, company_id, date_from, date_to)
+    return query.order_by(Conversion.created_at.desc(), Conversion.id.desc()).limit(limit).all()
@@ -7,7 +7,8 @@ import sys
 # Добавляем текущую директорию в путь
 sys.path.insert(0, os.path.dirname(__file__))
 
-from affiliate_platform.backend.app import app as flask_app, db
+from affiliate_platform.backend.app import app as flask_app
+from affiliate_platform.backend import migrations
 
 # Экспортируем app для Railway auto-detection
 app = flask_app
@@ -15,12 +16,13 @@ app = flask_app
 def init_db():
     """Инициализация базы данных"""
     with app.app_context():
-        db.create_all()
+        migrations.upgrade()
         print("✓ База данных инициализирована")
 
-# Инициализируем БД при первом запуске
-init_db()
+# Миграции применяются до запуска воркеров (start.sh: flask db-upgrade),
+# а не при импорте: иначе их запускал бы каждый воркер gunicorn
 
 if __name__ == "__main__":
+    init_db()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
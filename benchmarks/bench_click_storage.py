@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранения кликов: строки в clicks против справочников (миграция 5)
+
+Заполняет временную базу SQLite кликами в прежнем формате (user_agent,
+referrer, UTM и IP строками в каждой строке), измеряет размер таблицы с
+индексами на строку и время запросов по сырым кликам, затем применяет
+миграцию 5 и повторяет измерения.
+
+    python benchmarks/bench_click_storage.py --rows 200000 --repeat 5
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+DIRECTORY = tempfile.mkdtemp(prefix='bench_click_storage_')
+PATH = os.path.join(DIRECTORY, 'bench.db')
+os.environ['DATABASE_URL'] = f"sqlite:///{PATH}"
+os.environ['CATALOG_VERSION_FILE'] = os.path.join(DIRECTORY, 'catalog.version')
+
+from sqlalchemy import case, func, select, text, true  # noqa: E402
+
+from affiliate_platform.backend.app import app  # noqa: E402
+from affiliate_platform.backend.models import db, utcnow, UtmTuple  # noqa: E402
+from affiliate_platform.backend import migrations, partitions  # noqa: E402
+
+# Таблица clicks до миграции 5
+SCHEMA_BEFORE = """
+DROP TABLE clicks;
+CREATE TABLE clicks (
+    id INTEGER NOT NULL PRIMARY KEY,
+    affiliate_link_id INTEGER NOT NULL,
+    partner_id INTEGER NOT NULL,
+    offer_id INTEGER NOT NULL,
+    click_id VARCHAR(32),
+    ip_address VARCHAR(50),
+    user_agent VARCHAR(500),
+    referrer VARCHAR(500),
+    clicked_at DATETIME,
+    is_duplicate BOOLEAN,
+    utm_source VARCHAR(100),
+    utm_medium VARCHAR(100),
+    utm_campaign VARCHAR(200),
+    utm_content VARCHAR(200),
+    utm_term VARCHAR(200)
+);
+CREATE INDEX ix_clicks_partner_clicked ON clicks (partner_id, clicked_at);
+CREATE INDEX ix_clicks_offer_clicked ON clicks (offer_id, clicked_at);
+CREATE UNIQUE INDEX ix_clicks_click_id ON clicks (click_id);
+"""
+
+# Запросы в прежнем формате - те же, что строили rollups и sketches
+QUERIES_BEFORE = {
+    'backfill-rollups': (
+        "SELECT date(clicked_at), partner_id, offer_id, utm_source, utm_campaign, count(id), "
+        "count(CASE WHEN is_duplicate = 1 THEN id END) FROM clicks "
+        "GROUP BY date(clicked_at), partner_id, offer_id, utm_source, utm_campaign"
+    ),
+    'посетители партнёра': (
+        "SELECT clicked_at, partner_id, offer_id, ip_address, user_agent FROM clicks "
+        "WHERE partner_id = 1 AND clicked_at >= '{since}'"
+    ),
+}
+
+USER_AGENTS = [
+    f"Mozilla/5.0 (Linux; Android {10 + i % 5}; SM-A{500 + i}) AppleWebKit/537.36 "
+    f"(KHTML, like Gecko) Chrome/{110 + i % 20}.0.0.0 Mobile Safari/537.36"
+    for i in range(300)
+]
+REFERRERS = [f"https://t.me/channel_{i}/post" for i in range(200)]
+UTMS = [
+    ('telegram', 'social', f'spring_{i}', f'banner_{i % 4}', None) for i in range(40)
+] + [('google', 'cpc', 'brand', None, f'keyword {i}') for i in range(10)]
+
+
+def fill(rows):
+    """Клики за 30 дней: 20 партнёров, 100 офферов, повторяющиеся UA, referrer и UTM"""
+    db.create_all()
+    with db.engine.begin() as connection:
+        connection.connection.executescript(SCHEMA_BEFORE)
+
+    random.seed(1)
+    start = utcnow() - timedelta(days=30)
+    data = []
+    for i in range(rows):
+        utm = random.choice(UTMS) if random.random() < 0.7 else (None,) * 5
+        data.append((
+            1 + i % 20, 1 + i % 20, 1 + i % 100, f"click{i:012d}",
+            f"{random.randint(1, 223)}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}",
+            random.choice(USER_AGENTS), random.choice(REFERRERS) if random.random() < 0.6 else None,
+            start + timedelta(seconds=i * 30 * 86400 // rows), False, *utm
+        ))
+
+    connection = sqlite3.connect(PATH)
+    connection.executemany(
+        "INSERT INTO clicks (affiliate_link_id, partner_id, offer_id, click_id, ip_address, user_agent, "
+        "referrer, clicked_at, is_duplicate, utm_source, utm_medium, utm_campaign, utm_content, utm_term) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", data
+    )
+    connection.commit()
+    connection.close()
+
+    # Миграции 1-4 уже применены к этой схеме
+    migrations.applied_versions()
+    for version, name, _ in migrations.MIGRATIONS[:4]:
+        db.session.execute(
+            text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+            {'v': version, 'n': name, 't': utcnow()}
+        )
+    db.session.commit()
+    return start
+
+
+def queries_after(since):
+    """Те же запросы по справочникам - как их строит приложение, в SQL"""
+    clicks = partitions.select_clicks(
+        'id', 'clicked_at', 'partner_id', 'offer_id', 'utm_id', 'is_duplicate'
+    ).c
+    day = func.date(clicks.clicked_at)
+    grouped = select(
+        day.label('day'), clicks.partner_id, clicks.offer_id, clicks.utm_id,
+        func.count(clicks.id).label('clicks'),
+        func.count(case((clicks.is_duplicate == true(), clicks.id))).label('duplicate_clicks')
+    ).group_by(day, clicks.partner_id, clicks.offer_id, clicks.utm_id).subquery()
+    rollup = select(
+        grouped.c.day, grouped.c.partner_id, grouped.c.offer_id, UtmTuple.utm_source, UtmTuple.utm_campaign,
+        grouped.c.clicks, grouped.c.duplicate_clicks
+    ).outerjoin(UtmTuple, UtmTuple.id == grouped.c.utm_id)
+
+    visitors = partitions.select_clicks(
+        'clicked_at', 'partner_id', 'offer_id', 'ip_address', 'user_agent', date_from=since
+    )
+    visitors = select(visitors).where(visitors.c.partner_id == 1)
+
+    return {
+        name: str(query.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        for name, query in (('backfill-rollups', rollup), ('посетители партнёра', visitors))
+    }
+
+
+def table_size(connection):
+    """Байт в страницах clicks и её индексов (dbstat)"""
+    return connection.execute(
+        "SELECT sum(pgsize) FROM dbstat WHERE name = 'clicks' OR name LIKE 'ix_clicks_%'"
+    ).fetchone()[0]
+
+
+def measure(connection, sql, repeat):
+    """Лучшее время из repeat прогонов и число строк"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = len(connection.execute(sql).fetchall())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def report(title, queries, rows, repeat):
+    """VACUUM, размер и время запросов"""
+    connection = sqlite3.connect(PATH)
+    connection.execute("VACUUM")
+    size = table_size(connection)
+    print(f"{title}: {size / rows:6.1f} байт на клик (clicks с индексами: {size / 1e6:.1f} МБ)")
+
+    results = {}
+    for name, sql in queries.items():
+        elapsed, count = measure(connection, sql, repeat)
+        results[name] = elapsed
+        print(f"    {name:22} {elapsed * 1000:8.1f} мс ({count} строк)")
+    connection.close()
+    return size, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        start = fill(args.rows)
+        since = (start + timedelta(days=20)).date()
+        print(f"Кликов: {args.rows}, лучший из {args.repeat} прогонов\n")
+
+        before = {name: sql.format(since=since) for name, sql in QUERIES_BEFORE.items()}
+        size_before, time_before = report('до', before, args.rows, args.repeat)
+
+        started = time.perf_counter()
+        migrations.upgrade()
+        print(f"\nМиграция 5: {time.perf_counter() - started:.1f} с\n")
+        db.session.remove()
+
+        size_after, time_after = report('после', queries_after(since), args.rows, args.repeat)
+
+        print(f"\nРазмер: x{size_before / size_after:.1f} меньше")
+        for name in time_before:
+            print(f"{name:26} x{time_before[name] / time_after[name]:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сериализации списков: ORM + to_dict() + jsonify против проекций
+
+Заполняет временную базу SQLite и сравнивает строки в секунду для
+списков офферов, ссылок и выплат (запрос + сериализация в JSON).
+
+    python benchmarks/bench_serializers.py --rows 10000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+DIRECTORY = tempfile.mkdtemp(prefix='bench_serializers_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DIRECTORY, 'bench.db')}"
+os.environ['CATALOG_VERSION_FILE'] = os.path.join(DIRECTORY, 'catalog.version')
+
+from flask import jsonify  # noqa: E402
+
+from affiliate_platform.backend.app import app  # noqa: E402
+from affiliate_platform.backend.models import db, utcnow, User, Offer, AffiliateLink, Payout  # noqa: E402
+from affiliate_platform.backend import serializers  # noqa: E402
+
+BASE_URL = 'http://localhost:5000'
+
+
+def fill(rows):
+    """Заполнить базу: компания, партнёр и rows офферов, ссылок и выплат"""
+    db.create_all()
+    now = utcnow()
+
+    db.session.execute(db.insert(User), [
+        {'id': 1, 'email': 'company@example.com', 'password_hash': '-', 'user_type': 'company'},
+        {'id': 2, 'email': 'partner@example.com', 'password_hash': '-', 'user_type': 'partner'},
+    ])
+    db.session.execute(db.insert(Offer), [
+        {'company_id': 1, 'title': f'Курс по Python #{i}', 'description': 'Описание оффера ' * 5,
+         'product_url': f'https://example.com/product/{i}', 'price': 100000 + i * 0.5,
+         'commission_percent': 15, 'platform_percent': 20.0, 'category': 'Образование',
+         'is_active': True, 'created_at': now - timedelta(minutes=i)}
+        for i in range(rows)
+    ])
+    db.session.execute(db.insert(AffiliateLink), [
+        {'partner_id': 2, 'offer_id': i + 1, 'tracking_code': f'code{i:06d}',
+         'utm_source': 'telegram' if i % 2 else None, 'utm_campaign': 'spring' if i % 3 else None,
+         'is_active': True, 'created_at': now}
+        for i in range(rows)
+    ])
+    db.session.execute(db.insert(Payout), [
+        {'partner_id': 2, 'amount': 1000 + i, 'payment_method': 'card', 'status': 'pending',
+         'requested_at': now - timedelta(seconds=i)}
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+def orm_path(model, context):
+    """Как было: ORM-объекты, to_dict() и jsonify"""
+    objects = model.query.order_by(model.id).all()
+    items = [obj.to_dict(context) if context else obj.to_dict() for obj in objects]
+    return jsonify({'items': items, 'next_cursor': None}).get_data()
+
+
+def projection_path(projection, model, context):
+    """Проекция: кортежи колонок сразу в JSON"""
+    rows = projection.query().order_by(model.id).all()
+    return serializers.page(projection.encode_all(rows, context), None)
+
+
+def measure(function, repeat):
+    """Лучшее время из repeat прогонов и результат"""
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ('offers', Offer, serializers.OFFER, None),
+        ('affiliate_links', AffiliateLink, serializers.AFFILIATE_LINK, BASE_URL),
+        ('payouts', Payout, serializers.PAYOUT, None),
+    ]
+
+    with app.test_request_context('/', base_url=BASE_URL):
+        fill(args.rows)
+        print(f"Строк в списке: {args.rows}, лучший из {args.repeat} прогонов\n")
+
+        for name, model, projection, context in cases:
+            orm_time, orm_body = measure(lambda: orm_path(model, context), args.repeat)
+            fast_time, fast_body = measure(lambda: projection_path(projection, model, context), args.repeat)
+
+            print(f"{name:16} to_dict: {args.rows / orm_time:10.0f} строк/с   "
+                  f"проекция: {args.rows / fast_time:10.0f} строк/с   "
+                  f"x{orm_time / fast_time:4.1f}   "
+                  f"побайтно равны: {'да' if orm_body == fast_body else 'НЕТ'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк SQLite: пропускная способность чтения/записи до и после профиля WAL
+
+Несколько процессов (как воркеры gunicorn) одновременно пишут клики
+отдельными транзакциями и читают агрегаты из того же файла базы.
+
+    python benchmarks/bench_sqlite.py --writers 4 --readers 4 --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from affiliate_platform.backend.sqlite_tuning import DEFAULTS, apply_pragmas
+
+# Настройки SQLite "из коробки" (как было до профиля): journal_mode=DELETE,
+# synchronous=FULL и таймаут sqlite3 по умолчанию (5 с)
+BASELINE = {}
+
+SCHEMA = """
+CREATE TABLE clicks (
+    id INTEGER PRIMARY KEY,
+    partner_id INTEGER NOT NULL,
+    offer_id INTEGER NOT NULL,
+    ip_address VARCHAR(50),
+    user_agent VARCHAR(500),
+    clicked_at DATETIME
+);
+CREATE INDEX ix_clicks_partner_clicked ON clicks (partner_id, clicked_at);
+"""
+
+
+def connect(path, config):
+    """Соединение с заданным профилем"""
+    connection = sqlite3.connect(path)
+    apply_pragmas(connection, config)
+    return connection
+
+
+def writer(path, config, seconds, results):
+    """Вставлять по одному клику на транзакцию"""
+    connection = connect(path, config)
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        try:
+            connection.execute(
+                "INSERT INTO clicks (partner_id, offer_id, ip_address, user_agent, clicked_at) "
+                "VALUES (?, ?, '127.0.0.1', 'Mozilla/5.0', datetime('now'))",
+                (done % 50, done % 200)
+            )
+            connection.commit()
+            done += 1
+        except sqlite3.OperationalError:
+            connection.rollback()
+            errors += 1
+
+    results.put(('write', done, errors))
+
+
+def reader(path, config, seconds, results):
+    """Считать клики партнёра, как в статистике"""
+    connection = connect(path, config)
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        try:
+            connection.execute(
+                "SELECT count(*) FROM clicks WHERE partner_id = ? AND clicked_at >= '2000-01-01'",
+                (done % 50,)
+            ).fetchone()
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+
+    results.put(('read', done, errors))
+
+
+def run(name, config, args):
+    """Прогнать один профиль и напечатать результат"""
+    directory = tempfile.mkdtemp(prefix='bench_sqlite_')
+    path = os.path.join(directory, 'bench.db')
+
+    connection = connect(path, config)
+    connection.executescript(SCHEMA)
+    connection.close()
+
+    results = multiprocessing.Queue()
+    processes = (
+        [multiprocessing.Process(target=writer, args=(path, config, args.seconds, results))
+         for _ in range(args.writers)] +
+        [multiprocessing.Process(target=reader, args=(path, config, args.seconds, results))
+         for _ in range(args.readers)]
+    )
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    totals = {'write': [0, 0], 'read': [0, 0]}
+    for _ in processes:
+        kind, done, errors = results.get()
+        totals[kind][0] += done
+        totals[kind][1] += errors
+
+    print(f"{name:10} запись: {totals['write'][0] / args.seconds:10.0f} оп/с "
+          f"(locked: {totals['write'][1]:6})   "
+          f"чтение: {totals['read'][0] / args.seconds:10.0f} оп/с "
+          f"(locked: {totals['read'][1]:6})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"Процессов: {args.writers} пишущих, {args.readers} читающих, {args.seconds} с\n")
+    run('до', BASELINE, args)
+    run('после', DEFAULTS, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,13 +8,14 @@ import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'affiliate_platform'))
 
 from affiliate_platform.backend.app import app, db
+from affiliate_platform.backend import migrations
 from affiliate_platform.backend.models import User, Offer, PasswordReset
 
 def init_database():
     """Инициализировать базу данных"""
     with app.app_context():
         # Создание таблиц
-        db.create_all()
+        migrations.upgrade()
         print("✓ Таблицы базы данных созданы")
 
         # Проверка существующих данных
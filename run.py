@@ -8,12 +8,13 @@ import sys
 # Добавляем путь к модулям
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'affiliate_platform'))
 
-from affiliate_platform.backend.app import app, db
+from affiliate_platform.backend.app import app
+from affiliate_platform.backend import migrations
 
 if __name__ == '__main__':
     with app.app_context():
         # Создание базы данных
-        db.create_all()
+        migrations.upgrade()
         print("✓ База данных создана")
 
     print("\n" + "="*60)
@@ -3,8 +3,8 @@
 
 echo "🚀 Запуск Affiliate Bridge Platform..."
 
-# Инициализация БД (если нужно)
-# python init_db.py
+# Миграции схемы - один раз до запуска воркеров
+flask --app app db-upgrade || exit 1
 
 # Запуск приложения
 exec gunicorn app:app \
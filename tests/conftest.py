@@ -0,0 +1,108 @@
+"""
+Общие фикстуры: приложение на чистой базе для каждого теста
+
+По умолчанию - временный файл SQLite. Если задан DATABASE_URL, тесты идут
+на этой базе (например, PostgreSQL из DEPLOYMENT.md); все её таблицы
+удаляются перед каждым тестом, поэтому это должна быть отдельная база.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import MetaData
+
+DIRECTORY = tempfile.mkdtemp(prefix='affiliate_tests_')
+DATABASE = os.path.join(DIRECTORY, 'test.db')
+
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{DATABASE}')
+os.environ.update({
+    'CATALOG_VERSION_FILE': os.path.join(DIRECTORY, 'catalog.version'),
+    'AUTH_VERSION_FILE': os.path.join(DIRECTORY, 'auth.version'),
+    'TRACKING_VERSION_FILE': os.path.join(DIRECTORY, 'tracking.version'),
+    'MIGRATIONS_LOCK_FILE': os.path.join(DIRECTORY, 'migrations.lock'),
+    'CLICK_WRITE_BEHIND': 'false',
+    'MAIL_ENABLED': 'false',
+    # Быстрый KDF: тестам не нужна стойкость хешей
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+})
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from affiliate_platform.backend import app as app_module  # noqa: E402
+from affiliate_platform.backend import migrations  # noqa: E402
+from affiliate_platform.backend.models import db  # noqa: E402
+
+
+def reset_database():
+    """Удалить все таблицы базы (схему затем создают миграции)
+
+    Временный файл SQLite просто удаляется. В другой СУБД удаляются все
+    таблицы, в том числе не описанные моделями: schema_migrations и
+    архивные партиции кликов.
+    """
+    db.session.remove()
+    if db.engine.url.database != DATABASE:
+        tables = MetaData()
+        tables.reflect(db.engine)
+        tables.drop_all(db.engine)
+        return
+
+    db.engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DATABASE + suffix):
+            os.remove(DATABASE + suffix)
+
+
+@pytest.fixture
+def app():
+    """Приложение с пустой базой и сброшенными кешами воркера"""
+    flask_app = app_module.app
+    config = dict(flask_app.config)
+
+    with flask_app.app_context():
+        reset_database()
+        migrations.upgrade()
+
+        # Кеши воркера не должны пережить базу предыдущего теста
+        app_module.catalog_version.bump()
+        app_module.tracking_cache.clear()
+        app_module.auth_cache.clear()
+
+        yield flask_app
+
+        db.session.remove()
+
+    flask_app.config.clear()
+    flask_app.config.update(config)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def register(client, email, user_type, password='pw123456'):
+    """Зарегистрировать пользователя и вернуть заголовки с его токеном"""
+    client.post('/api/register', json={'email': email, 'password': password, 'user_type': user_type})
+    token = client.post('/api/login', json={'email': email, 'password': password}).json['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def company(client):
+    return register(client, 'company@example.com', 'company')
+
+
+@pytest.fixture
+def partner(client):
+    return register(client, 'partner@example.com', 'partner')
+
+
+def create_link(client, company, partner, **offer):
+    """Оффер компании и ссылка партнёра на него (словари из ответов API)"""
+    offer = client.post('/api/offers', json=dict({
+        'title': 'Курс', 'price': 1000, 'commission_percent': 10, 'product_url': 'https://shop.example/p'
+    }, **offer), headers=company).json['offer']
+    link = client.post('/api/affiliate-links', json={'offer_id': offer['id']}, headers=partner).json['link']
+    return offer, link
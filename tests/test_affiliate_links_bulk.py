@@ -0,0 +1,76 @@
+"""
+Массовое создание партнёрских ссылок: переиспользование существующих
+"""
+from sqlalchemy import func, select
+
+from affiliate_platform.backend.models import db, AffiliateLink
+from conftest import create_link, register
+
+
+def create_offer(client, company, title):
+    return client.post('/api/offers', json={
+        'title': title, 'price': 1000, 'commission_percent': 10
+    }, headers=company).json['offer']
+
+
+def bulk(client, partner, *items):
+    return client.post('/api/affiliate-links/bulk', json={'links': list(items)}, headers=partner)
+
+
+def count_links():
+    return db.session.scalar(select(func.count()).select_from(AffiliateLink))
+
+
+def test_existing_link_is_reused(client, company, partner):
+    offer, link = create_link(client, company, partner)
+    other = create_offer(client, company, 'Вебинар')
+
+    response = bulk(
+        client, partner,
+        {'offer_id': offer['id'], 'utm_source': 'telegram'},
+        {'offer_id': other['id'], 'utm_source': 'vk'},
+        {'offer_id': other['id'], 'utm_source': 'ok'},
+        {'offer_id': 10 ** 6}
+    )
+    assert response.status_code == 201
+    body = response.json
+    assert body['created'] == 1
+
+    reused, created, repeated, missing = body['links']
+    # Ссылка на оффер у партнёра одна: существующая возвращается без изменений
+    assert reused['created'] is False
+    assert reused['link']['id'] == link['id'] and reused['link']['tracking_code'] == link['tracking_code']
+    assert 'utm_source' not in reused['link']
+
+    # Повтор оффера в запросе - та же новая ссылка с UTM первого вхождения
+    assert created['created'] is True and created['link']['utm_source'] == 'vk'
+    assert repeated['link']['id'] == created['link']['id']
+    assert missing == {'offer_id': 10 ** 6, 'error': 'Оффер не найден'}
+    assert count_links() == 2
+
+    # Повторный запрос ничего не создаёт
+    response = bulk(client, partner, {'offer_id': offer['id']}, {'offer_id': other['id']})
+    assert response.status_code == 200
+    assert response.json['created'] == 0
+    assert [item['link']['id'] for item in response.json['links']] == [link['id'], created['link']['id']]
+    assert count_links() == 2
+
+
+def test_links_of_other_partner_are_not_reused(client, company, partner):
+    offer, link = create_link(client, company, partner)
+    other_partner = register(client, 'partner2@example.com', 'partner')
+
+    response = bulk(client, other_partner, {'offer_id': offer['id']})
+    assert response.status_code == 201
+    item = response.json['links'][0]
+    assert item['created'] is True and item['link']['id'] != link['id']
+    assert item['link']['tracking_code'] != link['tracking_code']
+
+
+def test_bulk_validation(app, client, company, partner):
+    assert bulk(client, company, {'offer_id': 1}).status_code == 403
+    assert bulk(client, partner).status_code == 400
+    assert bulk(client, partner, {'offer_id': '1'}).status_code == 400
+
+    app.config['LINKS_BULK_MAX'] = 2
+    assert bulk(client, partner, *[{'offer_id': i} for i in range(3)]).status_code == 400
@@ -0,0 +1,80 @@
+"""
+Кеш авторизации token_required: сброс при смене пароля, роли, активности и баланса
+"""
+from datetime import timedelta
+
+from sqlalchemy import insert
+
+from affiliate_platform.backend import ledger
+from affiliate_platform.backend.app import auth_cache
+from affiliate_platform.backend.models import db, utcnow, User, Conversion, PasswordReset
+
+from conftest import create_link
+
+
+def user(email):
+    return User.query.filter_by(email=email).one()
+
+
+def test_repeated_requests_hit_cache(client, partner):
+    client.get('/api/affiliate-links', headers=partner)
+    hits = auth_cache.hits
+    client.get('/api/affiliate-links', headers=partner)
+    assert auth_cache.hits == hits + 1
+
+
+def test_deactivated_user_gets_403(client, partner):
+    assert client.get('/api/affiliate-links', headers=partner).status_code == 200
+
+    user('partner@example.com').is_active = False
+    db.session.commit()
+    response = client.get('/api/affiliate-links', headers=partner)
+    assert response.status_code == 403
+    assert response.json['error'] == 'Аккаунт деактивирован'
+
+    user('partner@example.com').is_active = True
+    db.session.commit()
+    assert client.get('/api/affiliate-links', headers=partner).status_code == 200
+
+
+def test_role_change_applies_immediately(client, partner):
+    offer = {'title': 'Курс', 'price': 1000, 'commission_percent': 10}
+    assert client.post('/api/offers', json=offer, headers=partner).status_code == 403
+
+    user('partner@example.com').user_type = 'company'
+    db.session.commit()
+    assert client.post('/api/offers', json=offer, headers=partner).status_code == 201
+
+
+def test_password_reset_drops_cached_user(client, partner):
+    client.get('/api/affiliate-links', headers=partner)
+    user_id = user('partner@example.com').id
+    assert user_id in auth_cache._users
+
+    client.post('/api/password-reset/request', json={'email': 'partner@example.com'})
+    token = PasswordReset.query.filter_by(user_id=user_id, used=False).one().reset_token
+    response = client.post('/api/password-reset/confirm', json={'token': token, 'new_password': 'new-pw-123'})
+    assert response.status_code == 200
+    assert user_id not in auth_cache._users
+
+
+def test_balance_is_cached_and_refreshed_by_ledger(client, company, partner):
+    _, link = create_link(client, company, partner)
+    assert client.get('/api/stats/partner', headers=partner).json['balance'] == 0
+
+    db.session.execute(insert(Conversion), [{
+        'affiliate_link_id': link['id'], 'partner_id': link['partner_id'], 'offer_id': link['offer_id'],
+        'sale_amount': 1000, 'commission_amount': 80, 'platform_fee': 20, 'status': 'pending',
+        'created_at': utcnow() - timedelta(days=30)
+    }])
+    db.session.commit()
+    ledger.settle(hold_days=14)
+    assert client.get('/api/stats/partner', headers=partner).json['balance'] == 80
+
+    client.post('/api/payouts', json={'amount': 30}, headers=partner)
+    assert client.get('/api/stats/partner', headers=partner).json['balance'] == 50
+
+    # Отказ в выплате ничего не меняет и кеш не сбрасывает
+    invalidations = auth_cache.invalidations
+    assert client.post('/api/payouts', json={'amount': 500}, headers=partner).status_code == 400
+    assert auth_cache.invalidations == invalidations
@@ -0,0 +1,37 @@
+"""
+Кеш каталога: страницы GET /api/offers из снимка воркера
+"""
+import json
+
+import pytest
+
+from affiliate_platform.backend import pagination
+from affiliate_platform.backend.app import catalog_cache
+
+from test_pagination import FORGED, cursor
+
+
+@pytest.fixture
+def offer_ids(client, company):
+    return [client.post('/api/offers', json={
+        'title': f'Курс {i}', 'price': 1000, 'commission_percent': 10
+    }, headers=company).json['offer']['id'] for i in range(5)]
+
+
+def test_pages_follow_cursor(app, offer_ids):
+    page = json.loads(catalog_cache.offers_page(2))
+    assert [item['id'] for item in page['items']] == offer_ids[:2]
+
+    page = json.loads(catalog_cache.offers_page(2, page['next_cursor']))
+    assert [item['id'] for item in page['items']] == offer_ids[2:4]
+
+    page = json.loads(catalog_cache.offers_page(10, pagination.encode_cursor([offer_ids[3]])))
+    assert [item['id'] for item in page['items']] == offer_ids[4:]
+    assert page['next_cursor'] is None
+
+
+@pytest.mark.parametrize('values', FORGED)
+def test_forged_cursor_is_value_error(app, offer_ids, values):
+    # Раньше bisect по id снимка падал с TypeError (500 вместо 400)
+    with pytest.raises(ValueError):
+        catalog_cache.offers_page(2, cursor(values))
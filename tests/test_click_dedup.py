@@ -0,0 +1,35 @@
+"""
+Отсев повторных кликов: смена поколений фильтра Блума
+"""
+from flask import Flask
+
+from affiliate_platform.backend.click_dedup import ClickDeduplicator
+
+
+def deduplicator(capacity):
+    app = Flask(__name__)
+    app.config.update(CLICK_DEDUP_WINDOW=3600, CLICK_DEDUP_CAPACITY=capacity)
+    return ClickDeduplicator(app)
+
+
+def test_repeat_within_window_is_duplicate():
+    dedup = deduplicator(100)
+    assert not dedup.is_duplicate('10.0.0.1', 'Mozilla/5.0', 'abc')
+    assert dedup.is_duplicate('10.0.0.1', 'Mozilla/5.0', 'abc')
+    assert not dedup.is_duplicate('10.0.0.2', 'Mozilla/5.0', 'abc')
+
+
+def test_full_filter_rotates_before_window():
+    dedup = deduplicator(100)
+    false_positives = 0
+    for i in range(1000):
+        false_positives += dedup.is_duplicate(f'10.0.{i // 256}.{i % 256}', 'Mozilla/5.0', 'abc')
+
+    # Окно не истекло, но поколение сменялось по заполнению фильтра
+    assert dedup.rotations >= 9
+    assert dedup._current.count <= 100
+    # Переполненный фильтр считал бы повторами почти все новые клики
+    assert false_positives < 10
+
+    # Клик из предыдущего поколения всё ещё повтор
+    assert dedup.is_duplicate('10.0.3.231', 'Mozilla/5.0', 'abc')
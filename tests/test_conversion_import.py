@@ -0,0 +1,102 @@
+"""
+Пакетная загрузка конверсий: некорректные суммы и гонка с параллельной загрузкой
+"""
+import json
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from affiliate_platform.backend import conversion_import
+from affiliate_platform.backend.models import db, utcnow, Conversion
+
+
+def create_link(client, company, partner):
+    offer = client.post('/api/offers', json={
+        'title': 'Курс', 'price': 1000, 'commission_percent': 10
+    }, headers=company).json['offer']
+    return client.post('/api/affiliate-links', json={'offer_id': offer['id']}, headers=partner).json['link']
+
+
+def upload(client, company, rows):
+    body = '\n'.join(rows if isinstance(rows[0], str) else map(json.dumps, rows))
+    response = client.post('/api/conversions/batch', data=body, headers=dict(
+        company, **{'Content-Type': 'application/x-ndjson'}
+    ))
+    assert response.status_code == 200
+    return response.json
+
+
+def test_non_finite_sale_amount_is_error(client, company, partner):
+    link = create_link(client, company, partner)
+    result = upload(client, company, [
+        f'{{"order_id": "{order_id}", "sale_amount": {amount}, "affiliate_link_id": {link["id"]}}}'
+        for order_id, amount in (('a', 'NaN'), ('b', 'Infinity'), ('c', '-Infinity'), ('d', '500'))
+    ])
+    assert [row['status'] for row in result['results']] == ['error', 'error', 'error', 'created']
+
+
+def test_sale_amount_must_fit_money_column(client, company, partner):
+    link = create_link(client, company, partner)
+    result = upload(client, company, [
+        {'order_id': order_id, 'sale_amount': amount, 'affiliate_link_id': link['id']}
+        for order_id, amount in (('a', 1e308), ('b', 10 ** 12), ('c', 999999999999.999), ('d', 999999999999.99))
+    ])
+    assert [row['status'] for row in result['results']] == ['error', 'error', 'error', 'created']
+
+
+def test_conflict_with_parallel_upload_becomes_duplicate(client, company, partner, monkeypatch):
+    link = create_link(client, company, partner)
+    ingest_chunk = conversion_import._ingest_chunk
+    calls = []
+
+    def racing(chunk, company_id, commissions):
+        calls.append(chunk)
+        if len(calls) == 1:
+            # Параллельный запрос записал тот же order_id между проверкой и INSERT
+            db.session.execute(insert(Conversion), [{
+                'affiliate_link_id': link['id'], 'partner_id': link['partner_id'], 'offer_id': link['offer_id'],
+                'order_id': 'a', 'sale_amount': 500, 'commission_amount': 40, 'platform_fee': 10,
+                'status': 'pending', 'created_at': utcnow()
+            }])
+            db.session.commit()
+            raise IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed: conversions.order_id'))
+        return ingest_chunk(chunk, company_id, commissions)
+
+    monkeypatch.setattr(conversion_import, '_ingest_chunk', racing)
+    result = upload(client, company, [
+        {'order_id': 'a', 'sale_amount': 500, 'affiliate_link_id': link['id']},
+        {'order_id': 'b', 'sale_amount': 700, 'affiliate_link_id': link['id']}
+    ])
+    assert len(calls) == 2
+    assert [row['status'] for row in result['results']] == ['duplicate', 'created']
+
+
+def test_persistent_conflict_marks_chunk_rows_as_errors(client, company, partner, monkeypatch):
+    link = create_link(client, company, partner)
+
+    def conflicting(chunk, company_id, commissions):
+        raise IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed: conversions.order_id'))
+
+    monkeypatch.setattr(conversion_import, '_ingest_chunk', conflicting)
+    result = upload(client, company, [
+        {'order_id': 'a', 'sale_amount': 500, 'affiliate_link_id': link['id']},
+        'не json'
+    ])
+    assert result['errors'] == 2
+    assert result['results'][0]['order_id'] == 'a'
+    assert db.session.query(Conversion).count() == 0
+
+
+def test_data_error_marks_chunk_rows_as_errors(client, company, partner, monkeypatch):
+    link = create_link(client, company, partner)
+    calls = []
+
+    def overflowing(chunk, company_id, commissions):
+        calls.append(chunk)
+        raise DataError('INSERT', {}, Exception('numeric field overflow'))
+
+    monkeypatch.setattr(conversion_import, '_ingest_chunk', overflowing)
+    result = upload(client, company, [{'order_id': 'a', 'sale_amount': 500, 'affiliate_link_id': link['id']}])
+    # Без повторов: та же пачка снова не поместится
+    assert len(calls) == 1
+    assert result['errors'] == 1
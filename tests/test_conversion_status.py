@@ -0,0 +1,107 @@
+"""
+Смена статуса конверсий компанией: журнал баланса и суточные агрегаты
+"""
+from sqlalchemy import func
+
+from affiliate_platform.backend import ledger
+from affiliate_platform.backend.models import db, User, DailyStat, LedgerEntry
+
+from conftest import create_link, register
+
+# Комиссия партнёра с продажи 1000 по офферу create_link
+COMMISSION = 80.0
+
+
+def upload(client, company, link, *order_ids):
+    """Pending-конверсии через пакетную загрузку, возвращает их id"""
+    results = client.post('/api/conversions/batch', json=[
+        {'order_id': order_id, 'sale_amount': 1000, 'affiliate_link_id': link['id']} for order_id in order_ids
+    ], headers=company).json['results']
+    return [result['conversion_id'] for result in results]
+
+
+def change(client, company, status, **body):
+    return client.post('/api/conversions/status', json=dict(body, status=status), headers=company)
+
+
+def balance(partner_id):
+    db.session.expire_all()
+    return db.session.get(User, partner_id).balance
+
+
+def amounts():
+    """Комиссии по статусам из daily_stats"""
+    row = db.session.query(
+        func.sum(DailyStat.pending_amount), func.sum(DailyStat.approved_amount),
+        func.sum(DailyStat.rejected_amount), func.sum(DailyStat.paid_amount)
+    ).one()
+    return dict(zip(('pending', 'approved', 'rejected', 'paid'), row))
+
+
+def test_approve_then_paid(client, company, partner):
+    _, link = create_link(client, company, partner)
+    ids = upload(client, company, link, 'o1', 'o2')
+    assert amounts() == {'pending': 2 * COMMISSION, 'approved': 0, 'rejected': 0, 'paid': 0}
+
+    response = change(client, company, 'approved', ids=ids)
+    assert response.json['updated'] == 2
+    assert response.json['from'] == {'pending': {'count': 2, 'commission_amount': 2 * COMMISSION}}
+    assert balance(link['partner_id']) == 2 * COMMISSION
+    assert amounts() == {'pending': 0, 'approved': 2 * COMMISSION, 'rejected': 0, 'paid': 0}
+
+    # paid не меняет баланс: комиссия уже начислена при approved
+    response = change(client, company, 'paid', ids=ids[:1])
+    assert response.json['updated'] == 1
+    assert balance(link['partner_id']) == 2 * COMMISSION
+    assert amounts() == {'pending': 0, 'approved': COMMISSION, 'rejected': 0, 'paid': COMMISSION}
+    assert ledger.check() == []
+
+
+def test_reject_approved_reverses_commission(client, company, partner):
+    _, link = create_link(client, company, partner)
+    ids = upload(client, company, link, 'o1', 'o2')
+    change(client, company, 'approved', ids=ids)
+
+    response = change(client, company, 'rejected', filter={'status': 'approved'})
+    assert response.json['from'] == {'approved': {'count': 2, 'commission_amount': 2 * COMMISSION}}
+    assert balance(link['partner_id']) == 0
+    assert amounts() == {'pending': 0, 'approved': 0, 'rejected': 2 * COMMISSION, 'paid': 0}
+
+    kinds = sorted(kind for (kind,) in db.session.query(LedgerEntry.kind))
+    assert kinds == ['conversion_approved'] * 2 + ['conversion_reversed'] * 2
+    assert ledger.check() == []
+
+
+def test_repeated_and_invalid_transitions(client, company, partner):
+    _, link = create_link(client, company, partner)
+    ids = upload(client, company, link, 'o1')
+    change(client, company, 'approved', ids=ids)
+
+    # Повторное подтверждение не начисляет комиссию второй раз
+    response = change(client, company, 'approved', ids=ids)
+    assert response.json['updated'] == 0 and response.json['skipped'] == 1
+    assert balance(link['partner_id']) == COMMISSION
+
+    # Недопустимые переходы и статусы
+    assert change(client, company, 'pending', ids=ids).status_code == 400
+    assert change(client, company, 'paid', filter={'status': 'pending'}).status_code == 400
+    assert change(client, company, 'approved', ids=[True]).status_code == 400
+
+    # Отклонённую конверсию нельзя снова подтвердить или оплатить
+    change(client, company, 'rejected', ids=ids)
+    assert change(client, company, 'approved', ids=ids).json['updated'] == 0
+    assert change(client, company, 'paid', ids=ids).json['updated'] == 0
+    assert balance(link['partner_id']) == 0
+    assert amounts() == {'pending': 0, 'approved': 0, 'rejected': COMMISSION, 'paid': 0}
+    assert ledger.check() == []
+
+
+def test_other_company_conversions_are_skipped(client, company, partner):
+    _, link = create_link(client, company, partner)
+    ids = upload(client, company, link, 'o1')
+    other = register(client, 'other@example.com', 'company')
+
+    response = change(client, other, 'approved', ids=ids)
+    assert response.json['updated'] == 0 and response.json['skipped'] == 1
+    assert change(client, partner, 'approved', ids=ids).status_code == 403
+    assert balance(link['partner_id']) == 0
@@ -0,0 +1,125 @@
+"""
+Справочники кликов: кодирование, обрезка длинных значений, миграция 5
+"""
+from sqlalchemy import Column, MetaData, Table, func, insert, select, text
+
+from affiliate_platform.backend import dimensions, migrations
+from affiliate_platform.backend.models import db, Click, PackedIP, UserAgent, Referrer, UtmTuple
+from affiliate_platform.backend.serializers import UTM_FIELDS
+from conftest import create_link
+
+COLUMNS = ('click_id', 'ip_address', 'user_agent', 'referrer', *UTM_FIELDS)
+
+
+def click(link, i, **values):
+    return {
+        'affiliate_link_id': link['id'], 'partner_id': link['partner_id'], 'offer_id': link['offer_id'],
+        'click_id': f'c{i}', **values
+    }
+
+
+def count(model):
+    return db.session.scalar(select(func.count()).select_from(model))
+
+
+def decoded(table):
+    rows = db.session.execute(dimensions.select_columns(table, *COLUMNS).order_by(table.c.click_id))
+    return {row.click_id: row._asdict() for row in rows}
+
+
+def test_encode_reuses_dimension_rows(client, company, partner):
+    _, link = create_link(client, company, partner)
+    rows = [
+        click(link, 0, ip_address='10.0.0.1', user_agent='Mozilla/5.0', referrer='https://a.example',
+              utm_source='vk', utm_campaign='spring'),
+        click(link, 1, ip_address='2001:db8::1', user_agent='Mozilla/5.0', utm_source='vk', utm_campaign='spring'),
+        click(link, 2, user_agent='curl/8.0', referrer='https://a.example')
+    ]
+    db.session.execute(insert(Click), dimensions.encode_clicks(rows))
+    db.session.commit()
+
+    # Второй пачкой те же значения новых строк в справочниках не добавляют
+    db.session.execute(insert(Click), dimensions.encode_clicks([click(link, 3, user_agent='curl/8.0')]))
+    db.session.commit()
+
+    assert (count(UserAgent), count(Referrer), count(UtmTuple)) == (2, 1, 1)
+
+    clicks = decoded(Click.__table__)
+    assert clicks['c0'] == {
+        'click_id': 'c0', 'ip_address': '10.0.0.1', 'user_agent': 'Mozilla/5.0', 'referrer': 'https://a.example',
+        'utm_source': 'vk', 'utm_medium': None, 'utm_campaign': 'spring', 'utm_content': None, 'utm_term': None
+    }
+    assert clicks['c1']['ip_address'] == '2001:db8::1'
+    # Клик без меток - без набора UTM, пустые поля читаются как NULL
+    assert clicks['c2']['utm_source'] is None and clicks['c2']['referrer'] == 'https://a.example'
+    assert clicks['c3']['user_agent'] == 'curl/8.0' and clicks['c3']['ip_address'] is None
+
+
+def test_clip_truncates_to_column_length():
+    row = {'user_agent': 'M' * 600, 'utm_source': 's' * 150, 'referrer': None, 'partner_id': 1}
+    clipped = dimensions.clip(row)
+    assert clipped == {'user_agent': 'M' * 500, 'utm_source': 's' * 100, 'referrer': None, 'partner_id': 1}
+
+    # Короткие значения не копируются
+    short = {'user_agent': 'Mozilla/5.0'}
+    assert dimensions.clip(short) is short
+
+
+def test_long_user_agent_does_not_drop_batch(client, company, partner):
+    _, link = create_link(client, company, partner)
+    long_agent = 'Mozilla/5.0 ' + 'x' * 1000
+
+    response = client.get(f"/track/{link['tracking_code']}", headers={'User-Agent': long_agent})
+    assert response.status_code == 302
+    client.get(f"/track/{link['tracking_code']}", headers={'User-Agent': 'Mozilla/5.0'})
+
+    # Обрезанное значение - одна строка справочника длиной колонки
+    agents = db.session.scalars(select(UserAgent.value).order_by(UserAgent.id)).all()
+    assert [len(value) for value in agents] == [500, len('Mozilla/5.0')]
+    assert count(Click) == 2
+
+    stats = client.get('/api/stats/partner', headers=partner).json
+    assert stats['total_clicks'] == 2
+
+
+def test_migration_encodes_legacy_click_table(client, company, partner):
+    _, link = create_link(client, company, partner)
+    db.session.execute(insert(UserAgent), [{'value': 'Mozilla/5.0'}])
+
+    # Таблица кликов в формате до миграции 5: строки вместо id справочников
+    utm = ', '.join(f'{field} VARCHAR(200)' for field in UTM_FIELDS)
+    db.session.execute(text(
+        "CREATE TABLE legacy_clicks (id INTEGER PRIMARY KEY, affiliate_link_id INTEGER, partner_id INTEGER, "
+        "offer_id INTEGER, click_id VARCHAR(32), ip_address VARCHAR(50), user_agent VARCHAR(500), "
+        f"referrer VARCHAR(500), {utm}, clicked_at TIMESTAMP, is_duplicate BOOLEAN)"
+    ))
+    legacy = Table('legacy_clicks', MetaData(), autoload_with=db.session.connection())
+    db.session.execute(insert(legacy), [
+        {'id': 1, **click(link, 0, ip_address='10.0.0.1', user_agent='Mozilla/5.0', referrer='',
+                          utm_source='vk', utm_medium='', utm_campaign='spring', utm_content=None, utm_term=None)},
+        {'id': 2, **click(link, 1, ip_address='::1', user_agent='curl/8.0', referrer='https://a.example',
+                          utm_source='vk', utm_medium=None, utm_campaign='spring', utm_content='', utm_term='')},
+        {'id': 3, **click(link, 2, ip_address=None, user_agent='', referrer=None,
+                          **dict.fromkeys(UTM_FIELDS))}
+    ])
+
+    migrations._encode_click_table(db.session.connection(), 'legacy_clicks')
+    db.session.commit()
+
+    encoded = Table(
+        'legacy_clicks', MetaData(), Column('ip_address', PackedIP()), autoload_with=db.session.connection()
+    )
+    assert 'user_agent' not in encoded.c and 'utm_id' in encoded.c
+    # Имеющееся значение справочника переиспользовано, UTM двух кликов - один набор
+    assert (count(UserAgent), count(Referrer), count(UtmTuple)) == (2, 1, 1)
+
+    clicks = decoded(encoded)
+    assert clicks['c0'] == {
+        'click_id': 'c0', 'ip_address': '10.0.0.1', 'user_agent': 'Mozilla/5.0', 'referrer': None,
+        'utm_source': 'vk', 'utm_medium': None, 'utm_campaign': 'spring', 'utm_content': None, 'utm_term': None
+    }
+    assert (clicks['c1']['ip_address'], clicks['c1']['referrer']) == ('::1', 'https://a.example')
+    assert clicks['c2']['user_agent'] is None and clicks['c2']['utm_source'] is None
+
+    # Повторный запуск по уже переведённой таблице ничего не делает
+    migrations._encode_click_table(db.session.connection(), 'legacy_clicks')
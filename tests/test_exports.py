@@ -0,0 +1,144 @@
+"""
+Выгрузка кликов и конверсий: содержимое, фильтры, NDJSON и CSV в gzip
+"""
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import insert
+
+from affiliate_platform.backend import dimensions, exports, partitions
+from affiliate_platform.backend.models import db, Click, Conversion
+from conftest import create_link, register
+
+OLD = datetime(2026, 1, 20, 10, 0)
+NEW = datetime(2026, 3, 5, 10, 0)
+
+
+def create_utm_link(client, company, partner, **utm):
+    offer = client.post('/api/offers', json={
+        'title': 'Вебинар', 'price': 500, 'commission_percent': 10
+    }, headers=company).json['offer']
+    return client.post('/api/affiliate-links', json={'offer_id': offer['id'], **utm}, headers=partner).json['link']
+
+
+def add_click(link, click_id, clicked_at, **values):
+    db.session.execute(insert(Click), dimensions.encode_clicks([{
+        'affiliate_link_id': link['id'], 'partner_id': link['partner_id'], 'offer_id': link['offer_id'],
+        'click_id': click_id, 'ip_address': '10.0.0.1', 'clicked_at': clicked_at, **values
+    }]))
+
+
+def add_conversion(link, order_id, created_at):
+    db.session.execute(insert(Conversion), [{
+        'affiliate_link_id': link['id'], 'partner_id': link['partner_id'], 'offer_id': link['offer_id'],
+        'order_id': order_id, 'sale_amount': 1000, 'commission_amount': 80, 'platform_fee': 20,
+        'status': 'pending', 'created_at': created_at
+    }])
+
+
+@pytest.fixture
+def links(client, company, partner):
+    """Ссылки партнёра: без меток (архивные клики) и с метками telegram/spring
+
+    Плюс ссылка другой компании, которая не должна попадать в выгрузку company.
+    """
+    _, plain = create_link(client, company, partner)
+    tagged = create_utm_link(client, company, partner, utm_source='telegram', utm_campaign='spring')
+    other_company = register(client, 'company2@example.com', 'company')
+    foreign = create_utm_link(client, other_company, partner, utm_source='telegram')
+
+    add_click(plain, 'old', OLD, user_agent='=HYPERLINK("x")', referrer='https://a.example')
+    add_click(tagged, 'new', NEW, user_agent='Mozilla/5.0', utm_source='telegram', utm_campaign='spring')
+    add_click(foreign, 'foreign', NEW, utm_source='telegram')
+    add_conversion(plain, 'o-old', OLD)
+    add_conversion(tagged, 'o-new', NEW)
+    add_conversion(foreign, 'o-foreign', NEW)
+    db.session.commit()
+
+    # Январские клики уходят в архивную партицию
+    partitions.rollover(today=date(2026, 3, 15))
+    return plain, tagged, foreign
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def gzip_csv(response):
+    return list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+
+
+def test_partner_clicks_ndjson(client, partner, links):
+    plain, tagged, _ = links
+    response = client.get('/api/export/clicks', query_string={'format': 'ndjson'}, headers=partner)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Cache-Control'] == 'no-store'
+
+    # Архивная партиция первой, затем горячая таблица
+    rows = ndjson(response)
+    assert [row['click_id'] for row in rows] == ['old', 'new', 'foreign']
+
+    old, new, _ = rows
+    assert old['affiliate_link_id'] == plain['id'] and old['clicked_at'] == OLD.isoformat()
+    assert (old['ip_address'], old['referrer'], old['is_duplicate']) == ('10.0.0.1', 'https://a.example', False)
+    # UTM в NDJSON - только непустые
+    assert not set(old) & set(exports.UTM_FIELDS)
+    assert (new['utm_source'], new['utm_campaign']) == ('telegram', 'spring')
+    assert 'utm_medium' not in new
+
+
+def test_company_clicks_gzip_csv_with_filters(client, company, links):
+    response = client.get('/api/export/clicks', query_string={'gzip': '1'}, headers=company)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    assert response.headers['Content-Disposition'].endswith('.csv.gz')
+
+    rows = gzip_csv(response)
+    # Клики по офферам другой компании не выгружаются
+    assert [row['click_id'] for row in rows] == ['old', 'new']
+    assert list(rows[0]) == list(exports.CLICK_FIELDS)
+    # Значение от посетителя не становится формулой
+    assert rows[0]['user_agent'] == '\'=HYPERLINK("x")'
+    assert (rows[0]['is_duplicate'], rows[0]['utm_source']) == ('false', '')
+
+    response = client.get('/api/export/clicks', query_string={
+        'gzip': 'true', 'date_from': '2026-03-01', 'utm_source': 'telegram', 'utm_campaign': 'spring'
+    }, headers=company)
+    assert [row['click_id'] for row in gzip_csv(response)] == ['new']
+
+    response = client.get('/api/export/clicks', query_string={'gzip': '1', 'date_to': '2026-01-31'}, headers=company)
+    assert [row['click_id'] for row in gzip_csv(response)] == ['old']
+
+
+def test_conversions_filters(client, company, partner, links):
+    response = client.get('/api/export/conversions', query_string={'format': 'ndjson'}, headers=partner)
+    rows = ndjson(response)
+    assert [row['order_id'] for row in rows] == ['o-old', 'o-new', 'o-foreign']
+    assert rows[1]['sale_amount'] == 1000 and rows[1]['status'] == 'pending'
+    # UTM конверсии - из её ссылки
+    assert (rows[1]['utm_source'], rows[1]['utm_campaign']) == ('telegram', 'spring')
+
+    response = client.get('/api/export/conversions', query_string={
+        'format': 'ndjson', 'utm_source': 'telegram'
+    }, headers=company)
+    assert [row['order_id'] for row in ndjson(response)] == ['o-new']
+
+    response = client.get('/api/export/conversions', query_string={
+        'gzip': '1', 'date_from': '2026-01-01', 'date_to': '2026-01-31'
+    }, headers=company)
+    rows = gzip_csv(response)
+    assert [row['order_id'] for row in rows] == ['o-old']
+    assert list(rows[0]) == list(exports.CONVERSION_FIELDS + exports.UTM_FIELDS)
+
+
+def test_export_rejects_bad_arguments(client, partner):
+    assert client.get('/api/export/clicks', query_string={'format': 'xml'}, headers=partner).status_code == 400
+    assert client.get('/api/export/clicks', query_string={
+        'date_from': '2026-02-01', 'date_to': '2026-01-01'
+    }, headers=partner).status_code == 400
+    assert client.get('/api/export/clicks').status_code == 401
@@ -0,0 +1,117 @@
+"""
+Журнал баланса: начисления, выплаты и сверка User.balance с журналом
+"""
+import threading
+from datetime import timedelta
+
+from sqlalchemy import insert, text, update
+
+from affiliate_platform.backend import ledger, migrations
+from affiliate_platform.backend.models import db, utcnow, User, Conversion, LedgerEntry
+
+from conftest import create_link
+
+
+def earn(link, *commissions, days_ago=30):
+    """Pending-конверсии старше холда, затем settle начисляет их комиссии"""
+    db.session.execute(insert(Conversion), [{
+        'affiliate_link_id': link['id'], 'partner_id': link['partner_id'], 'offer_id': link['offer_id'],
+        'sale_amount': 1000, 'commission_amount': commission, 'platform_fee': 0, 'status': 'pending',
+        'created_at': utcnow() - timedelta(days=days_ago)
+    } for commission in commissions])
+    db.session.commit()
+    return ledger.settle(hold_days=14)
+
+
+def balance(partner_id):
+    db.session.expire_all()
+    return db.session.get(User, partner_id).balance
+
+
+def test_settle_credits_balance(client, company, partner):
+    _, link = create_link(client, company, partner)
+    assert earn(link, 100, 50) == (2, 150)
+    # Свежая конверсия ещё на холде
+    assert earn(link, 70, days_ago=1) == (0, 0)
+
+    assert balance(link['partner_id']) == 150
+    entries = client.get('/api/ledger', headers=partner).json['items']
+    assert sorted(entry['amount'] for entry in entries) == [50, 100]
+    assert ledger.check() == []
+
+
+def test_payout_with_insufficient_balance(client, company, partner):
+    _, link = create_link(client, company, partner)
+    earn(link, 100)
+
+    response = client.post('/api/payouts', json={'amount': 100.01}, headers=partner)
+    assert response.status_code == 400
+    assert balance(link['partner_id']) == 100
+    assert client.get('/api/payouts', headers=partner).json['items'] == []
+
+    response = client.post('/api/payouts', json={'amount': 60}, headers=partner)
+    assert response.status_code == 201
+    assert balance(link['partner_id']) == 40
+    assert ledger.check() == []
+
+
+def test_concurrent_payouts_on_one_balance(app, client, company, partner):
+    _, link = create_link(client, company, partner)
+    earn(link, 100)
+
+    barrier = threading.Barrier(2)
+    statuses = []
+
+    def request_payout():
+        barrier.wait()
+        response = app.test_client().post('/api/payouts', json={'amount': 100}, headers=partner)
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=request_payout) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [201, 400]
+    assert balance(link['partner_id']) == 0
+    assert len(client.get('/api/payouts', headers=partner).json['items']) == 1
+    assert ledger.check() == []
+
+
+def test_failed_payout_returns_amount(client, company, partner):
+    _, link = create_link(client, company, partner)
+    earn(link, 100)
+    payout = client.post('/api/payouts', json={'amount': 80}, headers=partner).json['payout']
+
+    assert ledger.close_payout(payout['id'], 'failed')
+    db.session.commit()
+    # Завершённую выплату второй раз не закрыть - возврата дважды не будет
+    assert not ledger.close_payout(payout['id'], 'failed')
+    db.session.commit()
+
+    assert balance(link['partner_id']) == 100
+    kinds = [entry['kind'] for entry in client.get('/api/ledger', headers=partner).json['items']]
+    assert kinds == ['payout_failed', 'payout_requested', 'conversion_approved']
+    assert ledger.check() == []
+
+
+def test_opening_balances_match_old_balance(client, company, partner):
+    _, link = create_link(client, company, partner)
+    other = client.post('/api/register', json={
+        'email': 'other@example.com', 'password': 'pw123456', 'user_type': 'partner'
+    }).json['user']
+
+    # База до журнала: балансы есть, записей нет, миграция 6 не применялась
+    db.session.execute(update(User).where(User.id == link['partner_id']).values(balance=1234.56))
+    db.session.execute(update(User).where(User.id == other['id']).values(balance=0))
+    db.session.execute(text('DELETE FROM ledger_entries'))
+    db.session.execute(text('DELETE FROM schema_migrations WHERE version >= 6'))
+    db.session.commit()
+    assert ledger.check() == [(link['partner_id'], 1234.56, 0)]
+
+    assert 6 in migrations.upgrade()
+
+    entries = db.session.query(LedgerEntry.partner_id, LedgerEntry.kind, LedgerEntry.amount).all()
+    assert entries == [(link['partner_id'], 'opening_balance', 1234.56)]
+    assert ledger.check() == []
@@ -0,0 +1,165 @@
+"""
+Очередь писем: отправка через локальный SMTP-сервер, повторы и два отправителя
+"""
+import email
+import email.policy
+import socketserver
+import threading
+from datetime import timedelta
+
+import pytest
+
+from affiliate_platform.backend.app import mail_outbox
+from affiliate_platform.backend.mail_outbox import MailOutbox
+from affiliate_platform.backend.models import db, utcnow, EmailOutbox
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP: EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost ESMTP test')
+
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif command in ('MAIL', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline().decode()
+                    if data.rstrip('\r\n') == '.':
+                        break
+                    lines.append(data)
+                with server.lock:
+                    # Заданный тестом ответ на очередное письмо (по умолчанию 250)
+                    response = server.responses.pop(0) if server.responses else '250 OK'
+                    if response.startswith('250'):
+                        message = email.message_from_string(''.join(lines), policy=email.policy.default)
+                        server.messages.append(message)
+                self.reply(response)
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+@pytest.fixture
+def smtp_server(app):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.messages = []
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+
+    app.config.update(
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=server.server_address[1], MAIL_USE_TLS=False,
+        MAIL_USERNAME=None, MAIL_TIMEOUT=5, MAIL_RETRY_BASE=30
+    )
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def enqueue(count):
+    for i in range(count):
+        mail_outbox.enqueue(f'user{i}@example.com', f'Письмо {i}', f'<p>{i}</p>')
+    db.session.commit()
+
+
+def statuses():
+    db.session.expire_all()
+    return [message.status for message in EmailOutbox.query.order_by(EmailOutbox.id)]
+
+
+def test_flush_delivers_over_one_connection(smtp_server):
+    enqueue(3)
+
+    assert mail_outbox.flush() == 3
+    assert statuses() == ['sent'] * 3
+    assert smtp_server.connections == 1
+    assert [message['To'] for message in smtp_server.messages] == [f'user{i}@example.com' for i in range(3)]
+    assert smtp_server.messages[0]['Subject'] == 'Письмо 0'
+
+    # Отправленные письма повторно не забираются
+    assert mail_outbox.flush() == 0
+
+
+def test_temporary_error_is_retried_with_backoff(smtp_server):
+    enqueue(1)
+    smtp_server.responses = ['451 Try again later']
+
+    assert mail_outbox.flush() == 1
+    message = EmailOutbox.query.one()
+    assert (message.status, message.attempts) == ('pending', 1)
+    assert '451' in message.last_error
+    # Экспоненциальная задержка: первая попытка - MAIL_RETRY_BASE секунд
+    assert message.next_attempt_at > utcnow() + timedelta(seconds=20)
+
+    # До срока письмо не забирается
+    assert mail_outbox.flush() == 0
+
+    message.next_attempt_at = utcnow()
+    db.session.commit()
+    assert mail_outbox.flush() == 1
+    assert statuses() == ['sent']
+    assert len(smtp_server.messages) == 1
+
+
+def test_permanent_error_fails_message(smtp_server):
+    enqueue(2)
+    smtp_server.responses = ['550 Mailbox unavailable']
+
+    assert mail_outbox.flush() == 2
+    assert statuses() == ['failed', 'sent']
+    assert len(smtp_server.messages) == 1
+
+
+def test_two_flushers_send_each_message_once(app, smtp_server):
+    enqueue(40)
+    app.config['MAIL_OUTBOX_BATCH'] = 5
+
+    # Два воркера: свои экземпляры без подписки на события сессии
+    senders = []
+    for _ in range(2):
+        sender = MailOutbox()
+        sender.app = app
+        senders.append(sender)
+
+    barrier = threading.Barrier(2)
+    processed = []
+
+    def run(sender):
+        barrier.wait()
+        processed.append(sender.flush())
+
+    threads = [threading.Thread(target=run, args=(sender,)) for sender in senders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(processed) == 40
+    assert statuses() == ['sent'] * 40
+    recipients = [message['To'] for message in smtp_server.messages]
+    assert sorted(recipients) == sorted(f'user{i}@example.com' for i in range(40))
@@ -0,0 +1,80 @@
+"""
+Миграции существующей базы: статистика по накопленной истории
+"""
+import fcntl
+import threading
+from datetime import timedelta
+
+from sqlalchemy import insert, text
+
+from affiliate_platform.backend import dimensions, migrations
+from affiliate_platform.backend.models import db, utcnow, AffiliateLink, Click, Conversion
+
+
+def fill_history(client, company, partner):
+    """Клики и конверсии, записанные мимо агрегатов (как до их появления)"""
+    offer = client.post('/api/offers', json={
+        'title': 'Курс', 'price': 1000, 'commission_percent': 10
+    }, headers=company).json['offer']
+    link = client.post('/api/affiliate-links', json={'offer_id': offer['id']}, headers=partner).json['link']
+    link = db.session.get(AffiliateLink, link['id'])
+
+    clicked_at = utcnow() - timedelta(days=3)
+    db.session.execute(insert(Click), dimensions.encode_clicks([{
+        'affiliate_link_id': link.id, 'partner_id': link.partner_id, 'offer_id': link.offer_id,
+        'ip_address': f'10.0.0.{i % 3}', 'user_agent': 'Mozilla/5.0', 'clicked_at': clicked_at
+    } for i in range(6)]))
+    db.session.execute(insert(Conversion), [{
+        'affiliate_link_id': link.id, 'partner_id': link.partner_id, 'offer_id': link.offer_id,
+        'sale_amount': 1000, 'commission_amount': 80, 'platform_fee': 20, 'status': 'pending',
+        'created_at': clicked_at
+    }])
+
+    # Производные таблицы пусты, миграции пересчёта ещё не применялись
+    for table in ('daily_stats', 'visitor_sketches'):
+        db.session.execute(text(f'DELETE FROM {table}'))
+    db.session.execute(text('DELETE FROM schema_migrations WHERE version >= 8'))
+    db.session.commit()
+
+
+def test_upgrade_rebuilds_daily_stats(app, client, company, partner):
+    fill_history(client, company, partner)
+    assert client.get('/api/stats/partner', headers=partner).json['total_clicks'] == 0
+
+    assert 8 in migrations.upgrade()
+
+    stats = client.get('/api/stats/partner', headers=partner).json
+    assert stats['total_clicks'] == 6
+    assert stats['total_conversions'] == 1
+    assert stats['pending_earnings'] == 80
+
+
+def test_upgrade_rebuilds_visitor_sketches(app, client, company, partner):
+    fill_history(client, company, partner)
+    assert client.get('/api/stats/partner', headers=partner).json['unique_clicks'] == 0
+
+    assert 9 in migrations.upgrade()
+
+    # Три разных IP с одним user_agent
+    assert client.get('/api/stats/partner', headers=partner).json['unique_clicks'] == 3
+    assert client.get('/api/stats/company', headers=company).json['unique_clicks'] == 3
+
+
+def test_upgrade_waits_for_lock(app):
+    # Другой процесс применяет миграции: upgrade ждёт его, а не идёт параллельно
+    finished = threading.Event()
+
+    def run():
+        with app.app_context():
+            migrations.upgrade()
+        finished.set()
+
+    with open(app.config['MIGRATIONS_LOCK_FILE'], 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        thread = threading.Thread(target=run)
+        thread.start()
+        assert not finished.wait(0.3)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    thread.join(5)
+    assert finished.is_set()
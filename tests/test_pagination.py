@@ -0,0 +1,72 @@
+"""
+Курсоры постраничной выдачи: подделанный курсор - 400, а не ошибка сервера
+"""
+import base64
+import json
+
+import pytest
+
+from affiliate_platform.backend import pagination
+from affiliate_platform.backend.models import Offer, Payout
+
+FORGED = [['a'], [None], [{'x': 1}], [True], [1.5]]
+
+
+def cursor(values):
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+@pytest.mark.parametrize('values', FORGED)
+def test_decode_rejects_wrong_types(values):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor(values), (Offer.id,))
+
+
+def test_decode_checks_each_column():
+    columns = (Payout.requested_at, Payout.id)
+    values = pagination.decode_cursor(cursor(['2026-01-02T03:04:05', 7]), columns)
+    assert values[0].isoformat() == '2026-01-02T03:04:05' and values[1] == 7
+
+    for values in (['2026-01-02', '7'], [20260102, 7], ['вчера', 7], ['2026-01-02', None]):
+        with pytest.raises(ValueError):
+            pagination.decode_cursor(cursor(values), columns)
+
+
+@pytest.fixture
+def offers(client, company):
+    for i in range(3):
+        client.post('/api/offers', json={
+            'title': f'Курс {i}', 'price': 1000 + i, 'commission_percent': 10
+        }, headers=company)
+
+
+@pytest.mark.parametrize('cached', [True, False])
+@pytest.mark.parametrize('values', FORGED)
+def test_offers_forged_cursor(app, client, offers, cached, values):
+    app.config['CATALOG_CACHE'] = cached
+    response = client.get('/api/offers', query_string={'cursor': cursor(values)})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('sort, values', [
+    ('relevance', ['a', 1]),
+    ('relevance', [None, 1]),
+    ('relevance', [1.0, 'a']),
+    ('price_high', [{'x': 1}, 1]),
+    ('price_high', [1000.0, 1.5]),
+    ('newest', ['a']),
+    ('newest', [None]),
+    ('newest', [1, 2])
+])
+def test_search_forged_cursor(client, offers, sort, values):
+    response = client.get('/api/offers/search', query_string={'q': 'курс', 'sort': sort, 'cursor': cursor(values)})
+    assert response.status_code == 400
+
+
+def test_offers_valid_cursor(app, client, offers):
+    for cached in (True, False):
+        app.config['CATALOG_CACHE'] = cached
+        first = client.get('/api/offers', query_string={'limit': 2}).json
+        rest = client.get('/api/offers', query_string={'limit': 2, 'cursor': first['next_cursor']}).json
+        assert len(first['items']) + len(rest['items']) == 3
@@ -0,0 +1,110 @@
+"""
+Архивные партиции кликов: перенос и чтение на границе месяцев
+"""
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from affiliate_platform.backend import dimensions, partitions, rollups
+from affiliate_platform.backend.app import postback_signature
+from affiliate_platform.backend.models import db, Click, ClickPartition, DailyStat
+from conftest import create_link
+
+# Последняя секунда января, полночь 1 февраля и середина марта
+CLICKED_AT = {
+    'jan': datetime(2026, 1, 31, 23, 59, 59),
+    'feb': datetime(2026, 2, 1, 0, 0, 0),
+    'mar': datetime(2026, 3, 10, 12, 0, 0)
+}
+TODAY = date(2026, 3, 15)
+
+
+def add_clicks(link, **clicked_at):
+    db.session.execute(insert(Click), dimensions.encode_clicks([{
+        'affiliate_link_id': link['id'], 'partner_id': link['partner_id'], 'offer_id': link['offer_id'],
+        'click_id': click_id, 'ip_address': '10.0.0.1', 'user_agent': 'Mozilla/5.0', 'clicked_at': value
+    } for click_id, value in clicked_at.items()]))
+    db.session.commit()
+
+
+def click_ids(date_from=None, date_to=None):
+    clicks = partitions.select_clicks('click_id', date_from=date_from, date_to=date_to)
+    return sorted(db.session.scalars(select(clicks.c.click_id)))
+
+
+@pytest.fixture
+def link(client, company, partner):
+    _, link = create_link(client, company, partner)
+    add_clicks(link, **CLICKED_AT)
+    return link
+
+
+def test_rollover_splits_clicks_at_month_boundary(link):
+    assert partitions.rollover(today=TODAY) == [('clicks_202601', 1), ('clicks_202602', 1)]
+
+    hot = db.session.scalars(select(Click.click_id)).all()
+    assert hot == ['mar']
+    partitions_rows = {
+        partition.name: (partition.period_start, partition.period_end, partition.rows)
+        for partition in ClickPartition.query
+    }
+    assert partitions_rows == {
+        'clicks_202601': (date(2026, 1, 1), date(2026, 2, 1), 1),
+        'clicks_202602': (date(2026, 2, 1), date(2026, 3, 1), 1)
+    }
+
+    # Повторный перенос ничего не делает
+    assert partitions.rollover(today=TODAY) == []
+
+
+def test_select_clicks_routes_period_to_partitions(link):
+    partitions.rollover(today=TODAY)
+
+    assert click_ids() == ['feb', 'jan', 'mar']
+    assert click_ids(date(2026, 1, 31), date(2026, 1, 31)) == ['jan']
+    assert click_ids(date(2026, 2, 1), date(2026, 2, 1)) == ['feb']
+    assert click_ids(date(2026, 1, 31), date(2026, 2, 1)) == ['feb', 'jan']
+    assert click_ids(date_from=date(2026, 2, 2)) == ['mar']
+
+    # Партиции вне периода в запрос не попадают
+    names = [table.name for table in partitions.tables(date(2026, 2, 1), date(2026, 2, 1))]
+    assert names == ['clicks_202602', 'clicks']
+    names = [table.name for table in partitions.tables(date_from=date(2026, 3, 1))]
+    assert names == ['clicks']
+
+
+def test_late_click_is_appended_to_existing_partition(link):
+    partitions.rollover(today=TODAY)
+    add_clicks(link, late=datetime(2026, 1, 15))
+
+    assert partitions.rollover(today=TODAY) == [('clicks_202601', 1)]
+    assert ClickPartition.query.filter_by(name='clicks_202601').one().rows == 2
+    assert click_ids(date(2026, 1, 1), date(2026, 1, 31)) == ['jan', 'late']
+
+
+def test_find_click_and_postback_in_archive(app, client, link):
+    partitions.rollover(today=TODAY)
+
+    row = partitions.find_click('feb', 'partner_id', 'user_agent')
+    assert (row.partner_id, row.user_agent) == (link['partner_id'], 'Mozilla/5.0')
+    assert partitions.find_click('mar', 'id') is None
+
+    # Поздний постбэк по клику из архивной партиции
+    app.config['POSTBACK_SECRET'] = 'test-secret'
+    response = client.get('/postback', query_string={
+        'click_id': 'jan', 'amount': '500', 'signature': postback_signature('jan', '500')
+    })
+    assert response.status_code == 201
+    assert response.json['conversion']['affiliate_link_id'] == link['id']
+
+
+def test_rebuild_counts_archived_clicks(link):
+    partitions.rollover(today=TODAY)
+    rollups.rebuild()
+    db.session.commit()
+
+    days = dict(db.session.execute(
+        select(DailyStat.day, func.sum(DailyStat.clicks)).group_by(DailyStat.day)
+    ).all())
+    assert days == {date(2026, 1, 31): 1, date(2026, 2, 1): 1, date(2026, 3, 10): 1}
@@ -0,0 +1,44 @@
+"""
+Пересчёт хеша пароля при входе: только если параметры хеширования изменились
+"""
+from affiliate_platform.backend.app import password_hasher
+from affiliate_platform.backend.models import db, User
+
+from conftest import register
+
+
+def stored_hash(email):
+    db.session.expire_all()
+    return User.query.filter_by(email=email).one().password_hash
+
+
+def login(client, email):
+    response = client.post('/api/login', json={'email': email, 'password': 'pw123456'})
+    assert response.status_code == 200
+
+
+def test_current_hash_is_not_rehashed(app, client):
+    # Короткое имя метода: werkzeug сохраняет его с параметрами по умолчанию
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+    register(client, 'partner@example.com', 'partner')
+    password_hash = stored_hash('partner@example.com')
+    assert password_hash.startswith('pbkdf2:sha256:')
+    assert not password_hasher.needs_rehash(password_hash)
+
+    rehashed = password_hasher.rehashed
+    login(client, 'partner@example.com')
+    assert password_hasher.rehashed == rehashed
+    assert stored_hash('partner@example.com') == password_hash
+
+
+def test_changed_method_rehashes_once(app, client):
+    register(client, 'partner@example.com', 'partner')
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+
+    rehashed = password_hasher.rehashed
+    login(client, 'partner@example.com')
+    assert password_hasher.rehashed == rehashed + 1
+    assert stored_hash('partner@example.com').startswith('pbkdf2:sha256:2000$')
+
+    login(client, 'partner@example.com')
+    assert password_hasher.rehashed == rehashed + 1
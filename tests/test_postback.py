@@ -0,0 +1,69 @@
+"""
+Постбэк рекламодателя: только подписанные запросы, суммы в пределах NUMERIC(14, 2)
+"""
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from affiliate_platform.backend.app import postback_signature
+from affiliate_platform.backend.models import db, Conversion
+
+
+@pytest.fixture
+def click_id(app, client, company, partner):
+    app.config['POSTBACK_SECRET'] = 'test-secret'
+    offer = client.post('/api/offers', json={
+        'title': 'Курс', 'price': 1000, 'commission_percent': 10, 'product_url': 'https://shop.example/p'
+    }, headers=company).json['offer']
+    link = client.post('/api/affiliate-links', json={'offer_id': offer['id']}, headers=partner).json['link']
+    location = client.get(f"/track/{link['tracking_code']}").location
+    return parse_qs(urlsplit(location).query)['click_id'][0]
+
+
+def signed(click_id, amount='', order_id=''):
+    params = {'click_id': click_id, 'amount': amount, 'order_id': order_id}
+    params = {name: value for name, value in params.items() if value != ''}
+    params['signature'] = postback_signature(click_id, amount, order_id)
+    return params
+
+
+def test_signed_postback_creates_conversion(client, click_id):
+    response = client.get('/postback', query_string=signed(click_id, '500', 'o1'))
+    assert response.status_code == 201
+    assert response.json['conversion']['sale_amount'] == 500
+
+    # Повтор того же order_id - duplicate
+    response = client.post('/postback', json=signed(click_id, '500', 'o1'))
+    assert response.json['status'] == 'duplicate'
+
+
+def test_unsigned_postback_is_rejected(client, click_id):
+    response = client.get('/postback', query_string={'click_id': click_id, 'amount': '500', 'order_id': 'o1'})
+    assert response.status_code == 403
+    assert db.session.query(Conversion).count() == 0
+
+
+def test_forged_postback_is_rejected(client, click_id):
+    # Подпись от другой суммы
+    params = signed(click_id, '500', 'o1')
+    params['amount'] = '1e308'
+    assert client.get('/postback', query_string=params).status_code == 403
+
+    params = signed(click_id, '500', 'o1')
+    params['signature'] = '0' * 64
+    assert client.get('/postback', query_string=params).status_code == 403
+    assert db.session.query(Conversion).count() == 0
+
+
+def test_postback_without_secret_is_rejected(app, client, click_id):
+    params = signed(click_id, '500', 'o1')
+    app.config['POSTBACK_SECRET'] = None
+    assert client.get('/postback', query_string=params).status_code == 403
+    assert db.session.query(Conversion).count() == 0
+
+
+@pytest.mark.parametrize('amount', ['1e308', '1000000000000', '999999999999.999', 'inf', 'nan', '-5'])
+def test_oversized_amount_is_rejected(client, click_id, amount):
+    response = client.get('/postback', query_string=signed(click_id, amount, 'o1'))
+    assert response.status_code == 400
+    assert db.session.query(Conversion).count() == 0
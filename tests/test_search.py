@@ -0,0 +1,94 @@
+"""
+Поиск офферов: русские окончания, фасеты по категориям, ранжирование
+"""
+import pytest
+
+from affiliate_platform.backend import search
+from affiliate_platform.backend.models import db
+
+OFFERS = [
+    ('Курс программирования на Python', 'С нуля до первой работы', 'Программирование', 3000, 20),
+    ('Курсы английского языка', 'Разговорный английский', 'Языки', 1500, 15),
+    ('Интенсив по дизайну', 'Для тех, кто пишет на Python', 'Дизайн', 2000, 10),
+    ('Вебинар: Python для аналитиков', 'Pandas и графики', 'Программирование', 500, 30),
+    ('Курсы немецкого', 'Архив', 'Языки', 1000, 10)
+]
+
+
+@pytest.fixture
+def offers(client, company):
+    ids = []
+    for title, description, category, price, commission in OFFERS:
+        offer = client.post('/api/offers', json={
+            'title': title, 'description': description, 'category': category,
+            'price': price, 'commission_percent': commission
+        }, headers=company).json['offer']
+        ids.append(offer['id'])
+
+    # Неактивный оффер не ищется и не считается в фасетах
+    client.put(f'/api/offers/{ids[-1]}', json={'is_active': False}, headers=company)
+
+    if not search.fts_available() and db.engine.dialect.name == 'sqlite':
+        pytest.skip('SQLite без FTS5: LIKE не сравнивает кириллицу без учёта регистра')
+    return ids
+
+
+def find(client, **args):
+    response = client.get('/api/offers/search', query_string=args)
+    assert response.status_code == 200
+    return response.json
+
+
+def titles(body):
+    return sorted(item['title'] for item in body['items'])
+
+
+def test_stem_drops_russian_endings():
+    assert search.terms('Курсов программированию') == ['курс', 'программирован']
+    assert search.terms('курсы Python ё') == ['курс', 'python']
+    # Основа не короче MIN_STEM: короткие слова не обрезаются
+    assert search.stem('язык') == 'язык' and search.stem('ежи') == 'ежи'
+    assert search.normalize('Ёлка') == 'елка'
+
+
+def test_word_forms_find_same_offers_with_facets(client, offers):
+    for q in ('курс', 'курсы', 'Курсов', 'курсами'):
+        body = find(client, q=q)
+        assert titles(body) == ['Курс программирования на Python', 'Курсы английского языка']
+        assert body['facets'] == {'Программирование': 1, 'Языки': 1}
+        assert body['total'] == 2
+
+    # Категория индексируется вместе с названием и описанием
+    body = find(client, q='программированию')
+    assert titles(body) == ['Вебинар: Python для аналитиков', 'Курс программирования на Python']
+    assert body['facets'] == {'Программирование': 2}
+
+
+def test_facets_ignore_category_filter(client, offers):
+    body = find(client, q='python')
+    assert body['facets'] == {'Дизайн': 1, 'Программирование': 2}
+    assert body['total'] == 3
+
+    body = find(client, q='python', category='Программирование')
+    assert titles(body) == ['Вебинар: Python для аналитиков', 'Курс программирования на Python']
+    # Фасеты - без фильтра category, total - с ним
+    assert body['facets'] == {'Дизайн': 1, 'Программирование': 2}
+    assert body['total'] == 2
+
+    body = find(client, q='python', min_commission=20)
+    assert body['facets'] == {'Программирование': 2}
+
+    body = find(client, q='языков')
+    assert body['facets'] == {'Языки': 1} and body['total'] == 1
+
+
+def test_title_match_ranks_above_description(client, offers):
+    if not search.fts_available():
+        pytest.skip('Ранжирование bm25 есть только в FTS5')
+
+    body = find(client, q='python', limit=2)
+    # Совпадение в описании весит меньше, чем в названии
+    assert 'Интенсив по дизайну' not in [item['title'] for item in body['items']]
+    rest = find(client, q='python', limit=2, cursor=body['next_cursor'])
+    assert [item['title'] for item in rest['items']] == ['Интенсив по дизайну']
+    assert rest['next_cursor'] is None
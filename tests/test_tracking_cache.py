@@ -0,0 +1,45 @@
+"""
+Кеш tracking_code: сброс во всех воркерах через общий счётчик
+"""
+from sqlalchemy import update
+
+from affiliate_platform.backend.app import tracking_cache
+from affiliate_platform.backend.models import db, Offer
+from affiliate_platform.backend.shared_counter import SharedCounter
+
+
+def create_link(client, company, partner):
+    offer = client.post('/api/offers', json={
+        'title': 'Курс', 'price': 1000, 'commission_percent': 10, 'product_url': 'https://shop.example/p'
+    }, headers=company).json['offer']
+    link = client.post('/api/affiliate-links', json={'offer_id': offer['id']}, headers=partner).json['link']
+    return offer, link
+
+
+def test_change_in_other_worker_invalidates_cache(app, client, company, partner):
+    offer, link = create_link(client, company, partner)
+    assert client.get(f"/track/{link['tracking_code']}").location.startswith('https://shop.example/p')
+    assert tracking_cache.get(link['tracking_code']) is not None
+
+    # Другой воркер деактивировал оффер и увеличил общий счётчик
+    db.session.execute(update(Offer).where(Offer.id == offer['id']).values(is_active=False))
+    db.session.commit()
+    SharedCounter(app.config['TRACKING_VERSION_FILE']).bump()
+
+    response = client.get(f"/track/{link['tracking_code']}")
+    assert not response.location.startswith('https://shop.example')
+
+
+def test_deactivation_bumps_shared_counter(app, client, company, partner):
+    offer, link = create_link(client, company, partner)
+    client.get(f"/track/{link['tracking_code']}")
+
+    counter = SharedCounter(app.config['TRACKING_VERSION_FILE'])
+    before = counter.current()
+    client.put(f"/api/offers/{offer['id']}", json={'is_active': False}, headers=company)
+    assert counter.current() != before
+
+    # Создание оффера кеш ссылок не затрагивает
+    before = counter.current()
+    client.post('/api/offers', json={'title': 'Другой', 'price': 1, 'commission_percent': 1}, headers=company)
+    assert counter.current() == before
@@ -7,12 +7,13 @@ import sys
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.dirname(__file__))
 
-from affiliate_platform.backend.app import app, db
+from affiliate_platform.backend.app import app
+from affiliate_platform.backend import migrations
 
-# Инициализация базы данных при первом запуске
-with app.app_context():
-    db.create_all()
-    print("✓ База данных инициализирована")
+# Миграции применяются до запуска воркеров (start.sh: flask db-upgrade),
+# а не при импорте: иначе их запускал бы каждый воркер gunicorn
 
 if __name__ == "__main__":
+    with app.app_context():
+        migrations.upgrade()
     app.run()